@@ -0,0 +1,114 @@
+import os
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 30))
+
+MISSING = object()
+
+
+class UserCache:
+    """
+    LRU-кэш с TTL для списков пользователя (задачи, привычки).
+
+    Ключ - кортеж, второй элемент которого user_id: ("tasks", user_id, date).
+    Запись функциями из app/database.py вызывает invalidate_user(): удаляются все
+    ключи пользователя и увеличивается его версия. Чтение, начатое до записи, не
+    положит устаревший результат - set() сверяет версию, взятую перед запросом в БД.
+    TTL ограничивает устаревание, если данные меняет другой процесс (реплика).
+
+    Версии берутся из общего счетчика и хранятся не больше чем для max_entries
+    пользователей (дольше всех не менявшиеся вытесняются). Пользователь без
+    записи получает версию _floor - наибольшую из вытесненных, поэтому чтение,
+    начатое до вытеснения, все равно не пройдет проверку в set().
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._user_keys = {}         # user_id -> set(keys)
+        self._versions = OrderedDict()  # user_id -> значение _clock при последней записи
+        self._clock = 0
+        self._floor = 0              # версия пользователей, вытесненных из _versions
+        self._epoch = 0              # растет при clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def version(self, user_id):
+        return self._epoch, self._versions.get(user_id, self._floor)
+
+    def set(self, key, value, version):
+        user_id = key[1]
+        if self.version(user_id) != version:
+            return  # пока читали из БД, данные пользователя изменились
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        self._user_keys.setdefault(user_id, set()).add(key)
+        while len(self._data) > self.max_entries:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        if user_id is None:
+            return
+        self._clock += 1
+        self._versions[user_id] = self._clock
+        self._versions.move_to_end(user_id)
+        while len(self._versions) > self.max_entries:
+            _, self._floor = self._versions.popitem(last=False)
+        for key in self._user_keys.pop(user_id, ()):
+            self._data.pop(key, None)
+        self.invalidations += 1
+
+    def clear(self):
+        """Сброс всего кэша (массовые изменения: ночной пересчет и т.п.)."""
+        self._epoch += 1
+        self._data.clear()
+        self._user_keys.clear()
+        self.invalidations += 1
+
+    def _remove(self, key):
+        self._data.pop(key, None)
+        keys = self._user_keys.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[1]]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+user_cache = UserCache()
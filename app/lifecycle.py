@@ -0,0 +1,146 @@
+"""
+Жизненный цикл процесса: шаги запуска с повтором и таймингами, готовность
+(readiness) отдельно от живости (liveness), согласованная остановка.
+
+run.py сначала поднимает HTTP-сервер - GET /health отвечает сразу после bind,
+и проверка Railway не падает, пока база медленно просыпается. Хранилище,
+миграции и бот инициализируются в фоне через lifecycle.step: ошибка шага
+повторяется с экспоненциальной задержкой. GET /health/ready отдает 200 только
+после mark_ready() (хранилище открыто, схема актуальна), до этого API отвечает 503.
+
+Фоновые задачи запускаются через lifecycle.spawn. По SIGTERM request_stop()
+снимает готовность и выставляет stopping: задачи перестают брать новую работу
+(их паузы - lifecycle.sleep/lifecycle.wait - прерываются сразу), текущую
+доделывают, а drain() ждет их до общего срока SHUTDOWN_TIMEOUT_SECONDS и
+отменяет оставшиеся.
+"""
+import asyncio
+import logging
+import os
+import time
+
+STARTUP_RETRY_BASE_SECONDS = float(os.getenv("STARTUP_RETRY_BASE_SECONDS", 1))
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", 30))
+# Срок остановки от SIGTERM: HTTP-запросы, пачки уведомлений и транзакции доделываются
+# в его пределах. Должен быть меньше паузы платформы перед SIGKILL
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", 20))
+
+
+class Lifecycle:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ready = False
+        self.steps = {}  # имя шага -> статус, попытки, длительность, последняя ошибка
+        self.stopping = asyncio.Event()
+        self.stop_requested_at = None
+        self._tasks = {}
+
+    def uptime(self):
+        return time.perf_counter() - self.started
+
+    def record(self, name, seconds):
+        """Учитывает шаг, уже выполненный без step() (например, импорты)."""
+        self.steps[name] = {"status": "done", "attempts": 1, "seconds": round(seconds, 3), "error": None}
+
+    async def step(self, name, func, retry=True):
+        """
+        Выполняет шаг func() (функция или корутинная функция). При ошибке и retry
+        повторяет через 1, 2, 4... сек (не больше STARTUP_RETRY_MAX_SECONDS),
+        без retry - отмечает шаг failed и пробрасывает ошибку.
+        """
+        state = self.steps[name] = {"status": "running", "attempts": 0, "seconds": None, "error": None}
+        started = time.perf_counter()
+        delay = STARTUP_RETRY_BASE_SECONDS
+        while True:
+            state["attempts"] += 1
+            try:
+                result = func()
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except Exception as e:
+                state["error"] = f"{type(e).__name__}: {e}"
+                if not retry:
+                    state.update(status="failed", seconds=round(time.perf_counter() - started, 3))
+                    raise
+                logging.warning(f"Запуск, шаг {name}: попытка {state['attempts']} не удалась ({e}), "
+                                f"повтор через {delay:g} c")
+                if await self.sleep(delay):
+                    state["status"] = "stopped"
+                    raise RuntimeError(f"шаг {name} прерван остановкой") from e
+                delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+                continue
+            state.update(status="done", seconds=round(time.perf_counter() - started, 3))
+            logging.info(f"Запуск, шаг {name}: {state['seconds']:.3f} c (попыток: {state['attempts']})")
+            return result
+
+    def breakdown(self):
+        return ", ".join(f"{name}: {s['seconds']:.3f} c" for name, s in self.steps.items() if s["status"] == "done")
+
+    def mark_ready(self):
+        self.ready = True
+        logging.info(f"Готов принимать запросы через {self.uptime():.3f} c после старта [{self.breakdown()}]")
+
+    def snapshot(self):
+        """Для /health/ready: при остановке готовность снимается, чтобы балансировщик увел трафик."""
+        return {"ready": self.ready and not self.stopping.is_set(), "stopping": self.stopping.is_set(),
+                "uptime_seconds": round(self.uptime(), 3), "steps": self.steps}
+
+    # ---------- фоновые задачи и остановка ----------
+
+    def spawn(self, name, coro):
+        """Запускает фоновую задачу, которую drain() дождется при остановке."""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[name] = task
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Фоновая задача {task.get_name()} завершилась с ошибкой: {task.exception()}")
+
+    async def sleep(self, seconds):
+        """Пауза на seconds или до начала остановки. True - пора останавливаться."""
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=max(seconds, 0))
+        except asyncio.TimeoutError:
+            pass
+        return self.stopping.is_set()
+
+    async def wait(self, aw):
+        """Ждет aw, но не дольше начала остановки (тогда aw отменяется и возвращается None)."""
+        work = asyncio.ensure_future(aw)
+        stop = asyncio.ensure_future(self.stopping.wait())
+        try:
+            await asyncio.wait({work, stop}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+            if not work.done():
+                work.cancel()
+        return work.result() if work.done() and not work.cancelled() else None
+
+    def request_stop(self):
+        """Начало остановки: задачи перестают брать новую работу."""
+        if self.stopping.is_set():
+            return
+        self.stop_requested_at = time.perf_counter()
+        self.stopping.set()
+
+    def remaining(self):
+        """Сколько секунд осталось до срока остановки."""
+        if self.stop_requested_at is None:
+            return SHUTDOWN_TIMEOUT_SECONDS
+        return max(SHUTDOWN_TIMEOUT_SECONDS - (time.perf_counter() - self.stop_requested_at), 0)
+
+    async def drain(self):
+        """Ждет фоновые задачи до срока остановки, оставшиеся отменяет. Возвращает имена отмененных."""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if not tasks:
+            return []
+        _, pending = await asyncio.wait(tasks, timeout=self.remaining())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return sorted(task.get_name() for task in pending)
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,116 @@
+"""
+Метрики Prometheus, отдаются через GET /metrics (app/myapi.py).
+
+Гистограммы и счетчики пополняются на горячих путях: HTTP-маршруты (middleware),
+функции app/database.py (@db_timed), обработка апдейтов бота (BotMetricsMiddleware),
+рассылка уведомлений и ночные задачи. Загрузку пула и глубину очереди уведомлений
+дешевле снять в момент опроса - их выставляют collect_*.
+"""
+import time
+from functools import wraps
+
+from aiogram import BaseMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Длинные операции (ночной пересчет, архивация) - секунды и минуты
+SLOW_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Задержка уведомления от scheduled_time
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ["method", "route", "status"])
+
+DB_CALL_SECONDS = Histogram(
+    "db_call_duration_seconds", "Время функций app/database.py (с учетом кэша и ожидания пула)", ["function"])
+DB_CALL_ERRORS = Counter("db_call_errors_total", "Исключения в функциях app/database.py", ["function"])
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Соединения пула по состоянию", ["state"])
+DB_POOL_WAITING = Gauge("db_pool_requests_waiting", "Запросы, ждущие свободного соединения")
+
+BOT_UPDATE_SECONDS = Histogram("bot_update_duration_seconds", "Время обработки апдейта бота", ["event_type"])
+BOT_UPDATE_ERRORS = Counter("bot_update_errors_total", "Исключения при обработке апдейтов", ["event_type"])
+
+WEBHOOK_PENDING = Gauge("bot_webhook_pending_updates", "Принятые вебхуком апдейты, еще не обработанные")
+WEBHOOK_REJECTED = Counter("bot_webhook_rejected_total", "Апдейты, отклоненные с 503 из-за переполнения очереди")
+
+NOTIFY_SENT = Counter("notifications_sent_total", "Отправленные уведомления")
+NOTIFY_FAILED = Counter("notifications_failed_total", "Неудачные отправки", ["kind"])  # permanent / transient
+NOTIFY_RETRY_AFTER = Counter("notifications_retry_after_total", "Ответы RetryAfter от Telegram")
+NOTIFY_SEND_SECONDS = Histogram("notification_send_duration_seconds", "Время вызова Bot API")
+NOTIFY_LAG_SECONDS = Histogram(
+    "notification_lag_seconds", "Задержка отправки относительно scheduled_time", buckets=LAG_BUCKETS)
+NOTIFY_QUEUE_DEPTH = Gauge("notification_queue_depth", "Уведомления в очереди", ["status"])
+NOTIFY_QUEUE_DUE = Gauge("notification_queue_due", "Наступившие, но еще не отправленные уведомления")
+NOTIFY_QUEUE_OLDEST_DUE = Gauge(
+    "notification_queue_oldest_due_seconds", "Сколько ждет самое старое наступившее уведомление")
+
+ROLLOVER_PHASE_SECONDS = Histogram(
+    "rollover_phase_duration_seconds", "Длительность фаз ночного пересчета", ["phase"], buckets=SLOW_BUCKETS)
+ROLLOVER_PHASE_ROWS = Counter("rollover_phase_rows_total", "Строки, обработанные фазами пересчета", ["phase"])
+ARCHIVE_ROWS = Counter("archive_rows_total", "Строки, перенесенные в таблицы истории", ["table"])
+ARCHIVE_SECONDS = Histogram(
+    "archive_duration_seconds", "Длительность архивации по таблицам", ["table"], buckets=SLOW_BUCKETS)
+
+
+def db_timed(func):
+    """Декоратор async-функции БД: гистограмма времени и счетчик ошибок по имени функции."""
+    name = func.__name__
+    seconds = DB_CALL_SECONDS.labels(name)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_CALL_ERRORS.labels(name).inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class BotMetricsMiddleware(BaseMiddleware):
+    """Outer-middleware диспетчера aiogram: время обработки каждого апдейта по типу события."""
+
+    async def __call__(self, handler, event, data):
+        event_type = getattr(event, "event_type", None) or type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            BOT_UPDATE_ERRORS.labels(event_type).inc()
+            raise
+        finally:
+            BOT_UPDATE_SECONDS.labels(event_type).observe(time.perf_counter() - started)
+
+
+def observe_rollover(timings):
+    for phase, t in timings.items():
+        ROLLOVER_PHASE_SECONDS.labels(phase).observe(t["seconds"])
+        ROLLOVER_PHASE_ROWS.labels(phase).inc(t["rows"])
+
+
+def observe_archive(report):
+    for table in ("notifications", "tasks"):
+        ARCHIVE_ROWS.labels(table).inc(report[table]["rows"])
+        ARCHIVE_SECONDS.labels(table).observe(report[table]["seconds"])
+
+
+def collect_pool(pool_stats):
+    DB_POOL_CONNECTIONS.labels("size").set(pool_stats.get("pool_size", 0))
+    DB_POOL_CONNECTIONS.labels("available").set(pool_stats.get("pool_available", 0))
+    DB_POOL_CONNECTIONS.labels("in_use").set(pool_stats.get("pool_in_use", 0))
+    DB_POOL_WAITING.set(pool_stats.get("requests_waiting", 0))
+
+
+def collect_queue(queue):
+    for status in ("pending", "claimed"):
+        NOTIFY_QUEUE_DEPTH.labels(status).set(queue["depth"].get(status, 0))
+    NOTIFY_QUEUE_DUE.set(queue["due"])
+    NOTIFY_QUEUE_OLDEST_DUE.set(queue["oldest_due_seconds"] or 0)
+
+
+def render():
+    """Тело ответа /metrics и его Content-Type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
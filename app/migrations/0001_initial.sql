@@ -0,0 +1,48 @@
+-- Исходная схема (раньше создавалась init_db при каждом старте).
+-- IF NOT EXISTS - чтобы базы, созданные старым init_db, приняли миграцию без ошибок.
+
+-- USERS
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    tg_id BIGINT UNIQUE NOT NULL,
+    username TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    counttask INTEGER DEFAULT 0,
+    count_habits INTEGER DEFAULT 0,
+    count_complate_task INTEGER DEFAULT 0,
+    ratio_complate_habits INTEGER DEFAULT 0,
+    days_tracked INTEGER DEFAULT 0
+);
+
+-- TASKS
+CREATE TABLE IF NOT EXISTS tasks (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    title TEXT NOT NULL,
+    is_completed BOOLEAN DEFAULT FALSE,
+    task_date DATE DEFAULT CURRENT_DATE
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks(user_id);
+
+-- HABITS
+CREATE TABLE IF NOT EXISTS habits (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    title TEXT NOT NULL,
+    is_complete_today BOOLEAN DEFAULT FALSE,
+    count_complete INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (tg_id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_habits_user_id ON habits(user_id);
+
+-- EVENT
+CREATE TABLE IF NOT EXISTS scheduled_notifications (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    message_text TEXT,
+    file_id TEXT,           -- ID файла в Телеграм (фото, видео или голосовое)
+    media_type TEXT,        -- 'photo', 'video', 'voice' или NULL
+    scheduled_time TIMESTAMP NOT NULL,
+    is_sent BOOLEAN DEFAULT FALSE
+);
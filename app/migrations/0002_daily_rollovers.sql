@@ -0,0 +1,7 @@
+-- ROLLOVER: отметка о выполненном ночном пересчете за день
+CREATE TABLE IF NOT EXISTS daily_rollovers (
+    run_date DATE PRIMARY KEY,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    timings JSONB
+);
@@ -0,0 +1,11 @@
+-- Очередь с захватом (claim/lease), чтобы несколько воркеров не слали дубли:
+-- pending -> claimed (claimed_by, lease_until) -> sent | pending (повтор) | dead
+ALTER TABLE scheduled_notifications
+    ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'pending',
+    ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+    ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_error TEXT;
+
+UPDATE scheduled_notifications SET status = 'sent'
+WHERE is_sent = TRUE AND status = 'pending';
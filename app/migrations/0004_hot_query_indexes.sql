@@ -0,0 +1,17 @@
+-- migrate: no-transaction
+-- Индексы под горячие запросы. CONCURRENTLY - не блокируем запись в живые таблицы,
+-- поэтому миграция идет вне транзакции, по одному оператору.
+
+-- get_user_tasks(user_id, date) - фильтр по (user_id, task_date) + ORDER BY id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_user_date_id ON tasks(user_id, task_date, id DESC);
+
+-- get_user_tasks(user_id) без даты - (user_id, id DESC) заменяет idx_tasks_user_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_user_id_id ON tasks(user_id, id DESC);
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_user_id;
+
+-- delete_completed_tasks - частичный индекс только по выполненным
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_completed ON tasks(id) WHERE is_completed = TRUE;
+
+-- claim_notifications / get_upcoming_notification_times - только живая часть очереди
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_due
+    ON scheduled_notifications(scheduled_time) WHERE status IN ('pending', 'claimed');
@@ -0,0 +1,39 @@
+-- Архив: отправленные/мертвые уведомления и старые невыполненные задачи
+-- переносятся сюда пачками (app/database.py: archive_old_rows), чтобы рабочие
+-- таблицы оставались маленькими. Колонки те же, плюс момент переноса.
+
+CREATE TABLE IF NOT EXISTS tasks_history (
+    id INTEGER PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    title TEXT NOT NULL,
+    is_completed BOOLEAN,
+    task_date DATE,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Календарь за старые месяцы читает историю по (user_id, task_date)
+CREATE INDEX IF NOT EXISTS idx_tasks_history_user_date ON tasks_history(user_id, task_date, id DESC);
+
+CREATE TABLE IF NOT EXISTS scheduled_notifications_history (
+    id INTEGER PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    message_text TEXT,
+    file_id TEXT,
+    media_type TEXT,
+    scheduled_time TIMESTAMP NOT NULL,
+    is_sent BOOLEAN,
+    status TEXT NOT NULL,
+    claimed_by TEXT,
+    lease_until TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_history_user ON scheduled_notifications_history(user_id, scheduled_time);
+
+-- Отчет по каждому запуску архивации: сколько строк и пачек перенесено
+CREATE TABLE IF NOT EXISTS archive_runs (
+    id SERIAL PRIMARY KEY,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    report JSONB
+);
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- Индексы под выборку кандидатов в архив (рабочие таблицы - CONCURRENTLY).
+
+-- Завершенная часть очереди уведомлений, по сроку
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_finished
+    ON scheduled_notifications(scheduled_time) WHERE status IN ('sent', 'dead');
+
+-- Невыполненные задачи по дате (выполненные удаляются ночным пересчетом)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_open_date ON tasks(task_date) WHERE is_completed = FALSE;
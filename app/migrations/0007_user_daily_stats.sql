@@ -0,0 +1,18 @@
+-- Дневные факты по пользователю: пишутся ночным пересчетом до сброса привычек
+-- и удаления выполненных задач, поэтому история не теряется. Строка есть только
+-- за дни, когда у пользователя были привычки или задачи на этот день.
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    user_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    habits_total INTEGER NOT NULL DEFAULT 0,
+    habits_done INTEGER NOT NULL DEFAULT 0,
+    tasks_total INTEGER NOT NULL DEFAULT 0,
+    tasks_done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+-- Серия дней, когда выполнено все запланированное, ведется тем же пересчетом
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS current_streak INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS best_streak INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_complete_day DATE;
@@ -0,0 +1,8 @@
+-- Часовой пояс пользователя (IANA): ночной пересчет идет пачками по поясам
+-- в местные 23:58. Существующие пользователи остаются на Москве.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone TEXT NOT NULL DEFAULT 'Europe/Moscow';
+
+-- Отметка о пересчете теперь на (день, пояс)
+ALTER TABLE daily_rollovers ADD COLUMN IF NOT EXISTS timezone TEXT NOT NULL DEFAULT 'Europe/Moscow';
+ALTER TABLE daily_rollovers DROP CONSTRAINT IF EXISTS daily_rollovers_pkey;
+ALTER TABLE daily_rollovers ADD PRIMARY KEY (run_date, timezone);
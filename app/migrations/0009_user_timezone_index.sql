@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Выбор пользователей одного пояса в фазах пересчета и список поясов для планировщика
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_timezone ON users(timezone, tg_id);
@@ -0,0 +1,15 @@
+-- Рассылка на сегмент пользователей: одна строка здесь, строки уведомлений
+-- создаются одним INSERT ... SELECT и ссылаются на нее через broadcast_id.
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id SERIAL PRIMARY KEY,
+    message_text TEXT,
+    file_id TEXT,
+    media_type TEXT,
+    scheduled_time TIMESTAMP NOT NULL,
+    segment JSONB NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE scheduled_notifications ADD COLUMN IF NOT EXISTS broadcast_id INTEGER;
+ALTER TABLE scheduled_notifications_history ADD COLUMN IF NOT EXISTS broadcast_id INTEGER;
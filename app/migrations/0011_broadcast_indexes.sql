@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Прогресс рассылки: счетчики по статусам строк одной рассылки (в очереди и в истории)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_broadcast
+    ON scheduled_notifications(broadcast_id, status) WHERE broadcast_id IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_history_broadcast
+    ON scheduled_notifications_history(broadcast_id, status) WHERE broadcast_id IS NOT NULL;
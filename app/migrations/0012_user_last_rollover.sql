@@ -0,0 +1,8 @@
+-- Последний день, за который пользователь прошел ночной пересчет. Отметка
+-- daily_rollovers стоит на (день, пояс), а пояс меняется вместе с устройством:
+-- без отметки на пользователе переезд на запад пересчитал бы тот же день дважды.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_rollover_date DATE;
+
+UPDATE users u SET last_rollover_date = r.last_date
+FROM (SELECT timezone, max(run_date) AS last_date FROM daily_rollovers GROUP BY timezone) r
+WHERE u.timezone = r.timezone AND u.last_rollover_date IS NULL;
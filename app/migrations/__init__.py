@@ -0,0 +1,168 @@
+"""
+Версионные миграции схемы.
+
+Каждый файл NNNN_описание.sql в этом каталоге - одна миграция, применяются по
+возрастанию номера, примененные записываются в schema_version. Обычная миграция
+выполняется одной транзакцией. Если первая строка файла
+`-- migrate: no-transaction`, операторы (разделенные ";" в конце строки)
+выполняются по одному вне транзакции - нужно для CREATE INDEX CONCURRENTLY.
+"""
+import asyncio
+import logging
+import re
+import time
+from pathlib import Path
+
+import psycopg
+from psycopg.rows import dict_row
+
+import app.postgres as db
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent
+NO_TRANSACTION_MARK = "-- migrate: no-transaction"
+# Ключ advisory lock: одновременно мигрирует только одна реплика
+LOCK_ID = 0x7A5E_0001
+# Пауза между попытками взять блокировку, пока мигрирует другая реплика, сек
+LOCK_RETRY_SECONDS = 0.5
+
+_FILE_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    @property
+    def sql(self):
+        return self.path.read_text(encoding="utf-8")
+
+    @property
+    def transactional(self):
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARK)
+
+    def statements(self):
+        """Операторы файла по одному (для миграций вне транзакции)."""
+        lines = [line for line in self.sql.splitlines() if not line.strip().startswith("--")]
+        return [stmt.strip() for stmt in re.split(r";\s*$", "\n".join(lines), flags=re.M) if stmt.strip()]
+
+
+def load_migrations():
+    migrations = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        match = _FILE_RE.match(path.name)
+        if not match:
+            raise RuntimeError(f"Неверное имя файла миграции: {path.name}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Повторяющиеся номера миграций: {versions}")
+    return migrations
+
+
+def latest_version():
+    migrations = load_migrations()
+    return migrations[-1].version if migrations else 0
+
+
+async def current_version(conn):
+    """Текущая версия схемы (0 - таблицы schema_version еще нет)."""
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS exists")
+        if not (await cur.fetchone())["exists"]:
+            return 0
+        await cur.execute("SELECT COALESCE(max(version), 0) AS version FROM schema_version")
+        return (await cur.fetchone())["version"]
+
+
+async def apply_pending(conn):
+    """
+    Применяет недостающие миграции на соединении conn (должно быть в autocommit).
+    Возвращает список (версия, имя, мс).
+    """
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                duration_ms INTEGER
+            )
+        """)
+    version = await current_version(conn)
+    applied = []
+    for migration in load_migrations():
+        if migration.version <= version:
+            continue
+        started = time.perf_counter()
+        if migration.transactional:
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await _record(conn, migration, started)
+        else:
+            for statement in migration.statements():
+                await conn.execute(statement)
+            await _record(conn, migration, started)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        logging.info(f"Миграция {migration.version:04d}_{migration.name} применена за {duration_ms} мс")
+        applied.append((migration.version, migration.name, duration_ms))
+    return applied
+
+
+async def _record(conn, migration, started):
+    await conn.execute(
+        "INSERT INTO schema_version (version, name, duration_ms) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, int((time.perf_counter() - started) * 1000)),
+    )
+
+
+async def _acquire_lock(conn):
+    """
+    Берет advisory lock короткими pg_try_advisory_lock с паузой между попытками.
+    Блокирующий pg_advisory_lock держал бы у ожидающей реплики открытый запрос
+    (снимок), а CREATE INDEX CONCURRENTLY мигрирующей реплики ждет завершения всех
+    снимков - взаимная блокировка (DeadlockDetected). Между попытками соединение
+    простаивает и ничего не держит.
+    """
+    waiting = False
+    while True:
+        cur = await conn.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_ID,))
+        if (await cur.fetchone())[0]:
+            return
+        if not waiting:
+            logging.info("Схему БД мигрирует другая реплика, ждем")
+            waiting = True
+        await asyncio.sleep(LOCK_RETRY_SECONDS)
+
+
+async def migrate():
+    """
+    Приводит схему к последней версии. Если база уже актуальна - один SELECT
+    через общий пул, без блокировок. Иначе берет advisory lock на отдельном
+    соединении (остальные реплики ждут, см. _acquire_lock), проверяет версию
+    заново - пока ждали, миграции могла применить другая реплика - и применяет
+    недостающие.
+    """
+    target = latest_version()
+    async with db.get_connection() as conn:
+        version = await current_version(conn)
+    if version >= target:
+        logging.info(f"Схема БД актуальна (версия {version})")
+        return []
+
+    logging.info(f"Миграция схемы БД: {version} -> {target}")
+    conn = await psycopg.AsyncConnection.connect(db.DATABASE_URL, autocommit=True, connect_timeout=10)
+    try:
+        await _acquire_lock(conn)
+        try:
+            version = await current_version(conn)
+            if version >= target:
+                logging.info(f"Схема БД актуальна (версия {version}), миграции применила другая реплика")
+                return []
+            return await apply_pending(conn)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
+    finally:
+        await conn.close()
@@ -1,15 +1,32 @@
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Request
+import hmac
+import logging
+import time
+import uuid
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import List
 import app.database as db
-from typing import List, Optional
-
-app = FastAPI()
+import app.metrics as metrics
+import app.notifier as notifier
+from app.cache import user_cache
+from app.lifecycle import lifecycle
+from config import ADMIN_SECRET, BOT_MODE, WEBHOOK_PATH
+from typing import List, Literal, Optional, Union
+from datetime import date, datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# orjson: сериализует dict_row/date/datetime напрямую, без jsonable_encoder
+app = FastAPI(default_response_class=ORJSONResponse)
 WEB_DIR = Path(__file__).resolve().parent.parent / "web"
 
+# Списки задач/привычек сжимаем, мелкие ответы отдаем как есть
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,58 +34,257 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Время ответа по шаблону маршрута (/api/tasks/{user_id}), а не по фактическому
+# пути - иначе число серий росло бы с числом пользователей
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        label = getattr(route, "path", "") or getattr(route, "name", None) or "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, label, status).observe(time.perf_counter() - started)
+
+# Пока хранилище не открыто (фоновый запуск в run.py), API отвечает 503 сразу,
+# не дожидаясь ошибки пула; /health и статика доступны с первой секунды
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    if not lifecycle.ready and request.url.path.startswith("/api/"):
+        return ORJSONResponse({"detail": "Сервис запускается"}, status_code=503, headers={"Retry-After": "5"})
+    return await call_next(request)
+
+# ================= ETag =================
+# ETag строится из версии данных пользователя в кэше (растет при каждой записи),
+# поэтому на If-None-Match можно ответить 304 без запроса в БД и сериализации.
+# BOOT_ID отличает процессы, окно TTL ограничивает устаревание при записи через
+# другую реплику - так же, как у самого кэша.
+BOOT_ID = uuid.uuid4().hex[:8]
+
+def make_etag(user_id, *parts):
+    epoch, version = user_cache.version(user_id)
+    window = int(time.time() // max(user_cache.ttl, 1))
+    tail = "-".join(str(p) for p in parts if p is not None)
+    return f'W/"{BOOT_ID}-{epoch}-{version}-{window}-{tail}"'
+
+async def conditional_json(request: Request, etag, loader):
+    """304, если у клиента актуальная версия, иначе загружает данные и отдает их с ETag."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    data = await loader()
+    return ORJSONResponse(data, headers=headers)
+
+
+def validate_timezone(value):
+    """IANA-имя пояса (Europe/Moscow, Asia/Tokyo); пустое значение пропускается."""
+    if value:
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Неизвестный часовой пояс: {value}")
+    return value
+
 class UserRegistration(BaseModel):
     tg_id: int
     name: str
+    # Пояс устройства из Mini App; при каждом входе синхронизируется
+    timezone: Optional[str] = None
+
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, value):
+        # Устаревшая база tzdata на устройстве не должна мешать входу: неизвестный
+        # пояс отбрасываем, и add_user оставляет текущий (у нового - DEFAULT_TIMEZONE)
+        try:
+            return validate_timezone(value)
+        except ValueError as e:
+            logging.warning(f"Регистрация без пояса: {e}")
+            return None
+
+class TimezoneUpdate(BaseModel):
+    timezone: str
+
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, value):
+        return validate_timezone(value)
 
 class TaskCreate(BaseModel):
     user_id: int
     title: str
     date: Optional[str] = None
 
+# Модели ответов. Списки отдаются через conditional_json (ORJSONResponse напрямую),
+# поэтому модели описывают схему в OpenAPI, а не прогоняют каждую строку через pydantic.
 class TaskResponse(BaseModel):
     id: int
+    user_id: int
     title: str
     is_completed: bool
+    task_date: date
 
+class HabitResponse(BaseModel):
+    id: int
+    title: str
+    is_complete_today: bool
+    count_complete: int
 
+class UserStatsResponse(BaseModel):
+    counttask: int
+    count_habits: int
+    count_complate_task: int
+    ratio_complate_habits: int
+    days_tracked: int
+
+class DashboardResponse(BaseModel):
+    tasks: List[TaskResponse]
+    habits: List[HabitResponse]
+    stats: Optional[UserStatsResponse] = None
+
+class StreakResponse(BaseModel):
+    current_streak: int
+    best_streak: int
+    last_complete_day: Optional[date] = None
+
+class PeriodStatsResponse(BaseModel):
+    period_start: date
+    days: int
+    habits_total: int
+    habits_done: int
+    tasks_total: int
+    tasks_done: int
+    habits_rate: Optional[float] = None
+    tasks_rate: Optional[float] = None
 
 
 @app.post("/api/register")
 async def register_user(user: UserRegistration):
     try:
-        db.add_user(user.tg_id, user.name)
+        await db.add_user(user.tg_id, user.name, user.timezone)
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/users/{tg_id}/timezone")
+async def api_set_timezone(tg_id: int, body: TimezoneUpdate):
+    """Смена пояса: ночной пересчет пользователя переедет в местные 23:58."""
+    if not await db.set_user_timezone(tg_id, body.timezone):
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return {"status": "ok"}
+
 @app.post("/api/tasks/add")
 async def api_add_task(task: TaskCreate):
     try:
-        db.add_task(task.user_id, task.title, task.date)
+        await db.add_task(task.user_id, task.title, task.date)
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/tasks/{user_id}")
-async def api_get_tasks(user_id: int, date: Optional[str] = None):
+@app.get("/api/tasks/{user_id}", response_model=List[TaskResponse])
+async def api_get_tasks(request: Request, user_id: int, date: Optional[str] = None):
+    try:
+        etag = make_etag(user_id, "tasks", date)
+        return await conditional_json(request, etag, lambda: db.get_user_tasks(user_id, date))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/tasks/{user_id}/range", response_model=List[TaskResponse])
+async def api_get_tasks_range(request: Request, user_id: int, start: date, end: date):
+    """Задачи за период (месяц календаря) одним запросом - дни группируются на клиенте."""
+    if end < start or (end - start).days > 62:
+        raise HTTPException(status_code=400, detail="Период должен быть от 0 до 62 дней")
     try:
-        return db.get_user_tasks(user_id, date)
+        etag = make_etag(user_id, "range", start, end)
+        return await conditional_json(request, etag, lambda: db.get_user_tasks_range(user_id, start, end))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/dashboard/{user_id}", response_model=DashboardResponse)
+async def api_get_dashboard(request: Request, user_id: int, date: Optional[str] = None):
+    """Задачи, привычки и счетчики пользователя одним ответом."""
+    try:
+        etag = make_etag(user_id, "dashboard", date)
+        return await conditional_json(request, etag, lambda: db.get_dashboard(user_id, date))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/stats/{user_id}/streak", response_model=StreakResponse)
+async def api_get_streak(request: Request, user_id: int):
+    """Текущая и лучшая серия дней, когда выполнено все запланированное."""
+    async def load():
+        row = await db.get_user_streak(user_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        return row
+
+    return await conditional_json(request, make_etag(user_id, "streak"), load)
+
+@app.get("/api/stats/{user_id}/periods", response_model=List[PeriodStatsResponse])
+async def api_get_period_stats(request: Request, user_id: int, period: Literal["week", "month"] = "week",
+                               limit: int = Query(12, ge=1, le=52)):
+    """Процент выполнения привычек и задач по неделям/месяцам из дневных фактов."""
+    try:
+        etag = make_etag(user_id, "periods", period, limit)
+        return await conditional_json(request, etag, lambda: db.get_user_period_stats(user_id, period, limit))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/tasks/toggle/{task_id}")
 async def api_toggle_task(task_id: int):
     try:
-        db.toggle_task_status(task_id)
+        await db.toggle_task_status(task_id)
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/health")
 async def health():
+    """Liveness: процесс жив и принимает соединения (не зависит от БД)."""
     return {"status": "ok"}
 
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: хранилище открыто, схема актуальна и процесс не останавливается; шаги запуска."""
+    snapshot = lifecycle.snapshot()
+    return ORJSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+@app.get("/health/db")
+async def health_db():
+    """Загрузка пула соединений с БД."""
+    return db.get_pool_stats()
+
+@app.get("/health/cache")
+async def health_cache():
+    """Кэш списков задач/привычек: попадания, промахи, вытеснения."""
+    return user_cache.stats()
+
+@app.get("/health/notifications")
+async def health_notifications():
+    """Счетчики рассылки уведомлений: отправлено, ошибки, RetryAfter, задержки."""
+    return notifier.stats.snapshot()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Метрики в формате Prometheus."""
+    metrics.collect_pool(db.get_pool_stats())
+    try:
+        if lifecycle.ready:
+            metrics.collect_queue(await db.get_notification_queue_stats())
+    except Exception as e:
+        logging.error(f"Не удалось снять метрики очереди уведомлений: {e}")
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/health/archive")
+async def health_archive():
+    """Последние запуски архивации: политика хранения и перенесенные строки по таблицам."""
+    return await db.get_archive_runs()
+
 
 class HabitCreate(BaseModel):
     user_id: int
@@ -76,29 +292,36 @@ class HabitCreate(BaseModel):
 
 @app.post("/api/habits/add")
 async def api_add_habit(habit: HabitCreate):
-    db.add_habit(habit.user_id, habit.title)
+    await db.add_habit(habit.user_id, habit.title)
     return {"status": "ok"}
 
-@app.get("/api/habits/{user_id}")
-async def api_get_habits(user_id: int):
-    return db.get_user_habits(user_id)
+@app.get("/api/habits/{user_id}", response_model=List[HabitResponse])
+async def api_get_habits(request: Request, user_id: int):
+    try:
+        etag = make_etag(user_id, "habits")
+        return await conditional_json(request, etag, lambda: db.get_user_habits(user_id))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/habits/toggle/{habit_id}")
 async def api_toggle_habit(habit_id: int):
-    db.toggle_habit_status(habit_id)
-    return {"status": "ok"}
+    try:
+        await db.toggle_habit_status(habit_id)
+        return {"status": "ok"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 
 # Эндпоинты удаления
 @app.delete("/api/tasks/{task_id}")
 async def api_delete_task(task_id: int):
-    db.delete_task(task_id)
+    await db.delete_task(task_id)
     return {"status": "ok"}
 
 @app.delete("/api/habits/{habit_id}")
 async def api_delete_habit(habit_id: int):
-    db.delete_habit(habit_id)
+    await db.delete_habit(habit_id)
     return {"status": "ok"}
 
 # Эндпоинты редактирования
@@ -107,33 +330,52 @@ class UpdateItem(BaseModel):
 
 @app.post("/api/tasks/update/{task_id}")
 async def api_update_task(task_id: int, data: UpdateItem):
-    db.update_task_title(task_id, data.title)
+    await db.update_task_title(task_id, data.title)
     return {"status": "ok"}
 
 @app.post("/api/habits/update/{habit_id}")
 async def api_update_habit(habit_id: int, data: UpdateItem):
-    db.update_habit_title(habit_id, data.title)
+    await db.update_habit_title(habit_id, data.title)
     return {"status": "ok"}
 
 
-class HabitResponse(BaseModel):
-    id: int
-    title: str
-    is_complete_today: bool
-    count_complete: int
+# Пакетные изменения от Mini App
+# Поле операции называется date и в теле класса заслоняет тип datetime.date
+TaskDate = date
+
+class BatchOperation(BaseModel):
+    op: Literal["task.add", "task.update", "task.toggle", "task.delete",
+                "habit.add", "habit.update", "habit.toggle", "habit.delete"]
+    id: Optional[int] = None
+    title: Optional[str] = None
+    # Некорректная дата отклоняется валидацией (422), а не падает в apply_batch
+    date: Optional[TaskDate] = None
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.op.endswith(".add") and not self.title:
+            raise ValueError(f"{self.op}: нужен title")
+        if not self.op.endswith(".add") and self.id is None:
+            raise ValueError(f"{self.op}: нужен id")
+        if self.op.endswith(".update") and not self.title:
+            raise ValueError(f"{self.op}: нужен title")
+        return self
+
+class BatchRequest(BaseModel):
+    user_id: int
+    operations: List[BatchOperation] = Field(..., min_length=1, max_length=500)
 
-@app.get("/api/habits/{user_id}", response_model=List[HabitResponse])
-async def api_get_habits(user_id: int):
+@app.post("/api/batch")
+async def api_batch(batch: BatchRequest):
+    """Применяет очередь изменений Mini App одной транзакцией."""
     try:
-        return db.get_user_habits(user_id)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/api/habits/toggle/{habit_id}")
-async def api_toggle_habit(habit_id: int):
-    try:
-        db.toggle_habit_status(habit_id)
-        return {"status": "ok"}
+        applied = await db.apply_batch(batch.user_id, [op.model_dump() for op in batch.operations])
+        return {"status": "ok", "applied": applied}
+    except db.IntegrityError:
+        # Пачка ссылается на несуществующего пользователя - повтор не поможет
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -150,7 +392,7 @@ class NotificationSchema(BaseModel):
 async def schedule_message(data: NotificationSchema):
     try:
         dt = datetime.strptime(data.scheduled_time, "%Y-%m-%d %H:%M")
-        db.add_scheduled_notification(
+        await db.add_scheduled_notification(
             data.user_id, 
             data.text, 
             dt, 
@@ -161,5 +403,72 @@ async def schedule_message(data: NotificationSchema):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+class SegmentCondition(BaseModel):
+    field: Literal["counttask", "count_habits", "count_complate_task", "ratio_complate_habits",
+                   "days_tracked", "current_streak", "best_streak", "timezone"]
+    op: Literal["=", "!=", "<", "<=", ">", ">="]
+    value: Union[int, str]
+
+class BroadcastSegment(BaseModel):
+    type: Literal["all", "ids", "filter"]
+    user_ids: Optional[List[int]] = Field(None, min_length=1, max_length=100_000)
+    conditions: Optional[List[SegmentCondition]] = Field(None, min_length=1, max_length=20)
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.type == "ids" and not self.user_ids:
+            raise ValueError("ids: нужен user_ids")
+        if self.type == "filter" and not self.conditions:
+            raise ValueError("filter: нужны conditions")
+        return self
+
+class BroadcastSchema(BaseModel):
+    text: Optional[str] = None
+    scheduled_time: str  # Формат: "2024-12-31 15:30"
+    file_id: Optional[str] = None
+    media_type: Optional[str] = None
+    segment: BroadcastSegment
+
+def require_admin(x_admin_token: str = Header(default="")):
+    """Рассылки доступны только с заголовком X-Admin-Token, совпадающим с ADMIN_SECRET."""
+    if not ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Служебные маршруты отключены: ADMIN_SECRET не задан")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Неверный X-Admin-Token")
+
+@app.post("/api/broadcasts", dependencies=[Depends(require_admin)])
+async def create_broadcast(data: BroadcastSchema):
+    """Одно сообщение на сегмент пользователей: все уведомления создаются одним запросом."""
+    try:
+        dt = datetime.strptime(data.scheduled_time, "%Y-%m-%d %H:%M")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        broadcast_id, total = await db.create_broadcast(
+            data.text, dt, data.segment.model_dump(exclude_none=True), data.file_id, data.media_type)
+        return {"status": "ok", "broadcast_id": broadcast_id, "total": total}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/broadcasts/{broadcast_id}", dependencies=[Depends(require_admin)])
+async def broadcast_progress(broadcast_id: int):
+    """Прогресс рассылки: сколько уведомлений ждет, захвачено, отправлено, не доставлено."""
+    progress = await db.get_broadcast_progress(broadcast_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Рассылка не найдена")
+    return progress
+
+# Апдейты бота в режиме BOT_MODE=webhook (обработчик выставляет run.py).
+# Маршрут объявлен до статики: mount("/") перехватил бы путь.
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    handler = getattr(request.app.state, "webhook", None)
+    if handler is None:
+        if BOT_MODE == "webhook":
+            # Бот еще запускается - Telegram повторит доставку
+            return Response(status_code=503, headers={"Retry-After": "5"})
+        raise HTTPException(status_code=404)
+    return await handler.handle(request)
+
 if WEB_DIR.exists():
     app.mount("/", StaticFiles(directory=str(WEB_DIR), html=True), name="web")
\ No newline at end of file
@@ -0,0 +1,349 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import app.database as db
+import app.metrics as metrics
+
+USER_TZ = ZoneInfo("Europe/Moscow")
+
+# Лимиты Telegram: ~30 сообщений/сек на бота и ~1 сообщение/сек в один чат
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", 20))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", 30))
+NOTIFY_PER_CHAT_INTERVAL = float(os.getenv("NOTIFY_PER_CHAT_INTERVAL", 1.0))
+NOTIFY_MARK_BATCH_SIZE = int(os.getenv("NOTIFY_MARK_BATCH_SIZE", 100))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", 3))
+# Очередь: сколько строк захватывать за раз, аренда, попытки до dead-letter, база бэкоффа
+NOTIFY_CLAIM_BATCH = int(os.getenv("NOTIFY_CLAIM_BATCH", 500))
+NOTIFY_LEASE_SECONDS = int(os.getenv("NOTIFY_LEASE_SECONDS", 300))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 5))
+NOTIFY_RETRY_BASE_SECONDS = int(os.getenv("NOTIFY_RETRY_BASE_SECONDS", 30))
+# Страховочная пересинхронизация таймера с БД (на случай потерянного NOTIFY), сек
+NOTIFY_RESYNC_SECONDS = float(os.getenv("NOTIFY_RESYNC_SECONDS", 300))
+NOTIFY_PRELOAD_LIMIT = int(os.getenv("NOTIFY_PRELOAD_LIMIT", 1000))
+
+
+class RateLimiter:
+    """
+    Ограничитель отправки: общий token bucket на бота + минимальный интервал
+    между сообщениями в один чат. pause() останавливает всех (RetryAfter от Telegram).
+    """
+
+    def __init__(self, rate, per_chat_interval):
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._chat_next = {}
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id):
+        # Очередь в конкретный чат
+        now = time.monotonic()
+        chat_at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = chat_at + self.per_chat_interval
+        if chat_at > now:
+            await asyncio.sleep(chat_at - now)
+
+        # Общий лимит бота
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def forget_idle_chats(self):
+        """Чистит чаты, интервал которых уже истек (чтобы словарь не рос бесконечно)."""
+        now = time.monotonic()
+        self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+
+class DispatcherStats:
+    """Счетчики пропускной способности и задержки доставки."""
+
+    def __init__(self, window=1000):
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+        self.retry_after = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self._send_ms = deque(maxlen=window)   # время вызова Bot API
+        self._lag_ms = deque(maxlen=window)    # scheduled_time -> фактическая отправка
+
+    def observe(self, send_seconds, lag_seconds):
+        self.sent += 1
+        self._send_ms.append(send_seconds * 1000)
+        metrics.NOTIFY_SENT.inc()
+        metrics.NOTIFY_SEND_SECONDS.observe(send_seconds)
+        if lag_seconds is not None:
+            self._lag_ms.append(lag_seconds * 1000)
+            metrics.NOTIFY_LAG_SECONDS.observe(lag_seconds)
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {"p50": None, "p95": None, "p99": None, "max": None}
+        data = sorted(values)
+        return {
+            "p50": round(data[len(data) // 2], 1),
+            "p95": round(data[max(0, int(len(data) * 0.95) - 1)], 1),
+            "p99": round(data[max(0, int(len(data) * 0.99) - 1)], 1),
+            "max": round(data[-1], 1),
+        }
+
+    def snapshot(self):
+        rate = self.last_batch_size / self.last_batch_seconds if self.last_batch_seconds else 0.0
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "dead": self.dead,
+            "retry_after": self.retry_after,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_per_second": round(rate, 1),
+            "send_ms": self._percentiles(self._send_ms),
+            "lag_ms": self._percentiles(self._lag_ms),
+        }
+
+
+# Общие счетчики процесса (отдаются через /health/notifications)
+stats = DispatcherStats()
+
+
+class NotificationDispatcher:
+    """
+    Рассылает пачку захваченных уведомлений с ограниченной параллельностью, соблюдая
+    лимиты Telegram, и отмечает результат в БД пачками: отправленные - по
+    NOTIFY_MARK_BATCH_SIZE, неудачные возвращаются в очередь или уходят в dead.
+    mark_sent/mark_failed можно подменить (например, при прогоне против фейкового Bot API).
+    """
+
+    def __init__(self, bot: Bot, concurrency=NOTIFY_CONCURRENCY, global_rate=NOTIFY_GLOBAL_RATE,
+                 per_chat_interval=NOTIFY_PER_CHAT_INTERVAL, mark_batch_size=NOTIFY_MARK_BATCH_SIZE,
+                 mark_sent=None, mark_failed=None, scheduler=None):
+        self.bot = bot
+        self.limiter = RateLimiter(global_rate, per_chat_interval)
+        self.concurrency = concurrency
+        self.mark_batch_size = mark_batch_size
+        self.mark_sent = mark_sent or db.mark_notifications_sent
+        self.mark_failed = mark_failed or self._mark_failed
+        self.scheduler = scheduler
+        self.stats = stats
+        self._sent_ids = []
+        self._failures = []
+
+    async def dispatch(self, notes):
+        """Отправляет все уведомления из notes, возвращает число успешно отправленных."""
+        if not notes:
+            return 0
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        sent_before = self.stats.sent
+
+        async def run(note):
+            async with semaphore:
+                await self._send_with_retry(note)
+
+        try:
+            await asyncio.gather(*(run(note) for note in notes))
+        finally:
+            await self._flush()
+            self.limiter.forget_idle_chats()
+
+        sent = self.stats.sent - sent_before
+        self.stats.batches += 1
+        self.stats.last_batch_size = len(notes)
+        self.stats.last_batch_seconds = time.perf_counter() - started
+        logging.info(f"Рассылка: отправлено {sent} из {len(notes)} за {self.stats.last_batch_seconds:.2f} c")
+        return sent
+
+    async def _send_with_retry(self, note):
+        u_id = note['user_id']
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            await self.limiter.acquire(u_id)
+            started = time.perf_counter()
+            try:
+                await self._send(note)
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать - притормаживаем всю рассылку
+                self.stats.retry_after += 1
+                metrics.NOTIFY_RETRY_AFTER.inc()
+                self.limiter.pause(e.retry_after)
+                logging.warning(f"RetryAfter {e.retry_after} c для пользователя {u_id} (попытка {attempt + 1})")
+                continue
+            except (TelegramForbiddenError, TelegramBadRequest) as send_error:
+                # Бот заблокирован / чат не найден - повторять бессмысленно
+                self._fail(note, send_error, permanent=True)
+                return
+            except Exception as send_error:
+                self._fail(note, send_error, permanent=False)
+                return
+            self.stats.observe(time.perf_counter() - started, self._lag(note))
+            self._sent_ids.append(note['id'])
+            if len(self._sent_ids) >= self.mark_batch_size:
+                await self._flush()
+            return
+        self._fail(note, "превышено число повторов RetryAfter", permanent=False)
+
+    def _fail(self, note, error, permanent):
+        self.stats.failed += 1
+        metrics.NOTIFY_FAILED.labels("permanent" if permanent else "transient").inc()
+        logging.error(f"Ошибка отправки пользователю {note['user_id']}: {error}")
+        self._failures.append((note['id'], str(error), permanent))
+
+    async def _mark_failed(self, failures):
+        return await db.mark_notifications_failed(failures, NOTIFY_MAX_ATTEMPTS, NOTIFY_RETRY_BASE_SECONDS)
+
+    async def _send(self, note):
+        u_id = note['user_id']
+        text = note['message_text']
+        f_id = note['file_id']
+        m_type = note['media_type']
+
+        # Взаимодействие с API Telegram через aiogram
+        if m_type == 'photo':
+            await self.bot.send_photo(u_id, photo=f_id, caption=text)
+        elif m_type == 'video':
+            await self.bot.send_video(u_id, video=f_id, caption=text)
+        elif m_type == 'voice':
+            await self.bot.send_voice(u_id, voice=f_id, caption=text)
+        else:
+            await self.bot.send_message(u_id, text=text)
+
+    async def _flush(self):
+        if self._sent_ids:
+            ids, self._sent_ids = self._sent_ids, []
+            try:
+                await self.mark_sent(ids)
+            except Exception as e:
+                # Аренда истечет, и строки будут захвачены повторно (at-least-once)
+                logging.error(f"Не удалось отметить отправленные уведомления {ids}: {e}")
+        if self._failures:
+            failures, self._failures = self._failures, []
+            try:
+                retry_times = await self.mark_failed(failures) or []
+            except Exception as e:
+                logging.error(f"Не удалось вернуть в очередь уведомления {[f[0] for f in failures]}: {e}")
+                return
+            self.stats.dead += len(failures) - len(retry_times)
+            if self.scheduler is not None:
+                for retry_at in retry_times:
+                    self.scheduler.push(retry_at)
+
+    @staticmethod
+    def _lag(note):
+        scheduled = note.get('scheduled_time')
+        if scheduled is None:
+            return None
+        return max(0.0, (moscow_now() - scheduled).total_seconds())
+
+
+def moscow_now():
+    """Текущее время по Москве без tzinfo - в таком виде хранится scheduled_time."""
+    return datetime.now(USER_TZ).replace(tzinfo=None)
+
+
+class NotificationScheduler:
+    """
+    Таймер ближайших уведомлений: min-heap из scheduled_time.
+    Загружается из БД при старте, пополняется через LISTEN/NOTIFY (каждая вставка
+    в scheduled_notifications шлет pg_notify) и просыпается ровно к ближайшему сроку
+    вместо опроса базы раз в минуту.
+    """
+
+    def __init__(self, resync_seconds=NOTIFY_RESYNC_SECONDS, preload_limit=NOTIFY_PRELOAD_LIMIT):
+        self.resync_seconds = resync_seconds
+        self.preload_limit = preload_limit
+        self._heap = []
+        self._truncated = False
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def load(self):
+        """Перечитывает ближайшие сроки из БД."""
+        times = await db.get_upcoming_notification_times(self.preload_limit)
+        self._heap = list(times)
+        heapq.heapify(self._heap)
+        self._truncated = len(times) >= self.preload_limit
+        self._changed.set()
+
+    def push(self, scheduled_time):
+        earliest = self._heap[0] if self._heap else None
+        heapq.heappush(self._heap, scheduled_time)
+        if earliest is None or scheduled_time < earliest:
+            self._changed.set()
+
+    def pop_due(self, now=None):
+        """Убирает из таймера все наступившие сроки."""
+        now = now or moscow_now()
+        while self._heap and self._heap[0] <= now:
+            heapq.heappop(self._heap)
+
+    async def wait_due(self):
+        """
+        Ждет наступления ближайшего срока. Возвращает True, если есть что отправлять,
+        False - если сработала страховочная пересинхронизация.
+        """
+        deadline = time.monotonic() + self.resync_seconds
+        while True:
+            self._changed.clear()
+            now = moscow_now()
+            if self._heap and self._heap[0] <= now:
+                return True
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return False
+            if self._heap:
+                timeout = min(timeout, (self._heap[0] - now).total_seconds())
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def refill_if_needed(self):
+        # Если при загрузке сроков было больше лимита, дочитываем следующие
+        if not self._heap and self._truncated:
+            await self.load()
+
+    async def listen(self):
+        """Слушает NOTIFY о новых уведомлениях, переподключаясь при обрыве."""
+        while True:
+            try:
+                async for payload in db.listen_notifications():
+                    try:
+                        self.push(datetime.fromisoformat(payload))
+                    except ValueError:
+                        logging.warning(f"Некорректный payload NOTIFY: {payload!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"LISTEN оборвался: {e}, переподключение через 5 c")
+            await asyncio.sleep(5)
+            # Пока соединения не было, NOTIFY могли потеряться
+            try:
+                await self.load()
+            except Exception as e:
+                logging.error(f"Не удалось перечитать таймер уведомлений: {e}")
@@ -0,0 +1,963 @@
+"""
+Хранилище на PostgreSQL (STORAGE_BACKEND=postgres, по умолчанию): psycopg 3,
+общий пул соединений, схема - версионные миграции app/migrations.
+Вызывающий код обращается к функциям через app.database.
+"""
+import os
+import time
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+from datetime import datetime, date
+
+from app.cache import user_cache, MISSING
+from app.metrics import db_timed
+from config import DEFAULT_TIMEZONE
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+if "sslmode" not in DATABASE_URL and "railway" in DATABASE_URL.lower():
+    DATABASE_URL += "&sslmode=require" if "?" in DATABASE_URL else "?sslmode=require"
+
+# Настройки пула соединений (можно переопределить через переменные окружения)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))         # ожидание свободного соединения, сек
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))      # закрывать простаивающие сверх min_size, сек
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))  # пересоздавать соединение, сек
+
+# Один пул на процесс: его используют API, бот и фоновые воркеры из run.py
+pool = AsyncConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_idle=DB_POOL_MAX_IDLE,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    check=AsyncConnectionPool.check_connection,  # проверка соединения перед выдачей
+    kwargs={"row_factory": dict_row, "connect_timeout": 10},
+    name="taskenforcer",
+    open=False,
+)
+
+async def open_pool():
+    """
+    Открывает пул и проверяет, что база отвечает (вызывается при старте).
+    Повторный вызов после ошибки безопасен: пул остается открытым и продолжает
+    подключаться в фоне (open(wait=True) закрыл бы его по таймауту насовсем).
+    """
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set")
+    await pool.open()
+    async with pool.connection() as conn:
+        await conn.execute("SELECT 1")
+
+async def migrate():
+    """Применяет недостающие миграции схемы (app/migrations)."""
+    from app.migrations import migrate as apply_migrations
+    return await apply_migrations()
+
+async def close_pool():
+    await pool.close()
+
+def get_pool_stats():
+    """Метрики загрузки пула: размер, свободные соединения, очередь ожидания и т.д."""
+    stats = pool.get_stats()
+    stats["pool_in_use"] = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    return stats
+
+def get_connection():
+    """Берет соединение из пула. При выходе из async with - commit/rollback и возврат в пул."""
+    return pool.connection()
+
+def _invalidate_owner(row):
+    """Сбрасывает кэш владельца строки (результат ... RETURNING user_id) после commit."""
+    if row:
+        user_cache.invalidate_user(row['user_id'])
+
+# ================= USERS =================
+
+@db_timed
+async def add_user(tg_id: int, username: str, timezone: str = None):
+    """Регистрирует пользователя; если передан timezone, обновляет пояс уже существующего."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            if timezone:
+                await cur.execute("""
+                    INSERT INTO users (tg_id, username, timezone)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (tg_id) DO UPDATE SET timezone = EXCLUDED.timezone
+                    WHERE users.timezone IS DISTINCT FROM EXCLUDED.timezone;
+                """, (tg_id, username, timezone))
+            else:
+                await cur.execute("""
+                    INSERT INTO users (tg_id, username)
+                    VALUES (%s, %s)
+                    ON CONFLICT (tg_id) DO NOTHING;
+                """, (tg_id, username))
+
+USER_STATS_QUERY = """
+    SELECT counttask, count_habits, count_complate_task, ratio_complate_habits, days_tracked
+    FROM users WHERE tg_id = %s
+"""
+
+@db_timed
+async def get_dashboard(user_id, date_str=None):
+    """
+    Задачи, привычки и счетчики пользователя для главного экрана Mini App.
+    Списки берутся из кэша, недостающее читается на одном соединении одним
+    pipeline-пакетом (один сетевой круг вместо трех запросов).
+    """
+    tasks_key = ("tasks", user_id, str(date_str) if date_str else None)
+    habits_key = ("habits", user_id)
+    tasks = user_cache.get(tasks_key)
+    habits = user_cache.get(habits_key)
+    version = user_cache.version(user_id)
+
+    async with get_connection() as conn:
+        stats_cur = conn.cursor()
+        tasks_cur = conn.cursor() if tasks is MISSING else None
+        habits_cur = conn.cursor() if habits is MISSING else None
+        async with conn.pipeline():
+            await stats_cur.execute(USER_STATS_QUERY, (user_id,))
+            if tasks_cur:
+                await tasks_cur.execute(*_tasks_query(user_id, date_str))
+            if habits_cur:
+                await habits_cur.execute(HABITS_QUERY, (user_id,))
+        stats = await stats_cur.fetchone()
+        if tasks_cur:
+            tasks = await tasks_cur.fetchall()
+            user_cache.set(tasks_key, tasks, version)
+        if habits_cur:
+            habits = await habits_cur.fetchall()
+            user_cache.set(habits_key, habits, version)
+
+    return {"tasks": tasks, "habits": habits, "stats": stats}
+
+# ================= TASKS =================
+
+@db_timed
+async def add_task(user_id, title, task_date=None):
+    if isinstance(task_date, str):
+        task_date = datetime.strptime(task_date, "%Y-%m-%d").date()
+
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO tasks (user_id, title, task_date) 
+                VALUES (%s, %s, %s)
+            """, (user_id, title, task_date or datetime.now().date()))
+        await conn.commit()
+    user_cache.invalidate_user(user_id)
+
+TASK_COLUMNS = "id, user_id, title, is_completed, task_date"
+
+def _tasks_query(user_id, date_str=None):
+    if date_str:
+        return "SELECT * FROM tasks WHERE user_id = %s AND task_date = %s ORDER BY id DESC", (user_id, date_str)
+    return "SELECT * FROM tasks WHERE user_id = %s ORDER BY id DESC", (user_id,)
+
+@db_timed
+async def get_user_tasks(user_id, date_str=None):
+    key = ("tasks", user_id, str(date_str) if date_str else None)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(*_tasks_query(user_id, date_str))
+            rows = await cur.fetchall()
+    user_cache.set(key, rows, version)
+    return rows
+
+@db_timed
+async def get_user_tasks_range(user_id, start_date, end_date):
+    """
+    Задачи пользователя за период [start_date, end_date] (например, месяц для календаря).
+    Старые задачи, перенесенные в tasks_history, тоже попадают в выборку (только для чтения).
+    """
+    key = ("tasks_range", user_id, str(start_date), str(end_date))
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                SELECT {TASK_COLUMNS} FROM tasks
+                WHERE user_id = %(user_id)s AND task_date BETWEEN %(start)s AND %(end)s
+                UNION ALL
+                SELECT {TASK_COLUMNS} FROM tasks_history
+                WHERE user_id = %(user_id)s AND task_date BETWEEN %(start)s AND %(end)s
+                ORDER BY task_date, id DESC
+            """, {"user_id": user_id, "start": start_date, "end": end_date})
+            rows = await cur.fetchall()
+    user_cache.set(key, rows, version)
+    return rows
+
+@db_timed
+async def toggle_task_status(task_id: int):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                UPDATE tasks
+                SET is_completed = NOT is_completed
+                WHERE id = %s
+                RETURNING user_id;
+            """, (task_id,))
+            owner = await cur.fetchone()
+    _invalidate_owner(owner)
+
+
+@db_timed
+async def delete_completed_tasks():
+    """Удаляет все выполненные задачи (вызывается ежедневно в 00:00)."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            deleted = await _delete_completed_tasks(cur)
+    user_cache.clear()
+    return deleted
+
+async def _delete_completed_tasks(cur, run_date=None, timezone=None):
+    await cur.execute(f"DELETE FROM tasks WHERE is_completed = TRUE AND {_zone_filter('user_id', timezone)}",
+                      {"day": run_date, "tz": timezone})
+    return cur.rowcount
+
+@db_timed
+async def delete_task(task_id: int):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM tasks WHERE id = %s RETURNING user_id", (task_id,))
+            owner = await cur.fetchone()
+    _invalidate_owner(owner)
+
+# Редактирование
+@db_timed
+async def update_task_title(task_id: int, new_title: str):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("UPDATE tasks SET title = %s WHERE id = %s RETURNING user_id", (new_title, task_id))
+            owner = await cur.fetchone()
+    _invalidate_owner(owner)
+
+
+# ============================ HABITS =================
+# Функции для работы с привычками
+@db_timed
+async def add_habit(user_id: int, title: str):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("INSERT INTO habits (user_id, title) VALUES (%s, %s)", (user_id, title))
+    user_cache.invalidate_user(user_id)
+
+HABITS_QUERY = "SELECT id, title, is_complete_today, count_complete FROM habits WHERE user_id = %s"
+
+@db_timed
+async def get_user_habits(user_id: int):
+    key = ("habits", user_id)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(HABITS_QUERY, (user_id,))
+            rows = await cur.fetchall()
+    user_cache.set(key, rows, version)
+    return rows
+
+@db_timed
+async def toggle_habit_status(habit_id: int):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("UPDATE habits SET is_complete_today = NOT is_complete_today WHERE id = %s RETURNING user_id", (habit_id,))
+            owner = await cur.fetchone()
+    _invalidate_owner(owner)
+
+@db_timed
+async def delete_habit(habit_id: int):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM habits WHERE id = %s RETURNING user_id", (habit_id,))
+            owner = await cur.fetchone()
+    _invalidate_owner(owner)
+
+
+@db_timed
+async def update_habit_title(habit_id: int, new_title: str):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("UPDATE habits SET title = %s WHERE id = %s RETURNING user_id", (new_title, habit_id))
+            owner = await cur.fetchone()
+    _invalidate_owner(owner)
+
+
+# ============================ BATCH =================
+# Пакетные операции Mini App: операция -> SQL с именованными параметрами.
+# Все, кроме добавления, ограничены строками самого пользователя.
+# Нарушение ограничений базы (привычка в пачке для несуществующего пользователя):
+# API отвечает на него 4xx, а не 500
+IntegrityError = psycopg.IntegrityError
+
+BATCH_STATEMENTS = {
+    "task.add": "INSERT INTO tasks (user_id, title, task_date) VALUES (%(user_id)s, %(title)s, %(date)s)",
+    "habit.add": "INSERT INTO habits (user_id, title) VALUES (%(user_id)s, %(title)s)",
+    "task.update": "UPDATE tasks SET title = %(title)s WHERE id = %(id)s AND user_id = %(user_id)s",
+    "habit.update": "UPDATE habits SET title = %(title)s WHERE id = %(id)s AND user_id = %(user_id)s",
+    "task.toggle": "UPDATE tasks SET is_completed = NOT is_completed WHERE id = %(id)s AND user_id = %(user_id)s",
+    "habit.toggle": "UPDATE habits SET is_complete_today = NOT is_complete_today WHERE id = %(id)s AND user_id = %(user_id)s",
+    "task.delete": "DELETE FROM tasks WHERE id = %(id)s AND user_id = %(user_id)s",
+    "habit.delete": "DELETE FROM habits WHERE id = %(id)s AND user_id = %(user_id)s",
+}
+# Порядок групп: добавления, переименования, переключения, удаления. Внутри группы
+# порядок операций сохраняется, поэтому итог совпадает с последовательным применением.
+BATCH_ORDER = ["task.add", "habit.add", "task.update", "habit.update",
+               "task.toggle", "habit.toggle", "task.delete", "habit.delete"]
+
+@db_timed
+async def apply_batch(user_id, operations):
+    """
+    Применяет список операций пользователя одной транзакцией: каждая группа
+    однотипных операций уходит одним executemany (pipeline), а не запросом на элемент.
+    operations - словари с ключами op, id, title, date. Возвращает {op: число операций}.
+    """
+    groups = {}
+    for op in operations:
+        params = {"user_id": user_id, "id": op.get("id"), "title": op.get("title"), "date": op.get("date")}
+        if op["op"] == "task.add":
+            task_date = params["date"]
+            if isinstance(task_date, str):
+                task_date = datetime.strptime(task_date, "%Y-%m-%d").date()
+            params["date"] = task_date or datetime.now().date()
+        groups.setdefault(op["op"], []).append(params)
+
+    applied = {}
+    async with get_connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                for name in BATCH_ORDER:
+                    if name in groups:
+                        await cur.executemany(BATCH_STATEMENTS[name], groups[name])
+                        applied[name] = len(groups[name])
+    user_cache.invalidate_user(user_id)
+    return applied
+
+def _zone_filter(column, timezone):
+    """
+    SQL-условие "column - tg_id пользователя из пояса %(tz)s, еще не пересчитанного
+    за %(day)s" для фаз ночного пересчета; без пояса (None) - все пользователи.
+    Отметка last_rollover_date на пользователе, а не только на (день, пояс): после
+    смены пояса тот же день не пересчитывается второй раз.
+
+    Пользователи пояса выбираются один раз (InitPlan по idx_users_timezone), а строки
+    habits, tasks и users - по индексам user_id/tg_id через = ANY. С IN (подзапрос)
+    планировщик соединял пояс с таблицей через Hash Join и проходил ее целиком на
+    каждый пояс.
+    """
+    if timezone is None:
+        return "TRUE"
+    return (f"{column} = ANY(ARRAY(SELECT tg_id FROM users WHERE timezone = %(tz)s"
+            " AND (last_rollover_date IS NULL OR last_rollover_date < %(day)s)))")
+
+@db_timed
+async def update_daily_user_stats():
+    """
+    Обновляет все счетчики пользователей в 23:58.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            updated = await _update_daily_user_stats(cur)
+        await conn.commit()
+    return updated
+
+async def _update_daily_user_stats(cur, run_date=None, timezone=None):
+    """
+    Один UPDATE ... FROM вместо 5 запросов на пользователя: привычки и задачи
+    агрегируются через GROUP BY, пользователи без привычек/задач получают нули.
+    Винрейт - скользящее среднее: ((прошлый_% * дни) + сегодняшний_%) / (дни + 1).
+    timezone ограничивает пересчет пользователями одного пояса.
+    """
+    await cur.execute(f"""
+        UPDATE users u
+        SET
+            days_tracked = u.days_tracked + 1,
+            count_habits = s.total_habits,
+            counttask = s.total_tasks,
+            count_complate_task = u.count_complate_task + s.done_tasks,
+            ratio_complate_habits = trunc(
+                (u.ratio_complate_habits * u.days_tracked
+                 + CASE WHEN s.total_habits > 0 THEN s.done_habits * 100.0 / s.total_habits ELSE 0 END)
+                / (u.days_tracked + 1)
+            )::int
+        FROM (
+            SELECT
+                us.tg_id,
+                COALESCE(h.total, 0) AS total_habits,
+                COALESCE(h.done, 0) AS done_habits,
+                COALESCE(t.total, 0) AS total_tasks,
+                COALESCE(t.done, 0) AS done_tasks
+            FROM users us
+            LEFT JOIN (
+                SELECT user_id, count(*) AS total, count(*) FILTER (WHERE is_complete_today) AS done
+                FROM habits WHERE {_zone_filter("user_id", timezone)} GROUP BY user_id
+            ) h ON h.user_id = us.tg_id
+            LEFT JOIN (
+                SELECT user_id, count(*) AS total, count(*) FILTER (WHERE is_completed) AS done
+                FROM tasks WHERE {_zone_filter("user_id", timezone)} GROUP BY user_id
+            ) t ON t.user_id = us.tg_id
+            WHERE {_zone_filter("us.tg_id", timezone)}
+        ) s
+        WHERE u.tg_id = s.tg_id
+    """, {"day": run_date, "tz": timezone})
+    return cur.rowcount
+
+
+@db_timed
+async def reset_daily_habits():
+    """
+    Увеличивает count_complete на 1 для всех выполненных сегодня привычек
+    и сбрасывает маркер is_complete_today в False для всех привычек.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            updated = await _reset_daily_habits(cur)
+    user_cache.clear()
+    return updated
+
+async def _reset_daily_habits(cur, run_date=None, timezone=None):
+    # Невыполненные привычки уже в False, поэтому достаточно одного UPDATE по выполненным
+    await cur.execute(f"""
+        UPDATE habits
+        SET count_complete = count_complete + 1,
+            is_complete_today = FALSE
+        WHERE is_complete_today = TRUE AND {_zone_filter("user_id", timezone)};
+    """, {"day": run_date, "tz": timezone})
+    return cur.rowcount
+
+
+async def _record_daily_stats(cur, run_date, timezone=None):
+    """
+    Факты дня run_date: привычки (все, is_complete_today) и задачи на этот день.
+    Уже записанная строка не перезаписывается: после сброса привычек и удаления
+    выполненных задач повторный подсчет дал бы нули.
+    """
+    await cur.execute(f"""
+        INSERT INTO user_daily_stats (user_id, day, habits_total, habits_done, tasks_total, tasks_done)
+        SELECT us.tg_id, %(day)s,
+               COALESCE(h.total, 0), COALESCE(h.done, 0),
+               COALESCE(t.total, 0), COALESCE(t.done, 0)
+        FROM users us
+        LEFT JOIN (
+            SELECT user_id, count(*) AS total, count(*) FILTER (WHERE is_complete_today) AS done
+            FROM habits WHERE {_zone_filter("user_id", timezone)} GROUP BY user_id
+        ) h ON h.user_id = us.tg_id
+        LEFT JOIN (
+            SELECT user_id, count(*) AS total, count(*) FILTER (WHERE is_completed) AS done
+            FROM tasks WHERE task_date = %(day)s AND {_zone_filter("user_id", timezone)} GROUP BY user_id
+        ) t ON t.user_id = us.tg_id
+        WHERE (h.user_id IS NOT NULL OR t.user_id IS NOT NULL) AND {_zone_filter("us.tg_id", timezone)}
+        ON CONFLICT (user_id, day) DO NOTHING
+    """, {"day": run_date, "tz": timezone})
+    return cur.rowcount
+
+async def _update_streaks(cur, run_date, timezone=None):
+    """
+    Серии по фактам дня: день засчитан, если выполнено все (привычки и задачи на день).
+    Серия продолжается, только если засчитан предыдущий пересчитанный день
+    пользователя (обычно вчера; после переезда на восток или пропуска - раньше).
+    """
+    await cur.execute(f"""
+        UPDATE users u
+        SET current_streak = s.streak,
+            best_streak = GREATEST(u.best_streak, s.streak),
+            last_complete_day = CASE WHEN s.streak > 0 THEN %(day)s ELSE u.last_complete_day END
+        FROM (
+            SELECT us.tg_id,
+                   CASE
+                       WHEN d.user_id IS NULL OR d.habits_done + d.tasks_done < d.habits_total + d.tasks_total THEN 0
+                       WHEN us.last_complete_day = us.last_rollover_date THEN us.current_streak + 1
+                       ELSE 1
+                   END AS streak
+            FROM users us
+            LEFT JOIN user_daily_stats d ON d.user_id = us.tg_id AND d.day = %(day)s
+            WHERE {_zone_filter("us.tg_id", timezone)}
+        ) s
+        WHERE u.tg_id = s.tg_id
+    """, {"day": run_date, "tz": timezone})
+    return cur.rowcount
+
+async def _mark_rolled_over(cur, run_date, timezone=None):
+    """Отметка о пересчете пользователей за run_date - последней фазой, после нее фазы их не выбирают."""
+    await cur.execute(f"""
+        UPDATE users SET last_rollover_date = %(day)s
+        WHERE {_zone_filter("tg_id", timezone)}
+    """, {"day": run_date, "tz": timezone})
+    return cur.rowcount
+
+# ============================ ROLLOVER =================
+# Фазы по порядку: (имя, функция(cur, run_date, timezone)). Их запросы проверяет
+# и benchmarks/check_query_plans.py
+ROLLOVER_PHASES = (
+    ("daily_stats", _record_daily_stats),
+    ("streaks", _update_streaks),
+    ("user_stats", _update_daily_user_stats),
+    ("reset_habits", _reset_daily_habits),
+    ("delete_completed_tasks", _delete_completed_tasks),
+    ("mark_users", _mark_rolled_over),
+)
+
+@db_timed
+async def run_daily_rollover(run_date: date, timezone: str = DEFAULT_TIMEZONE):
+    """
+    Ночной пересчет за день run_date для пользователей пояса timezone одной
+    транзакцией на одном соединении: 1. дневные факты и серии, 2. статистика
+    пользователей, 3. счетчики привычек, 4. удаление выполненных задач, 5. отметка
+    last_rollover_date у пересчитанных пользователей.
+    Отметка в daily_rollovers вставляется в той же транзакции, поэтому при падении
+    не применяется ничего, а повторный запуск за тот же день и пояс ничего не делает.
+    Пользователь, уже пересчитанный за run_date в другом поясе (сменил пояс),
+    пропускается по users.last_rollover_date.
+    Возвращает словарь с длительностью фаз (сек) или None, если день уже обработан.
+    """
+    timings = {}
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            # Параллельный запуск (другая реплика) подождет здесь и получит конфликт
+            await cur.execute("""
+                INSERT INTO daily_rollovers (run_date, timezone) VALUES (%s, %s)
+                ON CONFLICT (run_date, timezone) DO NOTHING
+            """, (run_date, timezone))
+            if cur.rowcount == 0:
+                return None
+
+            for phase, func in ROLLOVER_PHASES:
+                started = time.perf_counter()
+                rows = await func(cur, run_date, timezone=timezone)
+                timings[phase] = {"seconds": round(time.perf_counter() - started, 3), "rows": rows}
+
+            await cur.execute("""
+                UPDATE daily_rollovers
+                SET finished_at = CURRENT_TIMESTAMP, timings = %s
+                WHERE run_date = %s AND timezone = %s
+            """, (Jsonb(timings), run_date, timezone))
+        await conn.commit()
+    user_cache.clear()
+    return timings
+
+@db_timed
+async def get_user_timezones():
+    """Пояса, в которых есть пользователи (index-only scan по idx_users_timezone)."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT DISTINCT timezone FROM users")
+            return [row['timezone'] for row in await cur.fetchall()]
+
+@db_timed
+async def get_last_rollover_dates():
+    """{пояс: дата последнего успешного ночного пересчета}."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT timezone, max(run_date) AS last_date FROM daily_rollovers GROUP BY timezone")
+            return {row['timezone']: row['last_date'] for row in await cur.fetchall()}
+
+@db_timed
+async def set_user_timezone(tg_id: int, timezone: str):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("UPDATE users SET timezone = %s WHERE tg_id = %s", (timezone, tg_id))
+            return cur.rowcount
+
+# ============================ HISTORY =================
+# Чтение из user_daily_stats: агрегаты по неделям/месяцам считаются по готовым
+# дневным строкам (до ~31 строки на период по первичному ключу), а не по задачам.
+
+@db_timed
+async def get_user_streak(user_id):
+    key = ("streak", user_id)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT current_streak, best_streak, last_complete_day FROM users WHERE tg_id = %s
+            """, (user_id,))
+            row = await cur.fetchone()
+    user_cache.set(key, row, version)
+    return row
+
+@db_timed
+async def get_user_period_stats(user_id, period="week", limit=12):
+    """
+    Выполнение по периодам (period - 'week' или 'month'), последние limit периодов,
+    новые первыми. Проценты - доля выполненного за период, None если нечего было выполнять.
+    Текущий период считается по местному времени пользователя, как и дни user_daily_stats.
+    """
+    key = ("period_stats", user_id, period, limit)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                SELECT date_trunc(%(period)s, day::timestamp)::date AS period_start,
+                       count(*) AS days,
+                       sum(habits_total) AS habits_total,
+                       sum(habits_done) AS habits_done,
+                       sum(tasks_total) AS tasks_total,
+                       sum(tasks_done) AS tasks_done,
+                       round(100.0 * sum(habits_done) / NULLIF(sum(habits_total), 0), 1)::float8 AS habits_rate,
+                       round(100.0 * sum(tasks_done) / NULLIF(sum(tasks_total), 0), 1)::float8 AS tasks_rate
+                FROM user_daily_stats
+                WHERE user_id = %(user_id)s
+                  AND day >= date_trunc(%(period)s, now() AT TIME ZONE COALESCE(
+                          (SELECT timezone FROM users WHERE tg_id = %(user_id)s), %(default_tz)s))
+                      - %(back)s * ('1 ' || %(period)s::text)::interval
+                GROUP BY 1
+                ORDER BY 1 DESC
+            """, {"user_id": user_id, "period": period, "back": limit - 1, "default_tz": DEFAULT_TIMEZONE})
+            rows = await cur.fetchall()
+    user_cache.set(key, rows, version)
+    return rows
+
+# ============================ EVENT =================
+NOTIFY_CHANNEL = "scheduled_notifications"
+
+@db_timed
+async def add_scheduled_notification(user_id, text, scheduled_time, file_id=None, media_type=None):
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO scheduled_notifications (user_id, message_text, scheduled_time, file_id, media_type)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (user_id, text, scheduled_time, file_id, media_type))
+            # Будим планировщики (LISTEN) - уведомление уходит только после commit
+            await cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, scheduled_time.isoformat()))
+        await conn.commit()
+
+# Сегмент рассылки "filter": условия по счетчикам users, объединенные через AND.
+# Поля и операторы - только из этих списков (подставляются в SQL как есть).
+BROADCAST_FILTER_FIELDS = {"counttask", "count_habits", "count_complate_task", "ratio_complate_habits",
+                           "days_tracked", "current_streak", "best_streak", "timezone"}
+BROADCAST_FILTER_OPS = {"=", "!=", "<", "<=", ">", ">="}
+
+def _segment_condition(segment):
+    """
+    SQL-условие по users u для сегмента и его параметры:
+    {"type": "all"}, {"type": "ids", "user_ids": [...]},
+    {"type": "filter", "conditions": [{"field": ..., "op": ..., "value": ...}]}.
+    """
+    kind = segment["type"]
+    if kind == "all":
+        return "TRUE", {}
+    if kind == "ids":
+        return "u.tg_id = ANY(%(user_ids)s)", {"user_ids": list(segment["user_ids"])}
+    if kind == "filter":
+        parts, params = [], {}
+        for i, cond in enumerate(segment["conditions"]):
+            if cond["field"] not in BROADCAST_FILTER_FIELDS or cond["op"] not in BROADCAST_FILTER_OPS:
+                raise ValueError(f"Недопустимое условие сегмента: {cond}")
+            parts.append(f"u.{cond['field']} {cond['op']} %(v{i})s")
+            params[f"v{i}"] = cond["value"]
+        return " AND ".join(parts) or "TRUE", params
+    raise ValueError(f"Неизвестный тип сегмента: {kind}")
+
+# Уведомления рассылки одним INSERT ... SELECT; {condition} - из _segment_condition
+BROADCAST_INSERT_SQL = """
+    INSERT INTO scheduled_notifications
+        (user_id, message_text, file_id, media_type, scheduled_time, broadcast_id)
+    SELECT u.tg_id, %(text)s, %(file_id)s, %(media_type)s, %(scheduled_time)s, %(broadcast_id)s
+    FROM users u
+    WHERE {condition}
+"""
+
+@db_timed
+async def create_broadcast(text, scheduled_time, segment, file_id=None, media_type=None):
+    """
+    Рассылка на сегмент: строка broadcasts и по уведомлению на каждого пользователя
+    сегмента одним INSERT ... SELECT в одной транзакции (вместо запроса на пользователя).
+    Возвращает (id рассылки, число уведомлений).
+    """
+    condition, params = _segment_condition(segment)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                INSERT INTO broadcasts (message_text, file_id, media_type, scheduled_time, segment)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            """, (text, file_id, media_type, scheduled_time, Jsonb(segment)))
+            broadcast_id = (await cur.fetchone())['id']
+            await cur.execute(BROADCAST_INSERT_SQL.format(condition=condition), {**params, "text": text, "file_id": file_id, "media_type": media_type,
+                  "scheduled_time": scheduled_time, "broadcast_id": broadcast_id})
+            total = cur.rowcount
+            await cur.execute("UPDATE broadcasts SET total = %s WHERE id = %s", (total, broadcast_id))
+            # Один NOTIFY на всю рассылку - у всех строк один срок
+            await cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, scheduled_time.isoformat()))
+        await conn.commit()
+    return broadcast_id, total
+
+@db_timed
+async def get_broadcast_progress(broadcast_id):
+    """Рассылка и число ее уведомлений по статусам (в очереди и уже в архиве); None - нет такой."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT id, message_text, scheduled_time, segment, total, created_at
+                FROM broadcasts WHERE id = %s
+            """, (broadcast_id,))
+            broadcast = await cur.fetchone()
+            if broadcast is None:
+                return None
+            await cur.execute("""
+                SELECT status, count(*) AS count FROM (
+                    SELECT status FROM scheduled_notifications WHERE broadcast_id = %(id)s
+                    UNION ALL
+                    SELECT status FROM scheduled_notifications_history WHERE broadcast_id = %(id)s
+                ) s
+                GROUP BY status
+            """, {"id": broadcast_id})
+            counts = {row['status']: row['count'] for row in await cur.fetchall()}
+    progress = {status: counts.get(status, 0) for status in ("pending", "claimed", "sent", "dead")}
+    done = progress["sent"] + progress["dead"]
+    return {**broadcast, **progress,
+            "done_ratio": round(done / broadcast["total"], 4) if broadcast["total"] else 1.0}
+
+@db_timed
+async def get_upcoming_notification_times(limit=1000):
+    """
+    Ближайшие моменты, когда в очереди что-то станет доступно для захвата
+    (срок отправки, время повтора или истечение чужой аренды) - для таймера планировщика.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT DISTINCT GREATEST(scheduled_time, COALESCE(lease_until, scheduled_time)) AS due_time
+                FROM scheduled_notifications
+                WHERE status IN ('pending', 'claimed')
+                ORDER BY due_time
+                LIMIT %s
+            """, (limit,))
+            return [row['due_time'] for row in await cur.fetchall()]
+
+async def listen_notifications(channel=NOTIFY_CHANNEL):
+    """
+    Асинхронный генератор payload'ов NOTIFY. Использует отдельное соединение
+    вне пула: LISTEN держит его все время работы.
+    """
+    conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True, connect_timeout=10)
+    try:
+        await conn.execute(f"LISTEN {channel}")
+        async for notify in conn.notifies():
+            yield notify.payload
+    finally:
+        await conn.close()
+
+# Текущее московское время в том же виде, что и scheduled_time (TIMESTAMP без зоны)
+MOSCOW_NOW_SQL = "(CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow')"
+
+@db_timed
+async def get_notification_queue_stats():
+    """
+    Глубина живой очереди по статусам, число наступивших и возраст самого старого
+    наступившего (сек) - для /metrics. Читает только частичный индекс idx_notifications_due.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                SELECT status,
+                       count(*) AS depth,
+                       count(*) FILTER (WHERE scheduled_time <= {MOSCOW_NOW_SQL}) AS due,
+                       EXTRACT(EPOCH FROM {MOSCOW_NOW_SQL} - min(scheduled_time)
+                               FILTER (WHERE scheduled_time <= {MOSCOW_NOW_SQL}))::float8 AS oldest_due_seconds
+                FROM scheduled_notifications
+                WHERE status IN ('pending', 'claimed')
+                GROUP BY status
+            """)
+            rows = await cur.fetchall()
+    return {
+        "depth": {row['status']: row['depth'] for row in rows},
+        "due": sum(row['due'] for row in rows),
+        "oldest_due_seconds": max((row['oldest_due_seconds'] or 0 for row in rows), default=None),
+    }
+
+@db_timed
+async def claim_notifications(worker_id, limit=500, lease_seconds=300):
+    """
+    Захватывает до limit наступивших уведомлений для воркера worker_id.
+    FOR UPDATE SKIP LOCKED - параллельные воркеры берут разные строки; захваченная
+    строка арендована до lease_until и, если воркер умер, снова станет доступна.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                UPDATE scheduled_notifications n
+                SET status = 'claimed',
+                    claimed_by = %s,
+                    lease_until = {MOSCOW_NOW_SQL} + make_interval(secs => %s),
+                    attempts = n.attempts + 1
+                WHERE n.id IN (
+                    SELECT id FROM scheduled_notifications
+                    WHERE status IN ('pending', 'claimed')
+                      AND scheduled_time <= {MOSCOW_NOW_SQL}
+                      AND (lease_until IS NULL OR lease_until <= {MOSCOW_NOW_SQL})
+                    ORDER BY scheduled_time
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING n.id, n.user_id, n.message_text, n.file_id, n.media_type, n.scheduled_time, n.attempts
+            """, (worker_id, lease_seconds, limit))
+            return await cur.fetchall()
+
+@db_timed
+async def mark_notifications_sent(notif_ids):
+    """Отмечает пачку уведомлений отправленными одним запросом."""
+    if not notif_ids:
+        return 0
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                UPDATE scheduled_notifications
+                SET status = 'sent', is_sent = TRUE, lease_until = NULL, last_error = NULL
+                WHERE id = ANY(%s)
+            """, (list(notif_ids),))
+            return cur.rowcount
+
+@db_timed
+async def mark_notifications_failed(failures, max_attempts=5, retry_base_seconds=30):
+    """
+    Возвращает неотправленные уведомления в очередь с экспоненциальной задержкой
+    или переводит в dead (постоянная ошибка или исчерпаны попытки).
+    failures - список (id, текст ошибки, постоянная ли ошибка).
+    Возвращает моменты повторов, чтобы планировщик проснулся к ним.
+    """
+    if not failures:
+        return []
+    ids, errors, permanent = (list(column) for column in zip(*failures))
+    # Одно UPDATE на всю пачку: UNNEST разворачивает массивы в строки (id, error, permanent)
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                UPDATE scheduled_notifications AS n
+                SET status = CASE WHEN f.permanent OR n.attempts >= %s THEN 'dead' ELSE 'pending' END,
+                    claimed_by = NULL,
+                    last_error = f.error,
+                    lease_until = {MOSCOW_NOW_SQL} + make_interval(secs => %s * power(2, GREATEST(n.attempts - 1, 0)))
+                FROM UNNEST(%s::bigint[], %s::text[], %s::boolean[]) AS f(id, error, permanent)
+                WHERE n.id = f.id
+                RETURNING n.status, n.lease_until
+            """, (max_attempts, retry_base_seconds, ids, errors, permanent))
+            rows = await cur.fetchall()
+    return [row['lease_until'] for row in rows if row['status'] == 'pending']
+
+# ============================ ARCHIVE =================
+# Политика хранения: сколько дней строки живут в рабочих таблицах до переноса в историю
+ARCHIVE_NOTIFICATIONS_AFTER_DAYS = int(os.getenv("ARCHIVE_NOTIFICATIONS_AFTER_DAYS", 7))   # sent/dead
+ARCHIVE_TASKS_AFTER_DAYS = int(os.getenv("ARCHIVE_TASKS_AFTER_DAYS", 90))                  # невыполненные
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+ARCHIVE_MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", 200))  # на таблицу за один запуск
+
+NOTIFICATION_COLUMNS = ("id, user_id, message_text, file_id, media_type, scheduled_time, is_sent, "
+                        "status, claimed_by, lease_until, attempts, last_error, broadcast_id")
+
+# Перенос одной пачки: DELETE ... RETURNING и INSERT в историю одним оператором.
+# SKIP LOCKED - параллельный запуск на другой реплике берет другие строки.
+# id пачки собираются в массив и удаляются по первичному ключу: с id IN (подзапрос)
+# планировщик на таблице в сотни тысяч строк выбирал Hash Semi Join с Seq Scan
+# на каждую пачку.
+ARCHIVE_STATEMENTS = {
+    "notifications": f"""
+        WITH moved AS (
+            DELETE FROM scheduled_notifications
+            WHERE id = ANY(ARRAY(
+                SELECT id FROM scheduled_notifications
+                WHERE status IN ('sent', 'dead')
+                  AND scheduled_time < {MOSCOW_NOW_SQL} - make_interval(days => %(days)s)
+                ORDER BY scheduled_time
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ))
+            RETURNING {NOTIFICATION_COLUMNS}
+        )
+        INSERT INTO scheduled_notifications_history ({NOTIFICATION_COLUMNS})
+        SELECT {NOTIFICATION_COLUMNS} FROM moved
+    """,
+    "tasks": f"""
+        WITH moved AS (
+            DELETE FROM tasks
+            WHERE id = ANY(ARRAY(
+                SELECT id FROM tasks
+                WHERE is_completed = FALSE
+                  AND task_date < ({MOSCOW_NOW_SQL} - make_interval(days => %(days)s))::date
+                ORDER BY task_date
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ))
+            RETURNING {TASK_COLUMNS}
+        )
+        INSERT INTO tasks_history ({TASK_COLUMNS})
+        SELECT {TASK_COLUMNS} FROM moved
+    """,
+}
+
+async def _archive_table(name, days, batch_size, max_batches):
+    """
+    Переносит строки таблицы пачками по batch_size, каждая пачка - своя короткая
+    транзакция (блокировки и размер WAL за раз ограничены). Останавливается на
+    неполной пачке или после max_batches.
+    """
+    moved = batches = 0
+    started = time.perf_counter()
+    while batches < max_batches:
+        async with get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(ARCHIVE_STATEMENTS[name], {"days": days, "limit": batch_size})
+                count = cur.rowcount
+        batches += 1
+        moved += count
+        if count < batch_size:
+            break
+    return {"rows": moved, "batches": batches, "seconds": round(time.perf_counter() - started, 3)}
+
+@db_timed
+async def archive_old_rows(notifications_days=ARCHIVE_NOTIFICATIONS_AFTER_DAYS, tasks_days=ARCHIVE_TASKS_AFTER_DAYS,
+                           batch_size=ARCHIVE_BATCH_SIZE, max_batches=ARCHIVE_MAX_BATCHES):
+    """
+    Переносит в историю отправленные/мертвые уведомления старше notifications_days
+    и невыполненные задачи старше tasks_days. Отчет (строки, пачки, секунды по
+    таблицам) сохраняется в archive_runs и возвращается.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("INSERT INTO archive_runs DEFAULT VALUES RETURNING id")
+            run_id = (await cur.fetchone())['id']
+
+    report = {
+        "policy": {"notifications_days": notifications_days, "tasks_days": tasks_days,
+                   "batch_size": batch_size, "max_batches": max_batches},
+        "notifications": await _archive_table("notifications", notifications_days, batch_size, max_batches),
+        "tasks": await _archive_table("tasks", tasks_days, batch_size, max_batches),
+    }
+
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                UPDATE archive_runs SET finished_at = CURRENT_TIMESTAMP, report = %s WHERE id = %s
+            """, (Jsonb(report), run_id))
+    if report["tasks"]["rows"]:
+        user_cache.clear()
+    return report
+
+@db_timed
+async def get_archive_runs(limit=10):
+    """Последние запуски архивации с отчетами."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT id, started_at, finished_at, report FROM archive_runs
+                ORDER BY id DESC LIMIT %s
+            """, (limit,))
+            return await cur.fetchall()
@@ -0,0 +1,898 @@
+"""
+Встроенное хранилище на SQLite (STORAGE_BACKEND=sqlite): тот же набор функций,
+что и app/postgres.py, без внешнего сервера. Для локальных прогонов, тестов и
+одноузлового развертывания; STORAGE_PATH=":memory:" - база в памяти процесса.
+
+Одно соединение на процесс: запросы выполняются по очереди (asyncio.Lock) в
+потоке (asyncio.to_thread), каждый вызов - одна транзакция. NOTIFY заменен
+очередью в памяти процесса, поэтому несколько реплик на одной базе не поддерживаются.
+Время "по Москве" считается в Python, даты и время хранятся как ISO-строки.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+
+from app.cache import user_cache, MISSING
+from app.metrics import db_timed
+from config import DEFAULT_TIMEZONE, STORAGE_PATH
+
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("BOOLEAN", lambda value: value not in (b"0", b""))
+sqlite3.register_converter("JSON", json.loads)
+
+# Итоговая схема (эквивалент миграций app/migrations); версия - в PRAGMA user_version
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tg_id INTEGER UNIQUE NOT NULL,
+    username TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    counttask INTEGER DEFAULT 0,
+    count_habits INTEGER DEFAULT 0,
+    count_complate_task INTEGER DEFAULT 0,
+    ratio_complate_habits INTEGER DEFAULT 0,
+    days_tracked INTEGER DEFAULT 0,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    last_complete_day DATE,
+    timezone TEXT NOT NULL DEFAULT 'Europe/Moscow',
+    last_rollover_date DATE
+);
+CREATE INDEX IF NOT EXISTS idx_users_timezone ON users(timezone, tg_id);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    is_completed BOOLEAN DEFAULT FALSE,
+    task_date DATE DEFAULT CURRENT_DATE
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_date_id ON tasks(user_id, task_date, id DESC);
+CREATE INDEX IF NOT EXISTS idx_tasks_open_date ON tasks(task_date) WHERE is_completed = FALSE;
+
+CREATE TABLE IF NOT EXISTS habits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    is_complete_today BOOLEAN DEFAULT FALSE,
+    count_complete INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (tg_id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_habits_user_id ON habits(user_id);
+
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    habits_total INTEGER NOT NULL DEFAULT 0,
+    habits_done INTEGER NOT NULL DEFAULT 0,
+    tasks_total INTEGER NOT NULL DEFAULT 0,
+    tasks_done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS daily_rollovers (
+    run_date DATE NOT NULL,
+    timezone TEXT NOT NULL DEFAULT 'Europe/Moscow',
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    timings JSON,
+    PRIMARY KEY (run_date, timezone)
+);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_text TEXT,
+    file_id TEXT,
+    media_type TEXT,
+    scheduled_time TIMESTAMP NOT NULL,
+    segment JSON NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS scheduled_notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    message_text TEXT,
+    file_id TEXT,
+    media_type TEXT,
+    scheduled_time TIMESTAMP NOT NULL,
+    is_sent BOOLEAN DEFAULT FALSE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    claimed_by TEXT,
+    lease_until TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    broadcast_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_due
+    ON scheduled_notifications(scheduled_time) WHERE status IN ('pending', 'claimed');
+CREATE INDEX IF NOT EXISTS idx_notifications_finished
+    ON scheduled_notifications(scheduled_time) WHERE status IN ('sent', 'dead');
+CREATE INDEX IF NOT EXISTS idx_notifications_broadcast
+    ON scheduled_notifications(broadcast_id, status) WHERE broadcast_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS tasks_history (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    is_completed BOOLEAN,
+    task_date DATE,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_history_user_date ON tasks_history(user_id, task_date, id DESC);
+
+CREATE TABLE IF NOT EXISTS scheduled_notifications_history (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    message_text TEXT,
+    file_id TEXT,
+    media_type TEXT,
+    scheduled_time TIMESTAMP NOT NULL,
+    is_sent BOOLEAN,
+    status TEXT NOT NULL,
+    claimed_by TEXT,
+    lease_until TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    broadcast_id INTEGER,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_history_broadcast
+    ON scheduled_notifications_history(broadcast_id, status) WHERE broadcast_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS archive_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    report JSON
+);
+"""
+
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+
+_conn = None
+_lock = asyncio.Lock()
+
+def _connect():
+    conn = sqlite3.connect(STORAGE_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                           check_same_thread=False)
+    conn.row_factory = lambda cur, row: {col[0]: value for col, value in zip(cur.description, row)}
+    if STORAGE_PATH != ":memory:":
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+async def open_pool():
+    """Открывает соединение с файлом STORAGE_PATH (вызывается при старте)."""
+    global _conn
+    if _conn is None:
+        _conn = await asyncio.to_thread(_connect)
+
+async def close_pool():
+    global _conn
+    async with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def get_pool_stats():
+    busy = int(_lock.locked())
+    return {"backend": "sqlite", "path": STORAGE_PATH, "pool_size": 1,
+            "pool_available": 1 - busy, "pool_in_use": busy}
+
+def _transaction(func, *args):
+    with _conn:  # commit при успехе, rollback при исключении
+        return func(_conn, *args)
+
+async def _run(func, *args):
+    """Выполняет func(conn, *args) одной транзакцией в потоке, по одному вызову за раз."""
+    if _conn is None:
+        raise RuntimeError("Хранилище не открыто: сначала open_pool()")
+    async with _lock:
+        return await asyncio.to_thread(_transaction, func, *args)
+
+async def _fetchall(query, params=()):
+    return await _run(lambda conn: conn.execute(query, params).fetchall())
+
+async def _fetchone(query, params=()):
+    return await _run(lambda conn: conn.execute(query, params).fetchone())
+
+async def _execute(query, params=()):
+    return await _run(lambda conn: conn.execute(query, params).rowcount)
+
+def _invalidate_owner(row):
+    if row:
+        user_cache.invalidate_user(row['user_id'])
+
+def _moscow_now():
+    """Текущее московское время в том же виде, что и scheduled_time (без зоны)."""
+    return datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+
+# Обновление базы, созданной прежней версией схемы: версия -> скрипт до нее
+SCHEMA_UPGRADES = {
+    2: """
+        ALTER TABLE users ADD COLUMN last_rollover_date DATE;
+        UPDATE users SET last_rollover_date = (
+            SELECT max(run_date) FROM daily_rollovers d WHERE d.timezone = users.timezone);
+    """,
+}
+
+async def migrate():
+    """Создает схему или обновляет ее, если версия базы (user_version) меньше SCHEMA_VERSION."""
+    def apply(conn):
+        version = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+        if version >= SCHEMA_VERSION:
+            return []
+        started = time.perf_counter()
+        if version == 0:
+            conn.executescript(SCHEMA)
+        else:
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                conn.executescript(SCHEMA_UPGRADES[target])
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return [(SCHEMA_VERSION, "sqlite_schema", int((time.perf_counter() - started) * 1000))]
+    return await _run(apply)
+
+# ================= USERS =================
+
+@db_timed
+async def add_user(tg_id: int, username: str, timezone: str = None):
+    """Регистрирует пользователя; если передан timezone, обновляет пояс уже существующего."""
+    if timezone:
+        await _execute("""
+            INSERT INTO users (tg_id, username, timezone) VALUES (?, ?, ?)
+            ON CONFLICT (tg_id) DO UPDATE SET timezone = excluded.timezone
+            WHERE users.timezone IS NOT excluded.timezone
+        """, (tg_id, username, timezone))
+    else:
+        await _execute("INSERT INTO users (tg_id, username) VALUES (?, ?) ON CONFLICT (tg_id) DO NOTHING",
+                       (tg_id, username))
+
+USER_STATS_QUERY = """
+    SELECT counttask, count_habits, count_complate_task, ratio_complate_habits, days_tracked
+    FROM users WHERE tg_id = ?
+"""
+
+@db_timed
+async def get_dashboard(user_id, date_str=None):
+    """Задачи, привычки и счетчики пользователя для главного экрана Mini App (одна транзакция)."""
+    tasks_key = ("tasks", user_id, str(date_str) if date_str else None)
+    habits_key = ("habits", user_id)
+    tasks = user_cache.get(tasks_key)
+    habits = user_cache.get(habits_key)
+    version = user_cache.version(user_id)
+
+    def read(conn):
+        result = {"tasks": tasks, "habits": habits, "stats": conn.execute(USER_STATS_QUERY, (user_id,)).fetchone()}
+        if tasks is MISSING:
+            result["tasks"] = conn.execute(*_tasks_query(user_id, date_str)).fetchall()
+        if habits is MISSING:
+            result["habits"] = conn.execute(HABITS_QUERY, (user_id,)).fetchall()
+        return result
+    result = await _run(read)
+    # Кэш не потокобезопасен: заполняется в цикле событий, а не в потоке запроса
+    if tasks is MISSING:
+        user_cache.set(tasks_key, result["tasks"], version)
+    if habits is MISSING:
+        user_cache.set(habits_key, result["habits"], version)
+    return result
+
+# ================= TASKS =================
+
+@db_timed
+async def add_task(user_id, title, task_date=None):
+    if isinstance(task_date, str):
+        task_date = datetime.strptime(task_date, "%Y-%m-%d").date()
+    await _execute("INSERT INTO tasks (user_id, title, task_date) VALUES (?, ?, ?)",
+                   (user_id, title, task_date or datetime.now().date()))
+    user_cache.invalidate_user(user_id)
+
+TASK_COLUMNS = "id, user_id, title, is_completed, task_date"
+
+def _tasks_query(user_id, date_str=None):
+    if date_str:
+        return "SELECT * FROM tasks WHERE user_id = ? AND task_date = ? ORDER BY id DESC", (user_id, str(date_str))
+    return "SELECT * FROM tasks WHERE user_id = ? ORDER BY id DESC", (user_id,)
+
+@db_timed
+async def get_user_tasks(user_id, date_str=None):
+    key = ("tasks", user_id, str(date_str) if date_str else None)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    rows = await _fetchall(*_tasks_query(user_id, date_str))
+    user_cache.set(key, rows, version)
+    return rows
+
+@db_timed
+async def get_user_tasks_range(user_id, start_date, end_date):
+    """Задачи пользователя за период [start_date, end_date] вместе с архивными (tasks_history)."""
+    key = ("tasks_range", user_id, str(start_date), str(end_date))
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    rows = await _fetchall(f"""
+        SELECT {TASK_COLUMNS} FROM tasks
+        WHERE user_id = :user_id AND task_date BETWEEN :start AND :end
+        UNION ALL
+        SELECT {TASK_COLUMNS} FROM tasks_history
+        WHERE user_id = :user_id AND task_date BETWEEN :start AND :end
+        ORDER BY task_date, id DESC
+    """, {"user_id": user_id, "start": str(start_date), "end": str(end_date)})
+    user_cache.set(key, rows, version)
+    return rows
+
+@db_timed
+async def toggle_task_status(task_id: int):
+    _invalidate_owner(await _fetchone(
+        "UPDATE tasks SET is_completed = NOT is_completed WHERE id = ? RETURNING user_id", (task_id,)))
+
+@db_timed
+async def delete_completed_tasks():
+    """Удаляет все выполненные задачи."""
+    deleted = await _run(_delete_completed_tasks)
+    user_cache.clear()
+    return deleted
+
+def _delete_completed_tasks(conn, run_date=None, timezone=None):
+    return conn.execute(f"DELETE FROM tasks WHERE is_completed = TRUE AND {_zone_filter('user_id', timezone)}",
+                        {"day": run_date, "tz": timezone}).rowcount
+
+@db_timed
+async def delete_task(task_id: int):
+    _invalidate_owner(await _fetchone("DELETE FROM tasks WHERE id = ? RETURNING user_id", (task_id,)))
+
+@db_timed
+async def update_task_title(task_id: int, new_title: str):
+    _invalidate_owner(await _fetchone(
+        "UPDATE tasks SET title = ? WHERE id = ? RETURNING user_id", (new_title, task_id)))
+
+# ============================ HABITS =================
+
+@db_timed
+async def add_habit(user_id: int, title: str):
+    await _execute("INSERT INTO habits (user_id, title) VALUES (?, ?)", (user_id, title))
+    user_cache.invalidate_user(user_id)
+
+HABITS_QUERY = "SELECT id, title, is_complete_today, count_complete FROM habits WHERE user_id = ?"
+
+@db_timed
+async def get_user_habits(user_id: int):
+    key = ("habits", user_id)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    rows = await _fetchall(HABITS_QUERY, (user_id,))
+    user_cache.set(key, rows, version)
+    return rows
+
+@db_timed
+async def toggle_habit_status(habit_id: int):
+    _invalidate_owner(await _fetchone(
+        "UPDATE habits SET is_complete_today = NOT is_complete_today WHERE id = ? RETURNING user_id", (habit_id,)))
+
+@db_timed
+async def delete_habit(habit_id: int):
+    _invalidate_owner(await _fetchone("DELETE FROM habits WHERE id = ? RETURNING user_id", (habit_id,)))
+
+@db_timed
+async def update_habit_title(habit_id: int, new_title: str):
+    _invalidate_owner(await _fetchone(
+        "UPDATE habits SET title = ? WHERE id = ? RETURNING user_id", (new_title, habit_id)))
+
+# ============================ BATCH =================
+# Те же операции и порядок групп, что в app/postgres.py
+# Нарушение ограничений базы (привычка в пачке для несуществующего пользователя):
+# API отвечает на него 4xx, а не 500
+IntegrityError = sqlite3.IntegrityError
+
+BATCH_STATEMENTS = {
+    "task.add": "INSERT INTO tasks (user_id, title, task_date) VALUES (:user_id, :title, :date)",
+    "habit.add": "INSERT INTO habits (user_id, title) VALUES (:user_id, :title)",
+    "task.update": "UPDATE tasks SET title = :title WHERE id = :id AND user_id = :user_id",
+    "habit.update": "UPDATE habits SET title = :title WHERE id = :id AND user_id = :user_id",
+    "task.toggle": "UPDATE tasks SET is_completed = NOT is_completed WHERE id = :id AND user_id = :user_id",
+    "habit.toggle": "UPDATE habits SET is_complete_today = NOT is_complete_today WHERE id = :id AND user_id = :user_id",
+    "task.delete": "DELETE FROM tasks WHERE id = :id AND user_id = :user_id",
+    "habit.delete": "DELETE FROM habits WHERE id = :id AND user_id = :user_id",
+}
+BATCH_ORDER = ["task.add", "habit.add", "task.update", "habit.update",
+               "task.toggle", "habit.toggle", "task.delete", "habit.delete"]
+
+@db_timed
+async def apply_batch(user_id, operations):
+    """Применяет список операций пользователя одной транзакцией, группа - один executemany."""
+    groups = {}
+    for op in operations:
+        params = {"user_id": user_id, "id": op.get("id"), "title": op.get("title"), "date": op.get("date")}
+        if op["op"] == "task.add":
+            task_date = params["date"]
+            if isinstance(task_date, str):
+                task_date = datetime.strptime(task_date, "%Y-%m-%d").date()
+            params["date"] = task_date or datetime.now().date()
+        groups.setdefault(op["op"], []).append(params)
+
+    def apply(conn):
+        applied = {}
+        for name in BATCH_ORDER:
+            if name in groups:
+                conn.executemany(BATCH_STATEMENTS[name], groups[name])
+                applied[name] = len(groups[name])
+        return applied
+    applied = await _run(apply)
+    user_cache.invalidate_user(user_id)
+    return applied
+
+# ============================ ROLLOVER =================
+# Фазы ночного пересчета - те же запросы, что в app/postgres.py, в диалекте SQLite.
+
+def _zone_filter(column, timezone):
+    if timezone is None:
+        return "TRUE"
+    return (f"{column} IN (SELECT tg_id FROM users WHERE timezone = :tz"
+            " AND (last_rollover_date IS NULL OR last_rollover_date < :day))")
+
+def _day_totals(timezone, day=None):
+    """Подзапросы h/t: всего и выполнено привычек и задач (на день day, если задан) по пользователям."""
+    task_day = "task_date = :day AND " if day else ""
+    return f"""
+        LEFT JOIN (
+            SELECT user_id, count(*) AS total, sum(is_complete_today) AS done
+            FROM habits WHERE {_zone_filter("user_id", timezone)} GROUP BY user_id
+        ) h ON h.user_id = us.tg_id
+        LEFT JOIN (
+            SELECT user_id, count(*) AS total, sum(is_completed) AS done
+            FROM tasks WHERE {task_day}{_zone_filter("user_id", timezone)} GROUP BY user_id
+        ) t ON t.user_id = us.tg_id
+    """
+
+@db_timed
+async def update_daily_user_stats():
+    return await _run(_update_daily_user_stats)
+
+def _update_daily_user_stats(conn, run_date=None, timezone=None):
+    return conn.execute(f"""
+        UPDATE users AS u
+        SET
+            days_tracked = u.days_tracked + 1,
+            count_habits = s.total_habits,
+            counttask = s.total_tasks,
+            count_complate_task = u.count_complate_task + s.done_tasks,
+            ratio_complate_habits = CAST(
+                (u.ratio_complate_habits * u.days_tracked
+                 + CASE WHEN s.total_habits > 0 THEN s.done_habits * 100.0 / s.total_habits ELSE 0 END)
+                / (u.days_tracked + 1) AS INTEGER)
+        FROM (
+            SELECT us.tg_id,
+                   COALESCE(h.total, 0) AS total_habits, COALESCE(h.done, 0) AS done_habits,
+                   COALESCE(t.total, 0) AS total_tasks, COALESCE(t.done, 0) AS done_tasks
+            FROM users us
+            {_day_totals(timezone)}
+            WHERE {_zone_filter("us.tg_id", timezone)}
+        ) AS s
+        WHERE u.tg_id = s.tg_id
+    """, {"day": run_date, "tz": timezone}).rowcount
+
+@db_timed
+async def reset_daily_habits():
+    updated = await _run(_reset_daily_habits)
+    user_cache.clear()
+    return updated
+
+def _reset_daily_habits(conn, run_date=None, timezone=None):
+    return conn.execute(f"""
+        UPDATE habits
+        SET count_complete = count_complete + 1, is_complete_today = FALSE
+        WHERE is_complete_today = TRUE AND {_zone_filter("user_id", timezone)}
+    """, {"day": run_date, "tz": timezone}).rowcount
+
+def _record_daily_stats(conn, run_date, timezone=None):
+    return conn.execute(f"""
+        INSERT INTO user_daily_stats (user_id, day, habits_total, habits_done, tasks_total, tasks_done)
+        SELECT us.tg_id, :day,
+               COALESCE(h.total, 0), COALESCE(h.done, 0),
+               COALESCE(t.total, 0), COALESCE(t.done, 0)
+        FROM users us
+        {_day_totals(timezone, run_date)}
+        WHERE (h.user_id IS NOT NULL OR t.user_id IS NOT NULL) AND {_zone_filter("us.tg_id", timezone)}
+        ON CONFLICT (user_id, day) DO NOTHING
+    """, {"day": run_date, "tz": timezone}).rowcount
+
+def _update_streaks(conn, run_date, timezone=None):
+    return conn.execute(f"""
+        UPDATE users AS u
+        SET current_streak = s.streak,
+            best_streak = max(u.best_streak, s.streak),
+            last_complete_day = CASE WHEN s.streak > 0 THEN :day ELSE u.last_complete_day END
+        FROM (
+            SELECT us.tg_id,
+                   CASE
+                       WHEN d.user_id IS NULL OR d.habits_done + d.tasks_done < d.habits_total + d.tasks_total THEN 0
+                       WHEN us.last_complete_day = us.last_rollover_date THEN us.current_streak + 1
+                       ELSE 1
+                   END AS streak
+            FROM users us
+            LEFT JOIN user_daily_stats d ON d.user_id = us.tg_id AND d.day = :day
+            WHERE {_zone_filter("us.tg_id", timezone)}
+        ) AS s
+        WHERE u.tg_id = s.tg_id
+    """, {"day": run_date, "tz": timezone}).rowcount
+
+def _mark_rolled_over(conn, run_date, timezone=None):
+    return conn.execute(f"UPDATE users SET last_rollover_date = :day WHERE {_zone_filter('tg_id', timezone)}",
+                        {"day": run_date, "tz": timezone}).rowcount
+
+ROLLOVER_PHASES = (
+    ("daily_stats", _record_daily_stats),
+    ("streaks", _update_streaks),
+    ("user_stats", _update_daily_user_stats),
+    ("reset_habits", _reset_daily_habits),
+    ("delete_completed_tasks", _delete_completed_tasks),
+    ("mark_users", _mark_rolled_over),
+)
+
+@db_timed
+async def run_daily_rollover(run_date: date, timezone: str = DEFAULT_TIMEZONE):
+    """
+    Ночной пересчет за день run_date для пояса timezone одной транзакцией (см. app/postgres.py).
+    Возвращает длительность фаз или None, если день уже обработан.
+    """
+    def rollover(conn):
+        inserted = conn.execute("""
+            INSERT INTO daily_rollovers (run_date, timezone) VALUES (?, ?)
+            ON CONFLICT (run_date, timezone) DO NOTHING
+        """, (run_date, timezone)).rowcount
+        if not inserted:
+            return None
+        timings = {}
+        for phase, func in ROLLOVER_PHASES:
+            started = time.perf_counter()
+            rows = func(conn, run_date, timezone=timezone)
+            timings[phase] = {"seconds": round(time.perf_counter() - started, 3), "rows": rows}
+        conn.execute("""
+            UPDATE daily_rollovers SET finished_at = CURRENT_TIMESTAMP, timings = ?
+            WHERE run_date = ? AND timezone = ?
+        """, (json.dumps(timings), run_date, timezone))
+        return timings
+    timings = await _run(rollover)
+    if timings is not None:
+        user_cache.clear()
+    return timings
+
+@db_timed
+async def get_user_timezones():
+    return [row['timezone'] for row in await _fetchall("SELECT DISTINCT timezone FROM users")]
+
+@db_timed
+async def get_last_rollover_dates():
+    rows = await _fetchall('SELECT timezone, max(run_date) AS "last_date [DATE]" FROM daily_rollovers GROUP BY timezone')
+    return {row['timezone']: row['last_date'] for row in rows}
+
+@db_timed
+async def set_user_timezone(tg_id: int, timezone: str):
+    return await _execute("UPDATE users SET timezone = ? WHERE tg_id = ?", (timezone, tg_id))
+
+# ============================ HISTORY =================
+
+@db_timed
+async def get_user_streak(user_id):
+    key = ("streak", user_id)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    row = await _fetchone("SELECT current_streak, best_streak, last_complete_day FROM users WHERE tg_id = ?",
+                          (user_id,))
+    user_cache.set(key, row, version)
+    return row
+
+def _period_start(day, period):
+    return day - timedelta(days=day.weekday()) if period == "week" else day.replace(day=1)
+
+def _periods_back(start, period, count):
+    if period == "week":
+        return start - timedelta(weeks=count)
+    months = start.year * 12 + start.month - 1 - count
+    return date(months // 12, months % 12 + 1, 1)
+
+@db_timed
+async def get_user_period_stats(user_id, period="week", limit=12):
+    """
+    Выполнение по периодам (period - 'week' или 'month'), последние limit периодов,
+    новые первыми. Дневные строки суммируются в Python (date_trunc в SQLite нет).
+    """
+    key = ("period_stats", user_id, period, limit)
+    cached = user_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    version = user_cache.version(user_id)
+    # Текущий период - по местному времени пользователя, как и дни user_daily_stats
+    user = await _fetchone("SELECT timezone FROM users WHERE tg_id = ?", (user_id,))
+    today = datetime.now(ZoneInfo(user["timezone"] if user else DEFAULT_TIMEZONE)).date()
+    since = _periods_back(_period_start(today, period), period, limit - 1)
+    days = await _fetchall("""
+        SELECT day, habits_total, habits_done, tasks_total, tasks_done
+        FROM user_daily_stats WHERE user_id = ? AND day >= ?
+    """, (user_id, since))
+
+    periods = {}
+    for row in days:
+        start = _period_start(row['day'], period)
+        agg = periods.setdefault(start, {"period_start": start, "days": 0, "habits_total": 0, "habits_done": 0,
+                                         "tasks_total": 0, "tasks_done": 0})
+        agg["days"] += 1
+        for field in ("habits_total", "habits_done", "tasks_total", "tasks_done"):
+            agg[field] += row[field]
+    rows = []
+    for start in sorted(periods, reverse=True):
+        agg = periods[start]
+        agg["habits_rate"] = round(100.0 * agg["habits_done"] / agg["habits_total"], 1) if agg["habits_total"] else None
+        agg["tasks_rate"] = round(100.0 * agg["tasks_done"] / agg["tasks_total"], 1) if agg["tasks_total"] else None
+        rows.append(agg)
+    user_cache.set(key, rows, version)
+    return rows
+
+# ============================ EVENT =================
+NOTIFY_CHANNEL = "scheduled_notifications"
+
+# Подписчики listen_notifications в этом процессе: канал -> очереди
+_listeners = {}
+
+def _notify(channel, payload):
+    """Аналог pg_notify: вызывается после commit."""
+    for queue in _listeners.get(channel, ()):
+        queue.put_nowait(payload)
+
+async def listen_notifications(channel=NOTIFY_CHANNEL):
+    """Асинхронный генератор payload'ов _notify (только внутри процесса)."""
+    queue = asyncio.Queue()
+    _listeners.setdefault(channel, set()).add(queue)
+    try:
+        while True:
+            yield await queue.get()
+    finally:
+        _listeners[channel].discard(queue)
+
+@db_timed
+async def add_scheduled_notification(user_id, text, scheduled_time, file_id=None, media_type=None):
+    await _execute("""
+        INSERT INTO scheduled_notifications (user_id, message_text, scheduled_time, file_id, media_type)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, text, scheduled_time, file_id, media_type))
+    _notify(NOTIFY_CHANNEL, scheduled_time.isoformat())
+
+# Допустимые поля и операторы сегмента "filter" - те же, что в app/postgres.py
+BROADCAST_FILTER_FIELDS = {"counttask", "count_habits", "count_complate_task", "ratio_complate_habits",
+                           "days_tracked", "current_streak", "best_streak", "timezone"}
+BROADCAST_FILTER_OPS = {"=", "!=", "<", "<=", ">", ">="}
+
+def _segment_condition(segment):
+    kind = segment["type"]
+    if kind == "all":
+        return "TRUE", {}
+    if kind == "ids":
+        return "u.tg_id IN (SELECT value FROM json_each(:user_ids))", {"user_ids": json.dumps(list(segment["user_ids"]))}
+    if kind == "filter":
+        parts, params = [], {}
+        for i, cond in enumerate(segment["conditions"]):
+            if cond["field"] not in BROADCAST_FILTER_FIELDS or cond["op"] not in BROADCAST_FILTER_OPS:
+                raise ValueError(f"Недопустимое условие сегмента: {cond}")
+            parts.append(f"u.{cond['field']} {cond['op']} :v{i}")
+            params[f"v{i}"] = cond["value"]
+        return " AND ".join(parts) or "TRUE", params
+    raise ValueError(f"Неизвестный тип сегмента: {kind}")
+
+@db_timed
+async def create_broadcast(text, scheduled_time, segment, file_id=None, media_type=None):
+    """Рассылка на сегмент одним INSERT ... SELECT. Возвращает (id рассылки, число уведомлений)."""
+    condition, params = _segment_condition(segment)
+
+    def create(conn):
+        broadcast_id = conn.execute("""
+            INSERT INTO broadcasts (message_text, file_id, media_type, scheduled_time, segment)
+            VALUES (?, ?, ?, ?, ?)
+        """, (text, file_id, media_type, scheduled_time, json.dumps(segment))).lastrowid
+        total = conn.execute(f"""
+            INSERT INTO scheduled_notifications
+                (user_id, message_text, file_id, media_type, scheduled_time, broadcast_id)
+            SELECT u.tg_id, :text, :file_id, :media_type, :scheduled_time, :broadcast_id
+            FROM users u
+            WHERE {condition}
+        """, {**params, "text": text, "file_id": file_id, "media_type": media_type,
+              "scheduled_time": scheduled_time, "broadcast_id": broadcast_id}).rowcount
+        conn.execute("UPDATE broadcasts SET total = ? WHERE id = ?", (total, broadcast_id))
+        return broadcast_id, total
+    result = await _run(create)
+    _notify(NOTIFY_CHANNEL, scheduled_time.isoformat())
+    return result
+
+@db_timed
+async def get_broadcast_progress(broadcast_id):
+    """Рассылка и число ее уведомлений по статусам; None - нет такой."""
+    def read(conn):
+        broadcast = conn.execute("""
+            SELECT id, message_text, scheduled_time, segment, total, created_at FROM broadcasts WHERE id = ?
+        """, (broadcast_id,)).fetchone()
+        if broadcast is None:
+            return None, {}
+        rows = conn.execute("""
+            SELECT status, count(*) AS count FROM (
+                SELECT status FROM scheduled_notifications WHERE broadcast_id = :id
+                UNION ALL
+                SELECT status FROM scheduled_notifications_history WHERE broadcast_id = :id
+            ) GROUP BY status
+        """, {"id": broadcast_id}).fetchall()
+        return broadcast, {row['status']: row['count'] for row in rows}
+    broadcast, counts = await _run(read)
+    if broadcast is None:
+        return None
+    progress = {status: counts.get(status, 0) for status in ("pending", "claimed", "sent", "dead")}
+    done = progress["sent"] + progress["dead"]
+    return {**broadcast, **progress,
+            "done_ratio": round(done / broadcast["total"], 4) if broadcast["total"] else 1.0}
+
+@db_timed
+async def get_upcoming_notification_times(limit=1000):
+    rows = await _fetchall("""
+        SELECT DISTINCT max(scheduled_time, COALESCE(lease_until, scheduled_time)) AS "due_time [TIMESTAMP]"
+        FROM scheduled_notifications
+        WHERE status IN ('pending', 'claimed')
+        ORDER BY 1
+        LIMIT ?
+    """, (limit,))
+    return [row['due_time'] for row in rows]
+
+@db_timed
+async def get_notification_queue_stats():
+    now = _moscow_now()
+    rows = await _fetchall("""
+        SELECT status,
+               count(*) AS depth,
+               sum(scheduled_time <= :now) AS due,
+               min(CASE WHEN scheduled_time <= :now THEN scheduled_time END) AS "oldest_due [TIMESTAMP]"
+        FROM scheduled_notifications
+        WHERE status IN ('pending', 'claimed')
+        GROUP BY status
+    """, {"now": now})
+    return {
+        "depth": {row['status']: row['depth'] for row in rows},
+        "due": sum(row['due'] for row in rows),
+        "oldest_due_seconds": max(((now - row['oldest_due']).total_seconds() if row['oldest_due'] else 0
+                                   for row in rows), default=None),
+    }
+
+@db_timed
+async def claim_notifications(worker_id, limit=500, lease_seconds=300):
+    """
+    Захватывает до limit наступивших уведомлений. Запросы к базе идут по одному,
+    поэтому выборка и UPDATE в одной транзакции не пересекаются с другими захватами.
+    """
+    now = _moscow_now()
+    return await _fetchall("""
+        UPDATE scheduled_notifications
+        SET status = 'claimed', claimed_by = :worker, lease_until = :lease, attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM scheduled_notifications
+            WHERE status IN ('pending', 'claimed')
+              AND scheduled_time <= :now
+              AND (lease_until IS NULL OR lease_until <= :now)
+            ORDER BY scheduled_time
+            LIMIT :limit
+        )
+        RETURNING id, user_id, message_text, file_id, media_type,
+                  scheduled_time AS "scheduled_time [TIMESTAMP]", attempts
+    """, {"worker": worker_id, "lease": now + timedelta(seconds=lease_seconds), "now": now, "limit": limit})
+
+@db_timed
+async def mark_notifications_sent(notif_ids):
+    if not notif_ids:
+        return 0
+    return await _execute("""
+        UPDATE scheduled_notifications
+        SET status = 'sent', is_sent = TRUE, lease_until = NULL, last_error = NULL
+        WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(notif_ids)),))
+
+@db_timed
+async def mark_notifications_failed(failures, max_attempts=5, retry_base_seconds=30):
+    """Возвращает неотправленные в очередь с экспоненциальной задержкой или переводит в dead."""
+    if not failures:
+        return []
+    # Одно UPDATE на всю пачку: json_each разворачивает [id, error, permanent] в строки
+    rows = await _fetchall("""
+        UPDATE scheduled_notifications AS n
+        SET status = CASE WHEN f.permanent OR n.attempts >= :max_attempts THEN 'dead' ELSE 'pending' END,
+            claimed_by = NULL,
+            last_error = f.error,
+            lease_until = datetime(:now, '+' || (:retry_base * (1 << max(n.attempts - 1, 0))) || ' seconds')
+        FROM (SELECT json_extract(value, '$[0]') AS id, json_extract(value, '$[1]') AS error,
+                     json_extract(value, '$[2]') AS permanent
+              FROM json_each(:failures)) AS f
+        WHERE n.id = f.id
+        RETURNING status, lease_until
+    """, {"max_attempts": max_attempts, "retry_base": retry_base_seconds, "now": _moscow_now(),
+          "failures": json.dumps([list(failure) for failure in failures])})
+    return [row['lease_until'] for row in rows if row['status'] == 'pending']
+
+# ============================ ARCHIVE =================
+# Политика хранения - те же переменные окружения, что и для PostgreSQL
+ARCHIVE_NOTIFICATIONS_AFTER_DAYS = int(os.getenv("ARCHIVE_NOTIFICATIONS_AFTER_DAYS", 7))   # sent/dead
+ARCHIVE_TASKS_AFTER_DAYS = int(os.getenv("ARCHIVE_TASKS_AFTER_DAYS", 90))                  # невыполненные
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+ARCHIVE_MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", 200))
+
+NOTIFICATION_COLUMNS = ("id, user_id, message_text, file_id, media_type, scheduled_time, is_sent, "
+                        "status, claimed_by, lease_until, attempts, last_error, broadcast_id")
+
+# (таблица, история, колонки, выборка пачки id по :cutoff и :limit)
+ARCHIVE_TABLES = {
+    "notifications": ("scheduled_notifications", "scheduled_notifications_history", NOTIFICATION_COLUMNS, """
+        SELECT id FROM scheduled_notifications
+        WHERE status IN ('sent', 'dead') AND scheduled_time < :cutoff
+        ORDER BY scheduled_time LIMIT :limit
+    """),
+    "tasks": ("tasks", "tasks_history", TASK_COLUMNS, """
+        SELECT id FROM tasks
+        WHERE is_completed = FALSE AND task_date < :cutoff
+        ORDER BY task_date LIMIT :limit
+    """),
+}
+
+def _archive_batch(conn, name, cutoff, batch_size):
+    table, history, columns, select_ids = ARCHIVE_TABLES[name]
+    ids = json.dumps([row['id'] for row in conn.execute(select_ids, {"cutoff": cutoff, "limit": batch_size})])
+    conn.execute(f"""
+        INSERT INTO {history} ({columns})
+        SELECT {columns} FROM {table} WHERE id IN (SELECT value FROM json_each(?))
+    """, (ids,))
+    return conn.execute(f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))", (ids,)).rowcount
+
+async def _archive_table(name, days, batch_size, max_batches):
+    cutoff = _moscow_now() - timedelta(days=days)
+    if name == "tasks":
+        cutoff = cutoff.date()
+    moved = batches = 0
+    started = time.perf_counter()
+    while batches < max_batches:
+        count = await _run(_archive_batch, name, cutoff, batch_size)
+        batches += 1
+        moved += count
+        if count < batch_size:
+            break
+    return {"rows": moved, "batches": batches, "seconds": round(time.perf_counter() - started, 3)}
+
+@db_timed
+async def archive_old_rows(notifications_days=ARCHIVE_NOTIFICATIONS_AFTER_DAYS, tasks_days=ARCHIVE_TASKS_AFTER_DAYS,
+                           batch_size=ARCHIVE_BATCH_SIZE, max_batches=ARCHIVE_MAX_BATCHES):
+    """Переносит старые строки в историю пачками; отчет сохраняется в archive_runs."""
+    run_id = await _run(lambda conn: conn.execute("INSERT INTO archive_runs DEFAULT VALUES").lastrowid)
+    report = {
+        "policy": {"notifications_days": notifications_days, "tasks_days": tasks_days,
+                   "batch_size": batch_size, "max_batches": max_batches},
+        "notifications": await _archive_table("notifications", notifications_days, batch_size, max_batches),
+        "tasks": await _archive_table("tasks", tasks_days, batch_size, max_batches),
+    }
+    await _execute("UPDATE archive_runs SET finished_at = CURRENT_TIMESTAMP, report = ? WHERE id = ?",
+                   (json.dumps(report), run_id))
+    if report["tasks"]["rows"]:
+        user_cache.clear()
+    return report
+
+@db_timed
+async def get_archive_runs(limit=10):
+    return await _fetchall("SELECT id, started_at, finished_at, report FROM archive_runs ORDER BY id DESC LIMIT ?",
+                           (limit,))
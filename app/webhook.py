@@ -0,0 +1,77 @@
+"""
+Прием апдейтов бота через вебхук на том же uvicorn-приложении, что и API.
+
+Маршрут WEBHOOK_PATH объявлен в app/myapi.py и передает запрос сюда через
+app.state.webhook (его выставляет run.py в режиме BOT_MODE=webhook). Telegram
+получает 200 сразу, апдейт обрабатывается в фоне: одновременно не больше
+concurrency, в очереди реплики не больше max_pending. Сверх этого - 503, и
+Telegram повторит доставку позже (возможно, на другую реплику). При остановке
+новые апдейты тоже получают 503, а принятые дожидается drain().
+"""
+import asyncio
+import hmac
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import Request, Response
+
+import app.metrics as metrics
+from app.lifecycle import lifecycle
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    def __init__(self, bot: Bot, dp: Dispatcher, secret, concurrency, max_pending):
+        if not secret:
+            raise RuntimeError("WEBHOOK_SECRET не задан: без него вебхук принимает апдейты от кого угодно")
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    async def handle(self, request: Request):
+        token = request.headers.get(SECRET_HEADER, "")
+        # Байты, а не str: compare_digest падает TypeError на не-ASCII строках
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return Response(status_code=401)
+        if lifecycle.stopping.is_set():
+            # Реплика останавливается - Telegram доставит апдейт повторно (другой реплике)
+            return Response(status_code=503, headers={"Retry-After": "1"})
+        if self.pending >= self.max_pending:
+            metrics.WEBHOOK_REJECTED.inc()
+            return Response(status_code=503, headers={"Retry-After": "1"})
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as e:  # битый JSON / ValidationError
+            logging.warning(f"Некорректный апдейт вебхука: {e}")
+            return Response(status_code=400)
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        metrics.WEBHOOK_PENDING.set(self.pending)
+        task.add_done_callback(self._done)
+        return Response(status_code=200)
+
+    async def _process(self, update):
+        async with self._semaphore:
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        metrics.WEBHOOK_PENDING.set(self.pending)
+
+    async def drain(self, timeout=None):
+        """Ждет завершения принятых апдейтов (при остановке)."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
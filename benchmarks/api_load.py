@@ -0,0 +1,72 @@
+"""
+Нагрузочный тест API: шлет запросы с разной степенью параллельности и
+показывает, масштабируется ли пропускная способность.
+
+Если запросы к БД блокируют event loop, то при росте concurrency req/s
+почти не растет, а латентность растет линейно (запросы выстраиваются в очередь).
+
+Запуск (сервер уже поднят через `python run.py`):
+    python benchmarks/api_load.py --url http://localhost:8000 --user 1 --requests 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+
+async def _worker(session, url, queue, latencies):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        started = time.perf_counter()
+        async with session.get(url) as resp:
+            await resp.read()
+            # 503 при запуске/остановке и прочие не-2xx - ошибка прогона, а не быстрый ответ
+            if not 200 <= resp.status < 300:
+                raise RuntimeError(f"GET {url}: {resp.status}")
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_level(url, total, concurrency):
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(_worker(session, url, queue, latencies) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--user", type=int, default=1, help="tg_id пользователя, чьи задачи читаем")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--levels", default="1,5,20,50", help="список уровней параллельности")
+    args = parser.parse_args()
+
+    url = f"{args.url.rstrip('/')}/api/tasks/{args.user}"
+    print(f"GET {url}")
+    print(f"{'concurrency':>11} {'req/s':>9} {'p50, мс':>9} {'p95, мс':>9}")
+    for level in (int(x) for x in args.levels.split(",")):
+        r = await run_level(url, args.requests, level)
+        print(f"{r['concurrency']:>11} {r['rps']:>9.1f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
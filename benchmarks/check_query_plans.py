@@ -0,0 +1,271 @@
+"""
+Проверка планов горячих запросов: ни один не должен уходить в Seq Scan.
+
+Создает схему plan_check в базе DATABASE_URL теми же миграциями, что и при
+старте приложения (со всеми индексами), заполняет ее реалистичными объемами, делает ANALYZE и
+прогоняет EXPLAIN для каждого запроса. Код выхода 1, если найден Seq Scan
+по одной из таблиц приложения или план не использует индекс из EXPECTED_INDEXES.
+Таблицы истории тоже заполняются: на пустых планировщик выбирает Seq Scan.
+Рабочие таблицы (схема public) не трогаются.
+
+Кроме HOT_CALLS проверяются фазы ночного пересчета для одного пояса
+(app.postgres.ROLLOVER_PHASES, условие _zone_filter) и INSERT ... SELECT рассылки
+на сегменты по id и по поясу. Пересчет без пояса и рассылка "all" - заведомо
+полный проход по таблицам и не проверяются.
+
+    DATABASE_URL=postgresql://localhost/taskenforcer_bench python benchmarks/check_query_plans.py
+"""
+import argparse
+import asyncio
+import json
+from datetime import date, datetime
+import os
+import sys
+
+import psycopg
+from psycopg.rows import dict_row
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app.postgres as db  # noqa: E402
+from app.migrations import apply_pending  # noqa: E402
+
+SCHEMA = "plan_check"
+APP_TABLES = {"users", "tasks", "habits", "scheduled_notifications", "tasks_history",
+              "scheduled_notifications_history", "user_daily_stats"}
+
+# Пояса пользователей в seed(): большинство - Москва, остальные делят PLAN_ZONES поровну.
+# План пересчета проверяется для одного небольшого пояса
+PLAN_ZONES = ["Europe/Kaliningrad", "Europe/Samara", "Asia/Yekaterinburg", "Asia/Omsk", "Asia/Novosibirsk",
+              "Asia/Krasnoyarsk", "Asia/Irkutsk", "Asia/Yakutsk", "Asia/Vladivostok", "Asia/Magadan",
+              "Asia/Kamchatka", "Asia/Almaty", "Asia/Tashkent", "Europe/Minsk", "Europe/Berlin"]
+PLAN_TIMEZONE = "Asia/Vladivostok"
+PLAN_DAY = date(2024, 6, 1)
+
+# Индексы, которые план запроса обязан использовать (кроме отсутствия Seq Scan)
+EXPECTED_INDEXES = {
+    "get_user_tasks_range": {"idx_tasks_user_date_id", "idx_tasks_history_user_date"},
+}
+
+# (название, функция app.postgres, аргументы): запросы записываются из самих функций
+# (см. record), поэтому проверяется ровно тот SQL, что выполняет приложение
+HOT_CALLS = [
+    ("get_user_tasks(user, date)", db.get_user_tasks, (42, "2024-06-01")),
+    ("get_user_tasks(user)", db.get_user_tasks, (42,)),
+    ("get_user_habits", db.get_user_habits, (42,)),
+    ("get_user_tasks_range", db.get_user_tasks_range, (42, date(2024, 6, 1), date(2024, 6, 30))),
+    ("delete_completed_tasks", db.delete_completed_tasks, ()),
+    ("claim_notifications", db.claim_notifications, ("plan-check", 500, 300)),
+    ("get_upcoming_notification_times", db.get_upcoming_notification_times, ()),
+    ("mark_notifications_sent", db.mark_notifications_sent, (list(range(1, 501)),)),
+    ("mark_notifications_failed", db.mark_notifications_failed, ([(i, "error", False) for i in range(1, 51)],)),
+]
+
+
+class QueryRecorder:
+    """
+    Соединение и курсор одновременно: запоминает запросы, не выполняя их.
+    Выборки возвращают пустой результат.
+    """
+    rowcount = 0
+
+    def __init__(self):
+        self.queries = []
+
+    async def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    async def fetchall(self):
+        return []
+
+    async def fetchone(self):
+        return None
+
+    def cursor(self):
+        return self
+
+    async def commit(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def record(name, func, *args):
+    """(название, запрос, параметры) запросов func(*args): get_connection на время вызова - QueryRecorder."""
+    recorder = QueryRecorder()
+    original = db.get_connection
+    db.get_connection = lambda: recorder
+    try:
+        await func(*args)
+    finally:
+        db.get_connection = original
+        db.user_cache.clear()
+    if len(recorder.queries) == 1:
+        return [(name, *recorder.queries[0])]
+    return [(f"{name} #{i}", query, params) for i, (query, params) in enumerate(recorder.queries, 1)]
+
+
+async def hot_queries():
+    queries = []
+    for name, func, args in HOT_CALLS:
+        queries.extend(await record(name, func, *args))
+    # Пачка архивации - DELETE ... RETURNING и INSERT в историю одним оператором
+    queries.extend((f"archive_old_rows({name})", statement, {"days": days, "limit": db.ARCHIVE_BATCH_SIZE})
+                   for name, statement, days in (
+                       ("notifications", db.ARCHIVE_STATEMENTS["notifications"], db.ARCHIVE_NOTIFICATIONS_AFTER_DAYS),
+                       ("tasks", db.ARCHIVE_STATEMENTS["tasks"], db.ARCHIVE_TASKS_AFTER_DAYS)))
+    return queries
+
+
+async def rollover_queries(timezone):
+    """(название, запрос, параметры) фаз ночного пересчета для пояса timezone."""
+    queries = []
+    for phase, func in db.ROLLOVER_PHASES:
+        recorder = QueryRecorder()
+        await func(recorder, PLAN_DAY, timezone=timezone)
+        queries.extend((f"run_daily_rollover({phase}, {timezone})", query, params)
+                       for query, params in recorder.queries)
+    return queries
+
+
+def broadcast_queries():
+    """INSERT ... SELECT рассылки для сегментов, которые должны идти по индексам users."""
+    queries = []
+    for name, segment in (
+        ("ids", {"type": "ids", "user_ids": list(range(1, 1001))}),
+        ("timezone", {"type": "filter", "conditions": [{"field": "timezone", "op": "=", "value": PLAN_TIMEZONE}]}),
+    ):
+        condition, params = db._segment_condition(segment)
+        queries.append((f"create_broadcast({name})", db.BROADCAST_INSERT_SQL.format(condition=condition),
+                        {**params, "text": "text", "file_id": None, "media_type": None,
+                         "scheduled_time": datetime(2024, 6, 1, 12, 0), "broadcast_id": 1}))
+    return queries
+
+
+async def seed(conn, cur, users, tasks, habits, notifications, tasks_history, notifications_history):
+    await cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    await cur.execute(f"SET search_path TO {SCHEMA}")
+    await apply_pending(conn)
+    await cur.execute("""
+        INSERT INTO users (tg_id, username, timezone, last_rollover_date)
+        SELECT g, 'user' || g,
+               CASE WHEN random() < 0.7 THEN 'Europe/Moscow'
+                    ELSE (%(zones)s::text[])[1 + (random() * (cardinality(%(zones)s::text[]) - 1))::int] END,
+               %(day)s::date - 1
+        FROM generate_series(1, %(users)s) g
+    """, {"users": users, "zones": PLAN_ZONES, "day": PLAN_DAY})
+    # Выполненные задачи удаляются каждую ночь, поэтому их доля небольшая
+    await cur.execute("""
+        INSERT INTO tasks (user_id, title, is_completed, task_date)
+        SELECT 1 + (random() * (%s - 1))::bigint, 'task', random() < 0.03,
+               DATE '2024-01-01' + (random() * 365)::int
+        FROM generate_series(1, %s)
+    """, (users, tasks))
+    await cur.execute("""
+        INSERT INTO habits (user_id, title, is_complete_today)
+        SELECT 1 + (random() * (%s - 1))::bigint, 'habit', random() < 0.5
+        FROM generate_series(1, %s)
+    """, (users, habits))
+    # Почти вся таблица - уже отправленная история
+    await cur.execute("""
+        INSERT INTO scheduled_notifications (user_id, message_text, scheduled_time, is_sent, status)
+        SELECT 1 + (random() * (%s - 1))::bigint, 'text',
+               now() - interval '30 days' + random() * interval '31 days',
+               s.sent, CASE WHEN s.sent THEN 'sent' ELSE 'pending' END
+        FROM (SELECT random() < 0.98 AS sent FROM generate_series(1, %s)) s
+    """, (users, notifications))
+    # История - то, что архивация перенесла за прошлый год: старые невыполненные
+    # задачи и отправленные уведомления. id - после рабочих таблиц, как при переносе
+    await cur.execute("""
+        INSERT INTO tasks_history (id, user_id, title, is_completed, task_date)
+        SELECT %s + g, 1 + (random() * (%s - 1))::bigint, 'task', FALSE,
+               DATE '2023-01-01' + (random() * 365)::int
+        FROM generate_series(1, %s) g
+    """, (tasks, users, tasks_history))
+    await cur.execute("""
+        INSERT INTO scheduled_notifications_history (id, user_id, message_text, scheduled_time, is_sent, status)
+        SELECT %s + g, 1 + (random() * (%s - 1))::bigint, 'text',
+               now() - interval '400 days' + random() * interval '360 days', s.sent,
+               CASE WHEN s.sent THEN 'sent' ELSE 'dead' END
+        FROM (SELECT g, random() < 0.99 AS sent FROM generate_series(1, %s) g) s
+    """, (notifications, users, notifications_history))
+    # Дневные факты за месяц до PLAN_DAY (строка за день, когда было что выполнять)
+    await cur.execute("""
+        INSERT INTO user_daily_stats (user_id, day, habits_total, habits_done, tasks_total, tasks_done)
+        SELECT u.tg_id, d::date, 3, (random() * 3)::int, 2, (random() * 2)::int
+        FROM generate_series(1, %s) u(tg_id)
+        CROSS JOIN generate_series(%s::date - 30, %s::date - 1, interval '1 day') d
+        WHERE random() < 0.6
+    """, (users, PLAN_DAY, PLAN_DAY))
+    await cur.execute("ANALYZE")
+
+
+def seq_scans(plan):
+    """Все узлы Seq Scan по таблицам приложения в JSON-плане."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in APP_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def index_names(plan):
+    """Имена индексов, по которым читает план."""
+    found = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        found |= index_names(child)
+    return found
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--tasks", type=int, default=500_000)
+    parser.add_argument("--habits", type=int, default=60_000)
+    parser.add_argument("--notifications", type=int, default=300_000)
+    parser.add_argument("--tasks-history", type=int, default=1_000_000)
+    parser.add_argument("--notifications-history", type=int, default=2_000_000)
+    parser.add_argument("--verbose", action="store_true", help="печатать планы целиком")
+    args = parser.parse_args()
+
+    failed = []
+    # autocommit - миграции сами управляют транзакциями
+    conn = await psycopg.AsyncConnection.connect(db.DATABASE_URL, row_factory=dict_row, autocommit=True)
+    try:
+        async with conn.cursor() as cur:
+            await seed(conn, cur, args.users, args.tasks, args.habits, args.notifications,
+                       args.tasks_history, args.notifications_history)
+            queries = await hot_queries() + await rollover_queries(PLAN_TIMEZONE) + broadcast_queries()
+            for name, query, params in queries:
+                # EXPLAIN без ANALYZE: DELETE/FOR UPDATE не выполняются
+                await cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+                plan = (await cur.fetchone())["QUERY PLAN"][0]["Plan"]
+                scans = seq_scans(plan)
+                missing = sorted(EXPECTED_INDEXES.get(name, set()) - index_names(plan))
+                status = "FAIL" if scans or missing else "ok"
+                print(f"[{status:>4}] {name}: {plan['Node Type']}"
+                      + (f" (Seq Scan: {', '.join(scans)})" if scans else "")
+                      + (f" (без индексов: {', '.join(missing)})" if missing else ""))
+                if args.verbose:
+                    print(json.dumps(plan, indent=2))
+                if scans or missing:
+                    failed.append(name)
+    finally:
+        async with conn.cursor() as cur:
+            await cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+    if failed:
+        print(f"Seq Scan или нет ожидаемого индекса в горячих запросах: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Сравнение двух отчетов benchmarks/suite.py (например, до и после коммита).
+
+Печатает каждую числовую метрику обоих отчетов и изменение в процентах.
+Пометка "!" - ухудшение больше --threshold процентов; код выхода 1, если такие есть
+(удобно для CI).
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# Метрики, где больше - лучше; остальные (время, задержки, ошибки) - чем меньше, тем лучше
+HIGHER_IS_BETTER = ("rps", "per_second")
+SKIP = ("meta", "requests", "rows", "concurrency", "notifications.notifications", "bot_api")
+
+
+def flatten(data, prefix=""):
+    """{путь: число}; списки результатов по уровням адресуются как c<concurrency>."""
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict) and "concurrency" in item:
+                flat.update(flatten(item, f"{prefix}c{item['concurrency']}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix.rstrip(".")] = data
+    return flat
+
+
+def skipped(path):
+    parts = path.split(".")
+    return any(s in parts or path.startswith(s) for s in SKIP)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"base: {base['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+
+    base_flat, new_flat = flatten(base), flatten(new)
+    regressions = 0
+    width = max((len(p) for p in base_flat), default=10)
+    for path in sorted(set(base_flat) & set(new_flat)):
+        if skipped(path):
+            continue
+        old, cur = base_flat[path], new_flat[path]
+        if not old:
+            print(f"{path:<{width}} {old:>12} {cur:>12}")
+            continue
+        change = (cur - old) / old * 100
+        worse = -change if path.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        mark = "!" if worse > args.threshold else ""
+        regressions += bool(mark)
+        print(f"{path:<{width}} {old:>12} {cur:>12} {change:>+8.1f}% {mark}")
+
+    if regressions:
+        print(f"Ухудшений больше {args.threshold}%: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
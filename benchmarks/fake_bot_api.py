@@ -0,0 +1,106 @@
+"""
+Фейковый Telegram Bot API для локальных прогонов рассылки.
+
+Отвечает на sendMessage/sendPhoto/sendVideo/sendVoice как настоящий сервер,
+может добавлять задержку и отдавать 429 (RetryAfter) при превышении лимитов.
+Бот подключается к нему через TELEGRAM_API_URL=http://127.0.0.1:8081.
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 30 --global-rate 30
+"""
+import argparse
+import asyncio
+import time
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms=0.0, global_rate=0.0, per_chat_interval=0.0, retry_after=1):
+        self.latency = latency_ms / 1000
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.retry_after = retry_after
+        self.requests = 0
+        self.delivered = 0
+        self.rejected = 0
+        self._window_started = time.monotonic()
+        self._window_count = 0
+        self._chat_last = {}
+        self._message_id = 0
+
+    def _too_many(self, chat_id):
+        now = time.monotonic()
+        if now - self._window_started >= 1:
+            self._window_started, self._window_count = now, 0
+        if self.global_rate and self._window_count >= self.global_rate:
+            return True
+        last = self._chat_last.get(chat_id)
+        if self.per_chat_interval and last is not None and now - last < self.per_chat_interval:
+            return True
+        self._window_count += 1
+        self._chat_last[chat_id] = now
+        return False
+
+    async def handle(self, request):
+        self.requests += 1
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in ("deleteWebhook", "setWebhook"):
+            return web.json_response({"ok": True, "result": True})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "fake"}})
+
+        chat_id = int(data.get("chat_id", 0))
+        if self._too_many(chat_id):
+            self.rejected += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        self.delivered += 1
+        self._message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text") or data.get("caption") or "",
+        }})
+
+    async def handle_stats(self, request):
+        return web.json_response({"requests": self.requests, "delivered": self.delivered, "rejected": self.rejected})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+
+async def start_fake_bot_api(host="127.0.0.1", port=8081, **options):
+    """Запускает сервер в текущем event loop. Возвращает (api, runner); остановка - runner.cleanup()."""
+    api = FakeBotAPI(**options)
+    runner = web.AppRunner(api.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return api, runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--global-rate", type=float, default=0.0, help="сообщений/сек до 429 (0 - без лимита)")
+    parser.add_argument("--per-chat-interval", type=float, default=0.0)
+    args = parser.parse_args()
+    api = FakeBotAPI(args.latency_ms, args.global_rate, args.per_chat_interval)
+    web.run_app(api.make_app(), host=args.host, port=args.port)
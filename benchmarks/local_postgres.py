@@ -0,0 +1,54 @@
+"""
+Временный кластер Postgres для прогонов: initdb во временный каталог, pg_ctl start
+на свободном порту, база bench. Нужны бинарники Postgres в PATH (или PG_BIN).
+Все удаляется в stop().
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+DB_NAME = "bench"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _pg_tool(name):
+    bin_dir = os.getenv("PG_BIN")
+    path = os.path.join(bin_dir, name) if bin_dir else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise RuntimeError(f"Не найден {name}: добавьте бинарники Postgres в PATH или укажите PG_BIN")
+    return path
+
+
+class LocalPostgres:
+    def __init__(self, port=None):
+        self.port = port or _free_port()
+        self.data_dir = None
+
+    @property
+    def url(self):
+        return f"postgresql://postgres@127.0.0.1:{self.port}/{DB_NAME}"
+
+    def start(self):
+        self.data_dir = tempfile.mkdtemp(prefix="taskenforcer-pg-")
+        subprocess.run([_pg_tool("initdb"), "-D", self.data_dir, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, capture_output=True)
+        options = f"-p {self.port} -c listen_addresses=127.0.0.1 -k {self.data_dir}"
+        subprocess.run([_pg_tool("pg_ctl"), "-D", self.data_dir, "-o", options, "-w", "-l",
+                        os.path.join(self.data_dir, "server.log"), "start"], check=True, capture_output=True)
+        subprocess.run([_pg_tool("createdb"), "-h", "127.0.0.1", "-p", str(self.port), "-U", "postgres", DB_NAME],
+                       check=True, capture_output=True)
+        return self.url
+
+    def stop(self):
+        if not self.data_dir:
+            return
+        subprocess.run([_pg_tool("pg_ctl"), "-D", self.data_dir, "-m", "fast", "-w", "stop"], capture_output=True)
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        self.data_dir = None
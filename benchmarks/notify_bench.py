@@ -0,0 +1,77 @@
+"""
+Прогон NotificationDispatcher против фейкового Bot API (без БД).
+
+Поднимает benchmarks/fake_bot_api.py в том же процессе, генерирует N
+уведомлений для M пользователей и печатает счетчики диспетчера и сервера.
+
+    python benchmarks/notify_bench.py --notes 2000 --users 1500 --latency-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "postgresql://unused")  # БД не используется, mark_sent подменен
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from app.notifier import NotificationDispatcher  # noqa: E402
+from benchmarks.fake_bot_api import start_fake_bot_api  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=1500)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--server-rate", type=float, default=30.0, help="лимит фейкового сервера, сообщений/сек")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=30.0, help="лимит диспетчера, сообщений/сек")
+    args = parser.parse_args()
+
+    api, runner = await start_fake_bot_api(port=args.port, latency_ms=args.latency_ms,
+                                           global_rate=args.server_rate, per_chat_interval=1.0)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.port}"))
+    bot = Bot(token="123456:BENCH", session=session)
+
+    marked = []
+
+    async def mark_sent(ids):
+        marked.extend(ids)
+
+    async def mark_failed(failures):
+        return [None] * len(failures)  # все неудачные считаем поставленными на повтор
+
+    notes = [
+        {"id": i, "user_id": 1 + i % args.users, "message_text": f"msg {i}",
+         "file_id": None, "media_type": None, "scheduled_time": None}
+        for i in range(args.notes)
+    ]
+    dispatcher = NotificationDispatcher(bot, concurrency=args.concurrency, global_rate=args.rate,
+                                        mark_sent=mark_sent, mark_failed=mark_failed)
+    try:
+        started = time.perf_counter()
+        await dispatcher.dispatch(notes)
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    print(json.dumps({
+        "notes": args.notes,
+        "seconds": round(elapsed, 2),
+        "per_second": round(args.notes / elapsed, 1),
+        "marked": len(marked),
+        "dispatcher": dispatcher.stats.snapshot(),
+        "server": {"requests": api.requests, "delivered": api.delivered, "rejected": api.rejected},
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,145 @@
+"""
+Бенчмарк ночного пересчета статистики (update_daily_user_stats).
+
+Создает отдельную схему rollup_bench в базе DATABASE_URL, заполняет ее
+синтетическими пользователями/задачами/привычками и замеряет:
+  - legacy: старый вариант (5 запросов на пользователя);
+  - set-based: текущий app.database._update_daily_user_stats (один UPDATE).
+Каждый прогон выполняется в транзакции и откатывается, так что оба варианта
+работают на одинаковых данных. Рабочие таблицы (схема public) не трогаются.
+
+    DATABASE_URL=postgresql://localhost/taskenforcer_bench \\
+        python benchmarks/rollup_bench.py --users 100000 --tasks 1000000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app.postgres as db  # noqa: E402
+
+SCHEMA = "rollup_bench"
+
+
+async def legacy_rollup(cur):
+    """Прежняя реализация: SELECT всех пользователей и 4 count(*) + UPDATE на каждого."""
+    await cur.execute("SELECT tg_id, days_tracked, ratio_complate_habits FROM users")
+    users = await cur.fetchall()
+    for user in users:
+        u_id = user['tg_id']
+        days = user['days_tracked']
+        old_ratio = user['ratio_complate_habits']
+        await cur.execute("SELECT count(*) as total FROM habits WHERE user_id = %s", (u_id,))
+        total_habits = (await cur.fetchone())['total']
+        await cur.execute("SELECT count(*) as done FROM habits WHERE user_id = %s AND is_complete_today = TRUE", (u_id,))
+        done_habits_today = (await cur.fetchone())['done']
+        await cur.execute("SELECT count(*) as total_t FROM tasks WHERE user_id = %s", (u_id,))
+        total_tasks = (await cur.fetchone())['total_t']
+        await cur.execute("SELECT count(*) as done_t FROM tasks WHERE user_id = %s AND is_completed = TRUE", (u_id,))
+        done_tasks_today = (await cur.fetchone())['done_t']
+        today_ratio = (done_habits_today / total_habits * 100) if total_habits > 0 else 0
+        new_ratio = int(((old_ratio * days) + today_ratio) / (days + 1))
+        await cur.execute("""
+            UPDATE users SET days_tracked = days_tracked + 1, count_habits = %s, counttask = %s,
+                count_complate_task = count_complate_task + %s, ratio_complate_habits = %s
+            WHERE tg_id = %s
+        """, (total_habits, total_tasks, done_tasks_today, new_ratio, u_id))
+    return len(users)
+
+
+async def seed(conn, users, tasks, habits):
+    async with conn.cursor() as cur:
+        await cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        await cur.execute(f"SET search_path TO {SCHEMA}")
+        await cur.execute("""
+            CREATE TABLE users (
+                id SERIAL PRIMARY KEY, tg_id BIGINT UNIQUE NOT NULL, username TEXT NOT NULL,
+                counttask INTEGER DEFAULT 0, count_habits INTEGER DEFAULT 0,
+                count_complate_task INTEGER DEFAULT 0, ratio_complate_habits INTEGER DEFAULT 0,
+                days_tracked INTEGER DEFAULT 0
+            )
+        """)
+        await cur.execute("""
+            CREATE TABLE tasks (
+                id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, title TEXT NOT NULL,
+                is_completed BOOLEAN DEFAULT FALSE, task_date DATE DEFAULT CURRENT_DATE
+            )
+        """)
+        await cur.execute("""
+            CREATE TABLE habits (
+                id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, title TEXT NOT NULL,
+                is_complete_today BOOLEAN DEFAULT FALSE, count_complete INTEGER DEFAULT 0
+            )
+        """)
+        await cur.execute("""
+            INSERT INTO users (tg_id, username, days_tracked, ratio_complate_habits)
+            SELECT g, 'user' || g, (random() * 100)::int, (random() * 100)::int
+            FROM generate_series(1, %s) g
+        """, (users,))
+        await cur.execute("""
+            INSERT INTO tasks (user_id, title, is_completed)
+            SELECT 1 + (random() * (%s - 1))::bigint, 'task', random() < 0.4
+            FROM generate_series(1, %s)
+        """, (users, tasks))
+        await cur.execute("""
+            INSERT INTO habits (user_id, title, is_complete_today)
+            SELECT 1 + (random() * (%s - 1))::bigint, 'habit', random() < 0.5
+            FROM generate_series(1, %s)
+        """, (users, habits))
+        await cur.execute("CREATE INDEX ON tasks(user_id)")
+        await cur.execute("CREATE INDEX ON habits(user_id)")
+        await cur.execute("ANALYZE")
+    await conn.commit()
+
+
+async def timed(conn, fn):
+    async with conn.cursor() as cur:
+        started = time.perf_counter()
+        rows = await fn(cur)
+        elapsed = time.perf_counter() - started
+    await conn.rollback()
+    return rows, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--habits", type=int, default=300_000)
+    parser.add_argument("--skip-legacy", action="store_true", help="не запускать старый вариант (на 100k пользователей он идет минутами)")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после прогона")
+    args = parser.parse_args()
+
+    conn = await psycopg.AsyncConnection.connect(db.DATABASE_URL, row_factory=dict_row)
+    try:
+        started = time.perf_counter()
+        await seed(conn, args.users, args.tasks, args.habits)
+        print(f"seed: {args.users} users / {args.tasks} tasks / {args.habits} habits за {time.perf_counter() - started:.1f} c")
+
+        async with conn.cursor() as cur:
+            await cur.execute(f"SET search_path TO {SCHEMA}")
+        await conn.commit()
+
+        if not args.skip_legacy:
+            rows, elapsed = await timed(conn, legacy_rollup)
+            print(f"legacy:    {rows} users за {elapsed:.2f} c")
+        rows, elapsed = await timed(conn, db._update_daily_user_stats)
+        print(f"set-based: {rows} users за {elapsed:.2f} c")
+    finally:
+        if not args.keep:
+            async with conn.cursor() as cur:
+                await cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await conn.commit()
+        await conn.close()
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""
+Микро-бенчмарк сериализации списка задач.
+
+Сравнивает прежний путь FastAPI (jsonable_encoder + JSONResponse на json.dumps)
+с текущим ORJSONResponse на списках из 1k и 10k строк того же вида, что
+возвращает get_user_tasks (dict_row с date).
+
+    python benchmarks/serialization_bench.py --sizes 1000,10000 --repeat 50
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+
+def make_tasks(n):
+    start = date(2024, 1, 1)
+    return [
+        {"id": i, "user_id": 123456789, "title": f"Задача номер {i}",
+         "is_completed": i % 3 == 0, "task_date": start + timedelta(days=i % 365)}
+        for i in range(n)
+    ]
+
+
+def before(rows):
+    return JSONResponse(jsonable_encoder(rows)).body
+
+
+def after(rows):
+    return ORJSONResponse(rows).body
+
+
+def measure(fn, rows, repeat):
+    fn(rows)  # прогрев
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(rows)
+    return (time.perf_counter() - started) / repeat * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'rows':>7} {'before, мс':>11} {'after, мс':>10} {'speedup':>8} {'bytes':>9}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        rows = make_tasks(size)
+        t_before, _ = measure(before, rows, args.repeat)
+        t_after, size_bytes = measure(after, rows, args.repeat)
+        print(f"{size:>7} {t_before:>11.2f} {t_after:>10.2f} {t_before / t_after:>7.1f}x {size_bytes:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Только API (app.myapi) с открытым пулом - без бота и фоновых задач run.py.
+Хранилище открывается и схема проверяется до запуска сервера, затем API
+помечается готовым (иначе маршруты /api/ отвечают 503, см. app/lifecycle.py).
+Поднимается отдельным процессом из benchmarks/suite.py, чтобы клиенты нагрузки
+не делили event loop с сервером.
+
+    DATABASE_URL=postgresql://localhost/taskenforcer_bench python benchmarks/serve_app.py --port 8000
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app.database as db  # noqa: E402
+from app.lifecycle import lifecycle  # noqa: E402
+from app.myapi import app  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    await db.open_pool()
+    try:
+        await db.migrate()
+        lifecycle.mark_ready()
+        config = uvicorn.Config(app, host=args.host, port=args.port, log_level="warning")
+        await uvicorn.Server(config).serve()
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -0,0 +1,340 @@
+"""
+Воспроизводимый прогон производительности для сравнения коммитов.
+
+1. Postgres: временный кластер (--local-pg, нужны initdb/pg_ctl) или база
+   --database-url; во втором случае все создается в схеме bench_suite и удаляется.
+2. Схема - миграциями приложения, данные - generate_series с setseed(--seed):
+   --users/--tasks/--habits/--notifications.
+3. API: benchmarks/serve_app.py отдельным процессом, сценарии dashboard,
+   tasks_range и batch на уровнях параллельности --levels.
+4. Ночной пересчет run_daily_rollover за сегодня (длительность фаз).
+5. Рассылка: claim_notifications + NotificationDispatcher против фейкового Bot API
+   до опустошения очереди.
+
+Отчет - JSON (--out): коммит, параметры, rps и p50/p95/p99 по каждому шагу.
+Сравнение двух отчетов - benchmarks/compare.py.
+
+    python benchmarks/suite.py --local-pg --out before.json
+    python benchmarks/suite.py --database-url postgresql://localhost/taskenforcer_bench --out after.json
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import aiohttp
+import psycopg
+from psycopg.conninfo import make_conninfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.fake_bot_api import start_fake_bot_api  # noqa: E402
+from benchmarks.local_postgres import LocalPostgres  # noqa: E402
+
+SCHEMA = "bench_suite"
+
+
+def percentile(values, q):
+    """q-перцентиль (0..1) по методу ближайшего ранга; values отсортированы."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain"], cwd=ROOT, capture_output=True, text=True).stdout)
+        return {"commit": commit or None, "dirty": dirty}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+# ================= ДАННЫЕ =================
+
+async def prepare_database(url, args):
+    """Схема миграциями приложения и синтетические данные. Возвращает версию сервера."""
+    from app.migrations import apply_pending
+
+    conn = await psycopg.AsyncConnection.connect(url, autocommit=True)
+    try:
+        await apply_pending(conn)
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT setseed(%s)", (args.seed / 2 ** 31,))
+            await cur.execute("""
+                INSERT INTO users (tg_id, username) SELECT g, 'user' || g FROM generate_series(1, %s) g
+            """, (args.users,))
+            # Задачи в пределах +-45 дней от сегодня: есть что показать на главном и в календаре
+            await cur.execute("""
+                INSERT INTO tasks (user_id, title, is_completed, task_date)
+                SELECT 1 + floor(random() * %s)::bigint, 'task', random() < 0.3,
+                       CURRENT_DATE + (floor(random() * 91) - 45)::int
+                FROM generate_series(1, %s)
+            """, (args.users, args.tasks))
+            await cur.execute("""
+                INSERT INTO habits (user_id, title, is_complete_today)
+                SELECT 1 + floor(random() * %s)::bigint, 'habit', random() < 0.5
+                FROM generate_series(1, %s)
+            """, (args.users, args.habits))
+            # Наступившие уведомления - очередь, которую разгребает рассылка
+            await cur.execute("""
+                INSERT INTO scheduled_notifications (user_id, message_text, scheduled_time)
+                SELECT 1 + floor(random() * %s)::bigint, 'bench ' || g,
+                       (CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow') - random() * interval '10 minutes'
+                FROM generate_series(1, %s) g
+            """, (args.users, args.notifications))
+            await cur.execute("ANALYZE")
+            await cur.execute("SHOW server_version")
+            return (await cur.fetchone())[0]
+    finally:
+        await conn.close()
+
+
+# ================= API =================
+
+def api_scenarios(args):
+    """Сценарий -> функция(номер запроса) -> (метод, путь, тело)."""
+    rng = random.Random(args.seed)
+    users = [rng.randint(1, args.users) for _ in range(args.requests)]
+    today = date.today()
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+    return {
+        "dashboard": lambda i: ("GET", f"/api/dashboard/{users[i]}?date={today}", None),
+        "tasks_range": lambda i: ("GET", f"/api/tasks/{users[i]}/range?start={month_start}&end={month_end}", None),
+        "batch": lambda i: ("POST", "/api/batch", {
+            "user_id": users[i],
+            "operations": [{"op": "task.add", "title": f"bench {i}-{k}", "date": str(today)} for k in range(3)],
+        }),
+    }
+
+
+async def run_level(base_url, make_request, total, concurrency):
+    latencies = []
+    errors = []
+    numbers = iter(range(total))
+
+    async def worker(session):
+        for i in numbers:
+            method, path, body = make_request(i)
+            started = time.perf_counter()
+            try:
+                async with session.request(method, base_url + path, json=body) as resp:
+                    await resp.read()
+                    if not 200 <= resp.status < 300:
+                        errors.append(f"{method} {path}: {resp.status}")
+            except aiohttp.ClientError as e:
+                errors.append(f"{method} {path}: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    # Замер ответов с ошибкой (503 до готовности, 422, 500) - не замер API: прогон недействителен
+    if errors:
+        raise RuntimeError(f"Неуспешных ответов: {len(errors)} из {total}, первый - {errors[0]}")
+    return {"concurrency": concurrency, "errors": 0, **latency_summary(latencies, elapsed)}
+
+
+async def start_api(url, port):
+    env = dict(os.environ, DATABASE_URL=url, STORAGE_BACKEND="postgres")
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "benchmarks", "serve_app.py"), "--port", str(port), env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            if proc.returncode is not None:
+                raise RuntimeError(f"serve_app.py завершился с кодом {proc.returncode}")
+            try:
+                # /health отвечает сразу после bind, а API готов только после открытия хранилища
+                async with session.get(base_url + "/health/ready") as resp:
+                    if resp.status == 200:
+                        return proc, base_url
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("API не поднялся за 20 c")
+
+
+async def bench_api(url, args):
+    proc, base_url = await start_api(url, args.api_port)
+    try:
+        results = {}
+        for name, make_request in api_scenarios(args).items():
+            # Прогрев: соединения пула и кэш, результаты не учитываются
+            await run_level(base_url, make_request, min(args.requests, 50), 5)
+            results[name] = [await run_level(base_url, make_request, args.requests, level) for level in args.levels]
+        return results
+    finally:
+        proc.terminate()
+        await proc.wait()
+
+
+# ================= НОЧНЫЕ ЗАДАЧИ И РАССЫЛКА =================
+
+async def bench_rollover():
+    import app.postgres as db
+
+    started = time.perf_counter()
+    timings = await db.run_daily_rollover(date.today(), db.DEFAULT_TIMEZONE)
+    return {"seconds": round(time.perf_counter() - started, 3), "phases": timings}
+
+
+async def bench_notifications(args):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import app.postgres as db
+    from app.notifier import NOTIFY_CLAIM_BATCH, NOTIFY_LEASE_SECONDS, NotificationDispatcher
+
+    api, runner = await start_fake_bot_api(port=args.bot_port, latency_ms=args.bot_latency_ms)
+    bot = Bot(token="123456:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(
+        f"http://127.0.0.1:{args.bot_port}")))
+    dispatcher = NotificationDispatcher(bot, concurrency=args.notify_concurrency, global_rate=args.notify_rate,
+                                        per_chat_interval=0)
+    claim_seconds = []
+    try:
+        started = time.perf_counter()
+        while True:
+            claim_started = time.perf_counter()
+            claimed = await db.claim_notifications("bench-suite", NOTIFY_CLAIM_BATCH, NOTIFY_LEASE_SECONDS)
+            claim_seconds.append(time.perf_counter() - claim_started)
+            if not claimed:
+                break
+            await dispatcher.dispatch(claimed)
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    snapshot = dispatcher.stats.snapshot()
+    claim_seconds.sort()
+    return {
+        "notifications": dispatcher.stats.sent,
+        "seconds": round(elapsed, 3),
+        "per_second": round(dispatcher.stats.sent / elapsed, 1) if elapsed else None,
+        "failed": dispatcher.stats.failed,
+        "send_ms": snapshot["send_ms"],
+        "claim_ms": {"p50": round(percentile(claim_seconds, 0.5) * 1000, 2),
+                     "p99": round(percentile(claim_seconds, 0.99) * 1000, 2)},
+        "bot_api": {"requests": api.requests, "delivered": api.delivered, "rejected": api.rejected},
+    }
+
+
+# ================= ЗАПУСК =================
+
+async def run(args):
+    local_pg = None
+    admin_url = args.database_url or os.getenv("DATABASE_URL")
+    if args.local_pg:
+        local_pg = LocalPostgres()
+        admin_url = local_pg.start()
+    if not admin_url:
+        raise SystemExit("Укажите --local-pg или --database-url (DATABASE_URL)")
+
+    # Во внешней базе все таблицы прогона - в отдельной схеме; приложение видит ее через search_path
+    url = admin_url if local_pg else make_conninfo(admin_url, options=f"-c search_path={SCHEMA}")
+    if not local_pg:
+        async with await psycopg.AsyncConnection.connect(admin_url, autocommit=True) as conn:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    os.environ.update(DATABASE_URL=url, STORAGE_BACKEND="postgres")
+    import app.postgres as db  # пул создается при импорте из DATABASE_URL
+
+    report = {
+        "meta": {
+            **git_revision(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("database_url", "out")},
+        },
+    }
+    try:
+        report["meta"]["postgres"] = await prepare_database(url, args)
+        await db.open_pool()
+        try:
+            if "api" in args.steps:
+                report["api"] = await bench_api(url, args)
+            if "rollover" in args.steps:
+                report["rollover"] = await bench_rollover()
+            if "notifications" in args.steps:
+                report["notifications"] = await bench_notifications(args)
+        finally:
+            await db.close_pool()
+    finally:
+        if local_pg:
+            local_pg.stop()
+        elif not args.keep:
+            async with await psycopg.AsyncConnection.connect(admin_url, autocommit=True) as conn:
+                await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--local-pg", action="store_true", help="поднять временный кластер Postgres")
+    parser.add_argument("--database-url", help="внешняя база (схема bench_suite)")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему bench_suite после прогона")
+    parser.add_argument("--out", help="файл отчета JSON (по умолчанию stdout)")
+    parser.add_argument("--steps", default="api,rollover,notifications")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tasks", type=int, default=200_000)
+    parser.add_argument("--habits", type=int, default=30_000)
+    parser.add_argument("--notifications", type=int, default=2_000)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на сценарий и уровень")
+    parser.add_argument("--levels", default="1,10,50", help="уровни параллельности клиентов")
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--bot-port", type=int, default=8766)
+    parser.add_argument("--bot-latency-ms", type=float, default=30.0)
+    # Лимит Telegram (30/c) отключен по умолчанию: меряем собственные накладные расходы
+    parser.add_argument("--notify-rate", type=float, default=1000.0)
+    parser.add_argument("--notify-concurrency", type=int, default=50)
+    args = parser.parse_args()
+    args.levels = [int(x) for x in args.levels.split(",")]
+    args.steps = args.steps.split(",")
+    return args
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Отчет: {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    main()
@@ -1,3 +1,31 @@
 import os
 
-TOKEN = os.getenv("BOT_TOKEN", "")
\ No newline at end of file
+TOKEN = os.getenv("BOT_TOKEN", "")
+
+# Адрес Bot API (пусто - api.telegram.org). Нужен для локального Bot API сервера или фейка в бенчмарках
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Хранилище: postgres (DATABASE_URL) или sqlite - встроенная база для локальных
+# прогонов и одноузлового режима (STORAGE_PATH, ":memory:" - в памяти процесса)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "taskenforcer.sqlite3")
+
+# Секрет служебных маршрутов API (рассылки), передается в заголовке X-Admin-Token.
+# Пусто - служебные маршруты закрыты
+ADMIN_SECRET = os.getenv("ADMIN_SECRET", "")
+
+# Пояс по умолчанию (для пользователей без указанного пояса)
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook через uvicorn-приложение API
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес сервиса (https://...), к нему добавляется WEBHOOK_PATH
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (одинаковый на всех репликах)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько апдейтов обрабатывается одновременно и сколько может ждать в очереди реплики
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 50))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 500))
+# Параллельных соединений Telegram к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
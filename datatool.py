@@ -0,0 +1,179 @@
+"""
+Выгрузка и загрузка данных через COPY: users, tasks, habits, scheduled_notifications
+в CSV или JSONL (по расширению файла, можно с .gz). Данные идут потоком, память
+не зависит от размера таблицы.
+
+    python datatool.py export tasks tasks.csv.gz
+    python datatool.py export users users.jsonl
+    python datatool.py import users users.jsonl --truncate
+    python datatool.py import tasks tasks.csv.gz
+
+Загружать users раньше habits (внешний ключ). Работающее приложение увидит
+загруженные данные после истечения кэша (CACHE_TTL_SECONDS).
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import sys
+import time
+
+import orjson
+import psycopg
+
+import app.postgres as db
+
+# Колонки, которые выгружаются и допускаются при загрузке
+TABLES = {
+    "users": ["id", "tg_id", "username", "created_at", "counttask", "count_habits", "count_complate_task",
+              "ratio_complate_habits", "days_tracked", "current_streak", "best_streak", "last_complete_day",
+              "timezone"],
+    "tasks": [c.strip() for c in db.TASK_COLUMNS.split(",")],
+    "habits": ["id", "user_id", "title", "is_complete_today", "count_complete", "created_at"],
+    "scheduled_notifications": [c.strip() for c in db.NOTIFICATION_COLUMNS.split(",")],
+}
+CHUNK_SIZE = 1 << 20
+
+
+def detect_format(path, explicit=None):
+    if explicit:
+        return explicit
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".jsonl") or name.endswith(".ndjson"):
+        return "jsonl"
+    raise SystemExit(f"Не удалось определить формат по имени {path}: укажите --format csv|jsonl")
+
+
+def open_file(path, mode):
+    if path == "-":
+        return sys.stdout.buffer if "w" in mode else sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def check_columns(table, columns):
+    unknown = [c for c in columns if c not in TABLES[table]]
+    if unknown:
+        raise SystemExit(f"Неизвестные колонки {table}: {', '.join(unknown)}")
+
+
+# ================= EXPORT =================
+
+async def export_table(conn, table, out, fmt):
+    columns = ", ".join(TABLES[table])
+    rows = 0
+    async with conn.cursor() as cur:
+        if fmt == "csv":
+            async with cur.copy(f"COPY {table} ({columns}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+                # libpq отдает COPY построчно: один блок - одна строка (первая - заголовок)
+                async for data in copy:
+                    out.write(data)
+                    rows += 1
+            rows -= 1
+        else:
+            query = f"COPY (SELECT row_to_json(t)::text FROM (SELECT {columns} FROM {table}) t) TO STDOUT"
+            async with cur.copy(query) as copy:
+                copy.set_types(["text"])
+                async for (line,) in copy.rows():
+                    out.write(line.encode("utf-8"))
+                    out.write(b"\n")
+                    rows += 1
+    return rows
+
+
+# ================= IMPORT =================
+
+async def import_csv(cur, table, src):
+    text = io.TextIOWrapper(src, encoding="utf-8", newline="")
+    header = next(csv.reader([text.readline()]))
+    check_columns(table, header)
+    async with cur.copy(f"COPY {table} ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)") as copy:
+        while chunk := text.read(CHUNK_SIZE):
+            await copy.write(chunk)
+    return cur.rowcount
+
+
+async def import_jsonl(cur, table, src):
+    lines = (line for line in src if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return 0
+    first = orjson.loads(first)
+    columns = list(first)
+    check_columns(table, columns)
+    async with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        await copy.write_row([first[c] for c in columns])
+        for line in lines:
+            record = orjson.loads(line)
+            await copy.write_row([record.get(c) for c in columns])
+    return cur.rowcount
+
+
+async def import_table(conn, table, src, fmt, truncate):
+    async with conn.transaction():
+        async with conn.cursor() as cur:
+            if truncate:
+                await cur.execute(f"TRUNCATE {table} CASCADE" if table == "users" else f"TRUNCATE {table}")
+            rows = await (import_csv if fmt == "csv" else import_jsonl)(cur, table, src)
+            # id загружены как есть - двигаем SERIAL, чтобы новые строки не конфликтовали
+            await cur.execute(f"""
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(max(id), 1), max(id) IS NOT NULL)
+                FROM {table}
+            """)
+            if table == "scheduled_notifications":
+                # Будим планировщики к ближайшему сроку загруженной очереди
+                await cur.execute(f"""
+                    SELECT pg_notify(%s, min(scheduled_time)::text) FROM {table}
+                    WHERE status IN ('pending', 'claimed')
+                    HAVING min(scheduled_time) IS NOT NULL
+                """, (db.NOTIFY_CHANNEL,))
+    await conn.execute(f"ANALYZE {table}")
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("table", choices=list(TABLES))
+    parser.add_argument("path", help="файл (.csv, .jsonl, можно .gz) или - для stdin/stdout")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--truncate", action="store_true",
+                        help="очистить таблицу перед загрузкой (для users - вместе с habits)")
+    args = parser.parse_args()
+    fmt = detect_format(args.path, args.format)
+
+    started = time.perf_counter()
+    conn = await psycopg.AsyncConnection.connect(db.DATABASE_URL, autocommit=True, connect_timeout=10)
+    try:
+        if args.command == "export":
+            out = open_file(args.path, "wb")
+            try:
+                rows = await export_table(conn, args.table, out, fmt)
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+        else:
+            src = open_file(args.path, "rb")
+            try:
+                rows = await import_table(conn, args.table, src, fmt, args.truncate)
+            finally:
+                if src is not sys.stdin.buffer:
+                    src.close()
+    finally:
+        await conn.close()
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"{args.command} {args.table} ({fmt}): {rows} строк за {elapsed:.1f} c "
+                 f"({rows / elapsed if elapsed else 0:.0f} строк/с)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -1,61 +1,185 @@
 import asyncio
+import contextlib
 import logging
 import os 
+import signal
+import socket
+import sys
+import time
+# Отсчет времени запуска - до импорта aiogram, FastAPI и драйвера БД
+PROCESS_STARTED = time.perf_counter()
 import uvicorn
 from aiogram import Bot, Dispatcher
-from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo  # Важно: используем zoneinfo вместо pytz
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from datetime import datetime, timedelta, time as dt_time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError  # Важно: используем zoneinfo вместо pytz
 
 
-from app.database import init_db, reset_daily_habits, delete_completed_tasks, update_daily_user_stats, get_pending_notifications, mark_notification_sent
-from config import TOKEN
+from app.database import (open_pool, close_pool, migrate, run_daily_rollover, get_last_rollover_dates,
+                          get_user_timezones, claim_notifications, archive_old_rows)
+from config import (TOKEN, TELEGRAM_API_URL, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                    WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING, WEBHOOK_MAX_CONNECTIONS)
 from app.handlers import router
 from app.myapi import app 
+from app.metrics import BotMetricsMiddleware, observe_archive, observe_rollover
+from app.webhook import WebhookHandler
+from app.lifecycle import lifecycle, SHUTDOWN_TIMEOUT_SECONDS
+from app.notifier import NotificationDispatcher, NotificationScheduler, moscow_now, NOTIFY_CLAIM_BATCH, NOTIFY_LEASE_SECONDS
 from datetime import timezone
 
 # Определяем часовые пояса
 SERVER_TZ = ZoneInfo("America/Los_Angeles")  # Пояс сервера (Калифорния)
 USER_TZ = ZoneInfo("Europe/Moscow")          # Пояс пользователей (Москва)
 
+def create_bot():
+    """Bot с адресом Bot API из TELEGRAM_API_URL (локальный сервер или фейк для нагрузочных тестов)."""
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        return Bot(token=TOKEN, session=session)
+    return Bot(token=TOKEN)
+
 async def start_bot(bot, dp):
+    """Регистрирует обработчики и подключает бота: вебхук или сброс вебхука перед polling."""
+    dp.update.outer_middleware(BotMetricsMiddleware())
     dp.include_router(router)
-    await bot.delete_webhook(drop_pending_updates=True) 
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        await start_webhook(bot, dp)
+        return
+    await lifecycle.step("bot", lambda: bot.delete_webhook(drop_pending_updates=True))
+
+async def start_webhook(bot, dp):
+    """
+    Апдейты приходят POST-запросами на WEBHOOK_PATH того же uvicorn-приложения,
+    поэтому бот масштабируется вместе с репликами API. set_webhook идемпотентен:
+    все реплики регистрируют один и тот же адрес.
+    """
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("BOT_MODE=webhook требует WEBHOOK_BASE_URL")
+    app.state.webhook = WebhookHandler(bot, dp, WEBHOOK_SECRET, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING)
+    url = WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
+    await lifecycle.step("bot", lambda: bot.set_webhook(
+        url,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    ))
+    logging.info(f"Вебхук бота: {url}")
+
+# Пересчет идет в местные 23:58 каждого пояса пачкой по его пользователям -
+# нагрузка распределена по суткам, а не одним пиком в 23:58 по Москве
+ROLLOVER_HOUR, ROLLOVER_MINUTE = 23, 58
+# Как часто перечитывать список поясов (новый пользователь из нового пояса), сек
+ROLLOVER_RESCAN_SECONDS = float(os.getenv("ROLLOVER_RESCAN_SECONDS", 600))
+
+def rollover_moment(day, tz_name):
+    """Момент пересчета за day в поясе tz_name (aware datetime)."""
+    return datetime.combine(day, dt_time(ROLLOVER_HOUR, ROLLOVER_MINUTE), tzinfo=ZoneInfo(tz_name))
+
+def rollover_due_date(tz_name, now_utc):
+    """Последний день, чьи 23:58 в поясе tz_name уже наступили."""
+    local_now = now_utc.astimezone(ZoneInfo(tz_name))
+    due_date = local_now.date()
+    if (local_now.hour, local_now.minute) < (ROLLOVER_HOUR, ROLLOVER_MINUTE):
+        due_date -= timedelta(days=1)
+    return due_date
+
+async def run_rollover(run_date, tz_name):
+    """Запускает ночной пересчет за run_date для пояса и логирует длительность фаз."""
+    logging.info(f"Начало ежедневного обновления данных за {run_date} ({tz_name})...")
+    started = time.perf_counter()
+    timings = await run_daily_rollover(run_date, tz_name)
+    if timings is None:
+        logging.info(f"Обновление за {run_date} ({tz_name}) уже выполнено, пропускаем")
+        return
+    observe_rollover(timings)
+    phases = ", ".join(f"{name}: {t['seconds']:.3f} c ({t['rows']} строк)" for name, t in timings.items())
+    logging.info(f"Ежедневное обновление за {run_date} ({tz_name}) завершено за {time.perf_counter() - started:.3f} c [{phases}]")
+
+async def run_due_rollovers(started_at):
+    """
+    Выполняет пересчет для каждого пояса, у которого наступили 23:58 и день еще
+    не обработан. Пропущенные дни (рестарт) догоняются одним пересчетом за последний
+    наступивший день: состояние задач/привычек - снимок на текущий момент.
+    Пояс без истории впервые пересчитывается в свои 23:58 после старта, не задним числом.
+    Возвращает список поясов для расчета следующего пробуждения.
+    """
+    now_utc = datetime.now(timezone.utc)
+    zones = []
+    for tz_name in await get_user_timezones():
+        try:
+            ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            logging.error(f"Неизвестный часовой пояс пользователей: {tz_name!r}, пересчет пропущен")
+            continue
+        zones.append(tz_name)
+    last_dates = await get_last_rollover_dates()
+    for tz_name in zones:
+        if lifecycle.stopping.is_set():
+            break
+        due_date = rollover_due_date(tz_name, now_utc)
+        last_date = last_dates.get(tz_name)
+        if last_date is None:
+            if rollover_moment(due_date, tz_name) < started_at:
+                continue
+        elif last_date >= due_date:
+            continue
+        elif (due_date - last_date).days > 1:
+            logging.warning(f"Пропущено ночных пересчетов ({tz_name}): {(due_date - last_date).days - 1}, "
+                            f"последний {last_date}, выполняем за {due_date}")
+        try:
+            await run_rollover(due_date, tz_name)
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении данных ({tz_name}): {e}")
+    return zones
 
 async def schedule_daily_reset():
-    """Запуск процесса в 23:58 по московскому времени."""
+    """Пересчет в 23:58 по местному времени каждого пояса пользователей."""
+    started_at = datetime.now(timezone.utc)
+    while not lifecycle.stopping.is_set():
+        try:
+            zones = await run_due_rollovers(started_at)
+        except Exception as e:
+            logging.error(f"Ошибка планировщика пересчета: {e}")
+            zones = []
+
+        now_utc = datetime.now(timezone.utc)
+        wait_seconds = ROLLOVER_RESCAN_SECONDS
+        for tz_name in zones:
+            next_moment = rollover_moment(rollover_due_date(tz_name, now_utc) + timedelta(days=1), tz_name)
+            wait_seconds = min(wait_seconds, (next_moment - now_utc).total_seconds())
+        # +1 c: проснуться уже после 23:58:00, а не за мгновение до
+        await lifecycle.sleep(wait_seconds + 1)
+
+# Архивация - ночью, когда нагрузка минимальна и пересчет в 23:58 уже прошел
+ARCHIVE_HOUR = int(os.getenv("ARCHIVE_HOUR", 4))
+ARCHIVE_MINUTE = int(os.getenv("ARCHIVE_MINUTE", 30))
+
+async def run_archive():
+    """Переносит старые строки в таблицы истории и логирует отчет."""
+    report = await archive_old_rows()
+    observe_archive(report)
+    moved = ", ".join(
+        f"{name}: {report[name]['rows']} строк за {report[name]['batches']} пачек ({report[name]['seconds']:.3f} c)"
+        for name in ("notifications", "tasks")
+    )
+    logging.info(f"Архивация завершена [{moved}]")
+
+async def schedule_archive():
+    """Ежедневная архивация в ARCHIVE_HOUR:ARCHIVE_MINUTE по московскому времени."""
     while True:
-        utc_now = datetime.now(timezone.utc)
-        moscow_now = utc_now.astimezone(USER_TZ)
-        
-        # Целевое время 23:58
-        target_time = moscow_now.replace(hour=23, minute=58, second=0, microsecond=0)
-        
+        moscow_now = datetime.now(timezone.utc).astimezone(USER_TZ)
+        target_time = moscow_now.replace(hour=ARCHIVE_HOUR, minute=ARCHIVE_MINUTE, second=0, microsecond=0)
         if moscow_now >= target_time:
             target_time += timedelta(days=1)
-        
-        wait_seconds = (target_time - moscow_now).total_seconds()
-        logging.info(f"Следующее обновление статистики через {wait_seconds/3600:.2f} часов")
-        await asyncio.sleep(wait_seconds)
-        
+        if await lifecycle.sleep((target_time - moscow_now).total_seconds()):
+            return
         try:
-            logging.info("Начало ежедневного обновления данных...")
-            # ПОРЯДОК ВАЖЕН:
-            # 1. Сначала считаем статистику по текущим выполненным делам
-            update_daily_user_stats()
-            
-            # 2. Обновляем счетчики привычек и сбрасываем флаги выполнения
-            reset_daily_habits()
-            
-            # 3. Удаляем выполненные задачи
-            delete_completed_tasks()
-            
-            logging.info("Ежедневное обновление успешно завершено")
+            await run_archive()
         except Exception as e:
-            logging.error(f"Ошибка при обновлении данных: {e}")
-        
-        # Спим минуту, чтобы не сработало повторно в ту же секунду
-        await asyncio.sleep(60)
+            logging.error(f"Ошибка архивации: {e}")
+        if await lifecycle.sleep(60):
+            return
 
 async def get_moscow_time():
     """Вспомогательная функция для получения текущего московского времени"""
@@ -71,77 +195,180 @@ async def get_server_time():
 
 
 async def notification_worker(bot: Bot):
-    """Каждые 60 секунд проверяет базу и отправляет сообщения через API Telegram"""
-    logging.info("Воркер уведомлений запущен")
-    while True:
-        try:
-            pending = get_pending_notifications()
-            for note in pending:
-                u_id = note['user_id']
-                text = note['message_text']
-                f_id = note['file_id']
-                m_type = note['media_type']
-                
-                try:
-                    # Взаимодействие с API Telegram через aiogram
-                    if m_type == 'photo':
-                        await bot.send_photo(u_id, photo=f_id, caption=text)
-                    elif m_type == 'video':
-                        await bot.send_video(u_id, video=f_id, caption=text)
-                    elif m_type == 'voice':
-                        await bot.send_voice(u_id, voice=f_id, caption=text)
-                    else:
-                        await bot.send_message(u_id, text=text)
-                    
-                    mark_notification_sent(note['id'])
-                    logging.info(f"Успешно отправлено уведомление пользователю {u_id}")
-                except Exception as send_error:
-                    logging.error(f"Ошибка отправки пользователю {u_id}: {send_error}")
-        except Exception as e:
-            logging.error(f"Ошибка воркера: {e}")
-            
-        await asyncio.sleep(60)
+    """
+    Рассылает уведомления точно в срок: спит до ближайшего scheduled_time из таймера
+    (пополняется через LISTEN/NOTIFY) и только тогда идет в базу за наступившими.
+    При остановке новые пачки не захватываются, текущая доотправляется и отмечается.
+    """
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    logging.info(f"Воркер уведомлений {worker_id} запущен")
+    scheduler = NotificationScheduler()
+    dispatcher = NotificationDispatcher(bot, scheduler=scheduler)
+    listener = asyncio.create_task(scheduler.listen())
+    try:
+        while True:
+            try:
+                await scheduler.load()
+                break
+            except Exception as e:
+                logging.error(f"Не удалось загрузить таймер уведомлений: {e}")
+                if await lifecycle.sleep(10):
+                    return
+
+        while not lifecycle.stopping.is_set():
+            try:
+                due = await lifecycle.wait(scheduler.wait_due())
+                if lifecycle.stopping.is_set():
+                    break
+                if not due:
+                    # Страховка: перечитываем сроки и добираем то, что могли пропустить
+                    await scheduler.load()
+                now = moscow_now()
+                # Забираем очередь порциями, пока есть наступившие; другие реплики
+                # параллельно захватывают другие строки (SKIP LOCKED)
+                while not lifecycle.stopping.is_set():
+                    claimed = await claim_notifications(worker_id, NOTIFY_CLAIM_BATCH, NOTIFY_LEASE_SECONDS)
+                    if not claimed:
+                        break
+                    await dispatcher.dispatch(claimed)
+                scheduler.pop_due(now)
+                await scheduler.refill_if_needed()
+            except Exception as e:
+                logging.error(f"Ошибка воркера: {e}")
+                await lifecycle.sleep(10)
+    finally:
+        listener.cancel()
+    logging.info(f"Воркер уведомлений {worker_id} остановлен")
+
+
+async def wait_until_bound(server, server_task):
+    """Ждет, пока uvicorn займет порт; ошибка запуска сервера (порт занят) - наружу."""
+    while not server.started:
+        if server_task.done():
+            server_task.result()
+            raise RuntimeError("HTTP-сервер остановился при запуске")
+        await asyncio.sleep(0.01)
+
+async def startup(dp):
+    """
+    Фоновая инициализация после bind: хранилище и миграции (с повтором, пока база
+    не ответит), затем ночные задачи, бот и воркер уведомлений. Неверная настройка
+    бота (токен) не останавливает API - шаг помечается failed в /health/ready.
+    """
+    # Открываем хранилище (STORAGE_BACKEND) и применяем недостающие миграции схемы
+    await lifecycle.step("storage", open_pool)
+    await lifecycle.step("migrations", migrate)
+    if lifecycle.stopping.is_set():
+        return
+    lifecycle.mark_ready()
 
+    lifecycle.spawn("rollover", schedule_daily_reset())
+    lifecycle.spawn("archive", schedule_archive())
 
+    try:
+        bot = await lifecycle.step("bot_config", create_bot, retry=False)
+    except Exception as e:
+        logging.error(f"Бот не запущен: {e}")
+        return
+    app.state.bot = bot
+    lifecycle.spawn("notifications", notification_worker(bot))    # ОТПРАВКА УВЕДОМЛЕНИЙ
+    await start_bot(bot, dp)
+    logging.info(f"Запуск завершен за {lifecycle.uptime():.3f} c [{lifecycle.breakdown()}]")
+    if BOT_MODE != "webhook" and not lifecycle.stopping.is_set():
+        # Сигналы обрабатывает run.py (request_shutdown), сессию бота закрывает shutdown()
+        await dp.start_polling(bot, handle_signals=False, close_bot_session=False)
 
+async def stop_polling(dp):
+    try:
+        await dp.stop_polling()
+    except RuntimeError:
+        pass  # polling не запущен (режим webhook или бот не стартовал)
 
+def request_shutdown(server, dp):
+    """
+    SIGTERM/SIGINT: снимаем готовность, перестаем брать новую работу (HTTP-соединения,
+    апдейты бота, пачки уведомлений, ночные задачи), текущую доделываем.
+    """
+    if lifecycle.stopping.is_set():
+        return
+    logging.info(f"Остановка: новые запросы и задачи не принимаются, срок {SHUTDOWN_TIMEOUT_SECONDS:g} c")
+    lifecycle.request_stop()
+    server.should_exit = True
+    asyncio.create_task(stop_polling(dp))
 
+async def shutdown(dp):
+    """
+    После остановки HTTP-сервера: ждем фоновые задачи и апдейты вебхука до срока,
+    незавершенные отменяем (транзакция откатится, захваченные уведомления вернутся
+    в очередь по истечении аренды), затем закрываем сессию бота и хранилище.
+    """
+    lifecycle.request_stop()
+    await stop_polling(dp)
+    webhook = getattr(app.state, "webhook", None)
+    pending, _ = await asyncio.gather(
+        lifecycle.drain(),
+        webhook.drain(timeout=lifecycle.remaining()) if webhook else asyncio.sleep(0),
+    )
+    if pending:
+        logging.warning(f"Не завершились за {SHUTDOWN_TIMEOUT_SECONDS:g} c и отменены: {', '.join(pending)}")
+    if webhook and webhook.pending:
+        logging.warning(f"Не обработано апдейтов вебхука: {webhook.pending}")
+
+    bot = getattr(app.state, "bot", None)
+    if bot is not None:
+        await bot.session.close()
+    await close_pool()
+    logging.info("Остановка завершена")
 
 async def main():
-    # Инициализация структуры БД при запуске
-    init_db()
-    
-    bot = Bot(token=TOKEN)
-    dp = Dispatcher()
-    
+    lifecycle.started = PROCESS_STARTED
+    lifecycle.record("imports", time.perf_counter() - PROCESS_STARTED)
+
     # Получаем порт от Railway
     port = int(os.environ.get("PORT", 8000))
-    
+
+    # Сервер поднимается первым: /health отвечает, пока база и бот запускаются в фоне.
+    # timeout_graceful_shutdown - сколько ждать текущие HTTP-запросы при остановке
+    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info",
+                            timeout_graceful_shutdown=SHUTDOWN_TIMEOUT_SECONDS)
+    server = uvicorn.Server(config)
+    dp = Dispatcher()
+    loop = asyncio.get_running_loop()
+    try:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, request_shutdown, server, dp)
+    except NotImplementedError:
+        pass  # Windows: сигналы обрабатывает сам uvicorn, остановка - через shutdown()
+    else:
+        # Сигналы целиком на request_shutdown: uvicorn иначе ставит свои обработчики на
+        # время serve() и на выходе возвращает стандартные - повторный SIGTERM во время
+        # drain() убил бы процесс, не дождавшись фоновых задач
+        server.capture_signals = contextlib.nullcontext
+    server_task = asyncio.create_task(server.serve())
+    await lifecycle.step("http_bind", lambda: wait_until_bound(server, server_task), retry=False)
+    logging.info(f"Сервер запущен на порту {port} через {lifecycle.uptime():.3f} c после старта")
+
     # Логируем информацию о времени
     server_time = await get_server_time()
     moscow_time = await get_moscow_time()
     logging.info(f"Время на сервере (Калифорния): {server_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
     logging.info(f"Время для пользователей (Москва): {moscow_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
     logging.info(f"Разница во времени: {(moscow_time - server_time).total_seconds()/3600:.1f} часов")
-    
-    # Запускаем бота и планировщик как фоновые задачи
-    bot_task = asyncio.create_task(start_bot(bot, dp))
-    asyncio.create_task(schedule_daily_reset())
-    asyncio.create_task(notification_worker(bot))    # ОТПРАВКА УВЕДОМЛЕНИЙ
-
-    # Настройка и запуск API сервера
-    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info")
-    server = uvicorn.Server(config)
-    
-    logging.info(f"Сервер запущен на порту {port}")
-    await server.serve()
-    await bot_task
+
+    lifecycle.spawn("startup", startup(dp))
+    try:
+        await server_task
+    finally:
+        await shutdown(dp)
 
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
+    # psycopg AsyncConnection не работает с ProactorEventLoop (Windows)
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
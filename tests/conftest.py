@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# Тесты запускаются из корня репозитория без установки пакета; хранилище - встроенное,
+# чтобы импорт app.database не требовал DATABASE_URL
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("STORAGE_PATH", ":memory:")
@@ -0,0 +1,44 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("aiogram")
+
+from fastapi import HTTPException  # noqa: E402
+from pydantic import ValidationError  # noqa: E402
+
+import app.database as db  # noqa: E402
+import app.myapi as myapi  # noqa: E402
+
+
+def call_batch(user_id, operations, create_user=True):
+    async def scenario():
+        await db.open_pool()
+        try:
+            await db.migrate()
+            if create_user:
+                await db.add_user(user_id, "batch")
+            request = myapi.BatchRequest(user_id=user_id, operations=operations)
+            return await myapi.api_batch(request)
+        finally:
+            await db.close_pool()
+    return asyncio.run(scenario())
+
+
+def test_malformed_date_is_validation_error():
+    with pytest.raises(ValidationError):
+        myapi.BatchOperation(op="task.add", title="t", date="2026-13-40")
+    assert myapi.BatchOperation(op="task.add", title="t", date="2026-10-18").date == date(2026, 10, 18)
+
+
+def test_applies_task_with_date():
+    result = call_batch(7, [{"op": "task.add", "title": "t", "date": "2026-10-18"}])
+    assert result == {"status": "ok", "applied": {"task.add": 1}}
+
+
+def test_unknown_user_is_not_found():
+    with pytest.raises(HTTPException) as exc:
+        call_batch(8, [{"op": "habit.add", "title": "h"}], create_user=False)
+    assert exc.value.status_code == 404
@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # noqa: E402
+
+import app.myapi as myapi  # noqa: E402
+
+
+def test_rejects_wrong_token(monkeypatch):
+    monkeypatch.setattr(myapi, "ADMIN_SECRET", "s3cret")
+    with pytest.raises(HTTPException) as exc:
+        myapi.require_admin(x_admin_token="wrong")
+    assert exc.value.status_code == 401
+
+
+def test_rejects_non_ascii_token(monkeypatch):
+    monkeypatch.setattr(myapi, "ADMIN_SECRET", "s3cret")
+    with pytest.raises(HTTPException) as exc:
+        myapi.require_admin(x_admin_token="сЕкрет")
+    assert exc.value.status_code == 401
+
+
+def test_closed_without_secret(monkeypatch):
+    monkeypatch.setattr(myapi, "ADMIN_SECRET", "")
+    with pytest.raises(HTTPException) as exc:
+        myapi.require_admin(x_admin_token="")
+    assert exc.value.status_code == 403
+
+
+def test_accepts_matching_token(monkeypatch):
+    monkeypatch.setattr(myapi, "ADMIN_SECRET", "s3cret")
+    myapi.require_admin(x_admin_token="s3cret")
+
+
+def test_routes_require_admin():
+    guarded = {route.path for route in myapi.app.routes
+               if getattr(route, "dependant", None) is not None
+               and any(dep.call is myapi.require_admin for dep in route.dependant.dependencies)}
+    assert {"/api/broadcasts", "/api/broadcasts/{broadcast_id}"} <= guarded
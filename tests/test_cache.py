@@ -0,0 +1,34 @@
+from app.cache import MISSING, UserCache
+
+
+def test_versions_bounded_by_max_entries():
+    cache = UserCache(max_entries=100, ttl=60)
+    for user_id in range(10_000):
+        version = cache.version(user_id)
+        cache.set(("tasks", user_id, None), [user_id], version)
+        cache.invalidate_user(user_id)
+    assert len(cache._versions) <= cache.max_entries
+    assert len(cache._data) <= cache.max_entries
+
+
+def test_stale_read_rejected_after_version_evicted():
+    cache = UserCache(max_entries=2, ttl=60)
+    version = cache.version(1)          # чтение из БД началось
+    cache.invalidate_user(1)            # запись пользователя 1
+    for user_id in range(2, 10):        # версия пользователя 1 вытеснена
+        cache.invalidate_user(user_id)
+    assert 1 not in cache._versions
+    cache.set(("tasks", 1, None), ["stale"], version)
+    assert cache.get(("tasks", 1, None)) is MISSING
+
+
+def test_set_and_invalidate():
+    cache = UserCache(max_entries=10, ttl=60)
+    key = ("habits", 7)
+    cache.set(key, ["h"], cache.version(7))
+    assert cache.get(key) == ["h"]
+    version = cache.version(7)
+    cache.invalidate_user(7)
+    assert cache.get(key) is MISSING
+    cache.set(key, ["old"], version)
+    assert cache.get(key) is MISSING
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("prometheus_client")
+
+import app.sqlite_storage as db  # noqa: E402
+
+DAY = date(2026, 10, 17)
+
+
+async def user_row(tg_id):
+    return await db._fetchone(
+        "SELECT days_tracked, current_streak, last_complete_day, last_rollover_date FROM users WHERE tg_id = ?",
+        (tg_id,))
+
+
+async def complete_day(tg_id, day):
+    """Одна привычка и одна задача на day, обе выполнены."""
+    for habit in await db.get_user_habits(tg_id):
+        await db.toggle_habit_status(habit["id"])
+    await db.add_task(tg_id, "task", day)
+    for task in await db.get_user_tasks(tg_id, str(day)):
+        await db.toggle_task_status(task["id"])
+
+
+def run(scenario):
+    async def wrapper():
+        await db.open_pool()
+        try:
+            await db.migrate()
+            await scenario()
+        finally:
+            await db.close_pool()
+    asyncio.run(wrapper())
+
+
+def test_travel_west_does_not_roll_over_twice():
+    async def scenario():
+        await db.add_user(1, "u", "Europe/Moscow")
+        await db.add_habit(1, "habit")
+        await complete_day(1, DAY)
+        await db.run_daily_rollover(DAY, "Europe/Moscow")
+        before = await user_row(1)
+        assert (before["days_tracked"], before["current_streak"]) == (1, 1)
+
+        await db.set_user_timezone(1, "America/New_York")
+        timings = await db.run_daily_rollover(DAY, "America/New_York")
+        assert timings["mark_users"]["rows"] == 0
+        assert await user_row(1) == before
+        stats = await db._fetchone("SELECT habits_done, tasks_done FROM user_daily_stats WHERE user_id = 1")
+        assert (stats["habits_done"], stats["tasks_done"]) == (1, 1)
+    run(scenario)
+
+
+def test_travel_east_keeps_streak_over_skipped_day():
+    async def scenario():
+        await db.add_user(2, "u", "America/New_York")
+        await db.add_habit(2, "habit")
+        await complete_day(2, DAY)
+        await db.run_daily_rollover(DAY, "America/New_York")
+        # Токио уже пересчитал следующий день, когда пользователь туда прилетел
+        await db.run_daily_rollover(DAY + timedelta(days=1), "Asia/Tokyo")
+        await db.set_user_timezone(2, "Asia/Tokyo")
+        await complete_day(2, DAY + timedelta(days=2))
+        await db.run_daily_rollover(DAY + timedelta(days=2), "Asia/Tokyo")
+        row = await user_row(2)
+        assert row["current_streak"] == 2
+        assert row["last_rollover_date"] == DAY + timedelta(days=2)
+    run(scenario)
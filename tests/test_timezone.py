@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from pydantic import ValidationError  # noqa: E402
+
+import app.myapi as myapi  # noqa: E402
+
+
+def test_registration_drops_unknown_timezone():
+    user = myapi.UserRegistration(tg_id=1, name="a", timezone="Mars/Olympus_Mons")
+    assert user.timezone is None
+
+
+def test_registration_keeps_known_timezone():
+    user = myapi.UserRegistration(tg_id=1, name="a", timezone="Asia/Tokyo")
+    assert user.timezone == "Asia/Tokyo"
+
+
+def test_timezone_update_rejects_unknown_timezone():
+    with pytest.raises(ValidationError):
+        myapi.TimezoneUpdate(timezone="Mars/Olympus_Mons")
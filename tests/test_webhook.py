@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("fastapi")
+
+from fastapi import Request  # noqa: E402
+
+from app.webhook import SECRET_HEADER, WebhookHandler  # noqa: E402
+
+
+def make_request(token: bytes):
+    return Request({"type": "http", "method": "POST", "path": "/telegram/webhook",
+                    "headers": [(SECRET_HEADER.lower().encode(), token)]})
+
+
+def handle(token: bytes):
+    handler = WebhookHandler(bot=None, dp=None, secret="s3cret", concurrency=1, max_pending=1)
+    return asyncio.run(handler.handle(make_request(token)))
+
+
+def test_wrong_secret_rejected():
+    assert handle(b"wrong").status_code == 401
+
+
+def test_non_ascii_secret_rejected():
+    assert handle("сЕкрет".encode()).status_code == 401
@@ -13,6 +13,14 @@ let selectedItem = null; // { id, type, title }
 let isSaving = false;
 let calendarDate = new Date(); // Месяц, который смотрим
 let selectedDate = new Date(); // Конкретный день
+let calendarTasks = {};        // Задачи месяца календаря: { 'YYYY-MM-DD': [task, ...] }
+let calendarMonthKey = null;   // Какой месяц загружен в calendarTasks
+let pendingOps = [];           // Очередь изменений для /api/batch
+let flushTimer = null;
+const FLUSH_DELAY_MS = 800;
+const RETRY_MIN_MS = 2000;      // Повтор после сбоя сети/5xx: 2с, 4с, ... до минуты
+const RETRY_MAX_MS = 60000;
+let retryDelay = RETRY_MIN_MS;
 
 (async function init() {
     tg?.ready();
@@ -22,7 +30,12 @@ let selectedDate = new Date(); // Конкретный день
         await fetch(`${API_BASE_URL}/api/register`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ tg_id: userId, name: userName })
+            body: JSON.stringify({
+                tg_id: userId,
+                name: userName,
+                // Ночной пересчет идет в 23:58 по поясу устройства
+                timezone: Intl.DateTimeFormat().resolvedOptions().timeZone || null
+            })
         });
         refreshData();
     } catch (e) { showMessage("Ошибка подключения"); }
@@ -45,14 +58,82 @@ function switchTab(tab) {
     refreshData();
 }
 
+// Локальная дата в формате YYYY-MM-DD (toISOString сдвигает дату в UTC)
+function toDateKey(d) {
+    const pad = n => String(n).padStart(2, '0');
+    return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}`;
+}
+
+// --- ОЧЕРЕДЬ ИЗМЕНЕНИЙ ---
+// Отметки копятся и уходят одним запросом /api/batch (одна транзакция на сервере)
+function queueOp(op) {
+    pendingOps.push(op);
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(() => flushOps().then(refreshData), FLUSH_DELAY_MS);
+}
+
+// Повторная отправка очереди с растущей задержкой. Новая отметка (queueOp)
+// сбрасывает таймер и уходит раньше; после успешной отправки обновляем экран
+function scheduleRetry() {
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(() => flushOps().then(() => {
+        if (!pendingOps.length) refreshData();
+    }), retryDelay);
+    retryDelay = Math.min(retryDelay * 2, RETRY_MAX_MS);
+}
+
+async function flushOps() {
+    clearTimeout(flushTimer);
+    if (!pendingOps.length) return;
+    const operations = pendingOps;
+    pendingOps = [];
+    let res;
+    try {
+        res = await fetch(`${API_BASE_URL}/api/batch`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ user_id: userId, operations }),
+            keepalive: true // запрос дойдет, даже если Mini App закрывают
+        });
+    } catch (e) {
+        pendingOps = operations.concat(pendingOps);
+        console.error("Ошибка отправки изменений:", e);
+        showMessage("Нет связи с сервером, изменения будут отправлены повторно");
+        scheduleRetry();
+        return;
+    }
+    if (res.ok) {
+        retryDelay = RETRY_MIN_MS;
+        return;
+    }
+    // 4xx (кроме 408 и 429) - пачку сервер не примет и при повторе; 5xx и 503 при запуске - повторяем
+    const permanent = res.status >= 400 && res.status < 500 && res.status !== 408 && res.status !== 429;
+    if (!permanent) {
+        pendingOps = operations.concat(pendingOps);
+        scheduleRetry();
+    }
+    console.error(`Ошибка отправки изменений: HTTP ${res.status}`, await res.text().catch(() => ""));
+    showMessage(permanent
+        ? "Не удалось сохранить изменения"
+        : "Сервер недоступен, изменения будут отправлены повторно");
+}
+
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') flushOps();
+});
+
 async function refreshData() {
+    await flushOps(); // сначала отправляем накопленное, чтобы не перерисовать старое состояние
     try {
-        const [tRes, hRes] = await Promise.all([
-            fetch(`${API_BASE_URL}/api/tasks/${userId}`),
-            fetch(`${API_BASE_URL}/api/habits/${userId}`)
-        ]);
-        renderLists(await tRes.json(), await hRes.json());
+        // Задачи, привычки и счетчики одним запросом
+        const res = await fetch(`${API_BASE_URL}/api/dashboard/${userId}`);
+        const data = await res.json();
+        renderLists(data.tasks, data.habits);
     } catch (e) { console.error(e); }
+    if (currentTab === 'calendar') {
+        calendarMonthKey = null;
+        if (!document.getElementById('calendar-week-view').classList.contains('hidden')) fetchCalendarTasks();
+    }
 }
 
 function renderLists(tasks, habits) {
@@ -114,20 +195,14 @@ function closeEditModal() { document.getElementById('edit-modal').style.display
 async function handleUpdate() {
     const val = document.getElementById('edit-input').value.trim();
     if (!val || !selectedItem) return;
-    const path = selectedItem.type === 'task' ? `/api/tasks/update/${selectedItem.id}` : `/api/habits/update/${selectedItem.id}`;
-    await fetch(`${API_BASE_URL}${path}`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ title: val })
-    });
+    queueOp({ op: `${selectedItem.type}.update`, id: selectedItem.id, title: val });
     closeEditModal();
     refreshData();
 }
 
 async function confirmDelete() {
     if (!selectedItem) return;
-    const path = selectedItem.type === 'task' ? `/api/tasks/${selectedItem.id}` : `/api/habits/${selectedItem.id}`;
-    await fetch(`${API_BASE_URL}${path}`, { method: "DELETE" });
+    queueOp({ op: `${selectedItem.type}.delete`, id: selectedItem.id });
     closeContextModal();
     refreshData();
 }
@@ -156,8 +231,8 @@ async function handleSave() {
     
     // Определяем дату
     const taskDate = (currentTab === 'calendar') 
-        ? selectedDate.toISOString().split('T')[0] 
-        : new Date().toISOString().split('T')[0];
+        ? toDateKey(selectedDate) 
+        : toDateKey(new Date());
 
 
     const body = { 
@@ -183,16 +258,15 @@ async function handleSave() {
     }
 }
 
-async function toggleTask(id) {
-    await fetch(`${API_BASE_URL}/api/tasks/toggle/${id}`, { method: "POST" });
+// Чекбокс уже переключен в интерфейсе, на сервер изменение уйдет пачкой
+function toggleTask(id) {
+    queueOp({ op: 'task.toggle', id });
     tg?.HapticFeedback?.impactOccurred("light");
-    refreshData();
 }
 
-async function toggleHabit(id) {
-    await fetch(`${API_BASE_URL}/api/habits/toggle/${id}`, { method: "POST" });
+function toggleHabit(id) {
+    queueOp({ op: 'habit.toggle', id });
     tg?.HapticFeedback?.notificationOccurred("success");
-    refreshData();
 }
 
 function showMessage(msg) {
@@ -206,6 +280,7 @@ function showMessage(msg) {
 // --- ЛОГИКА КАЛЕНДАРЯ ---
 
 function renderCalendar() {
+    loadCalendarMonth(calendarDate).catch(console.error);
     const grid = document.getElementById('calendar-grid-days');
     const title = document.getElementById('calendar-month-title');
     grid.innerHTML = '';
@@ -276,10 +351,26 @@ async function setSpecificDay(dateStr) {
     renderWeekView();
 }
 
-async function fetchCalendarTasks() {
-    const dateStr = selectedDate.toISOString().split('T')[0];
-    const res = await fetch(`${API_BASE_URL}/api/tasks/${userId}?date=${dateStr}`);
+// Весь месяц задач одним запросом; дни берутся из calendarTasks без обращения к серверу
+async function loadCalendarMonth(date) {
+    const year = date.getFullYear();
+    const month = date.getMonth();
+    const key = `${year}-${month}`;
+    if (calendarMonthKey === key) return;
+
+    const start = toDateKey(new Date(year, month, 1));
+    const end = toDateKey(new Date(year, month + 1, 0));
+    const res = await fetch(`${API_BASE_URL}/api/tasks/${userId}/range?start=${start}&end=${end}`);
     const tasks = await res.json();
+
+    calendarTasks = {};
+    tasks.forEach(t => (calendarTasks[t.task_date] = calendarTasks[t.task_date] || []).push(t));
+    calendarMonthKey = key;
+}
+
+async function fetchCalendarTasks() {
+    await loadCalendarMonth(selectedDate);
+    const tasks = calendarTasks[toDateKey(selectedDate)] || [];
     const container = document.getElementById('list-calendar-tasks');
     
     container.innerHTML = tasks.length ? '' : '<div class="p-8 text-center text-zinc-600 text-xs uppercase tracking-widest font-bold">Задач нет</div>';